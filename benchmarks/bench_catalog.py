@@ -0,0 +1,86 @@
+"""
+本地食物目录的微基准测试
+
+用合成的食物目录对比旧的备用选择方式（每次合并所有列表、过滤后随机抽样）
+与 FoodCatalog 按餐点类型、口味、季节和温度的带索引查询。
+需要在安装了AstrBot的环境中运行：
+
+    python benchmarks/bench_catalog.py [食物数量] [次数]
+"""
+import sys
+import time
+import random
+
+from standins import load_plugin_module
+
+catalog_module = load_plugin_module("food_catalog")
+
+MEAL_TYPES = ["早餐", "中餐", "晚餐", "快餐", "面食", "甜点"]
+TAGS = ["辣", "甜", "酸", "咸", "素食", "肉类", "海鲜"]
+SEASONS = ["春季", "夏季", "秋季", "冬季"]
+
+
+def make_catalog_data(size):
+    """生成 size 道随机属性的食物"""
+    rng = random.Random(0)
+    foods = []
+    for i in range(size):
+        food = {
+            "name": f"食物{i}",
+            "meal_types": rng.sample(MEAL_TYPES, rng.randint(1, 2)),
+            "tags": rng.sample(TAGS, rng.randint(0, 3)),
+        }
+        if rng.random() < 0.3:
+            food["seasons"] = rng.sample(SEASONS, rng.randint(1, 3))
+        if rng.random() < 0.3:
+            low = rng.randint(-10, 20)
+            food["temperature"] = [low, low + rng.randint(10, 25)]
+        foods.append(food)
+    return {"meal_types": MEAL_TYPES, "tags": TAGS, "seasons": SEASONS, "foods": foods}
+
+
+def pick_from_lists(categories, meal_type, count, exclude):
+    """旧实现：按餐点类型取列表（未知类型时合并所有列表），去重、过滤后随机抽样"""
+    if meal_type in categories:
+        pool = categories[meal_type]
+    else:
+        pool = []
+        for foods in categories.values():
+            pool.extend(foods)
+    pool = [food for food in dict.fromkeys(pool) if food not in exclude] or list(dict.fromkeys(pool))
+    return random.sample(pool, min(count, len(pool)))
+
+
+def bench(name, func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {iterations / elapsed:>12,.0f} 次/秒  {elapsed / iterations * 1e6:>8.2f} 微秒/次")
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    data = make_catalog_data(size)
+    categories = {}
+    for food in data["foods"]:
+        for meal_type in food["meal_types"]:
+            categories.setdefault(meal_type, []).append(food["name"])
+
+    start = time.perf_counter()
+    catalog = catalog_module.FoodCatalog()
+    catalog.build(data)
+    print(f"{size} 道食物，建立索引耗时 {(time.perf_counter() - start) * 1000:.1f} 毫秒")
+
+    exclude = {"食物1", "食物2", "食物3", "食物4", "食物5"}
+    bench("列表（按餐点类型）", lambda: pick_from_lists(categories, "中餐", 5, exclude), iterations)
+    bench("列表（全部食物）", lambda: pick_from_lists(categories, None, 5, exclude), max(1, iterations // 10))
+    bench("目录（按餐点类型）", lambda: catalog.sample("中餐", 5, exclude), iterations)
+    bench("目录（类型+口味+季节+温度）",
+          lambda: catalog.sample("中餐", 5, exclude, tags=["辣"], season="冬季", temperature="3"), iterations)
+    bench("目录（全部食物）", lambda: catalog.sample(None, 5, exclude), iterations)
+
+
+if __name__ == "__main__":
+    main()
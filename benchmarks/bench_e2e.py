@@ -0,0 +1,176 @@
+"""
+离线端到端基准测试
+
+用合成的消息事件驱动 FoodRecommenderPlugin 的 recommend_food、change_food_recommendation
+和 food_command_handler，LLM使用延迟可配置的 FakeProvider，天气和火山引擎接口使用本地替身服务器。
+N 个并发用户各自循环执行这三种操作，最后输出吞吐量和各操作的延迟分位数。
+不需要网络，需要在安装了AstrBot的环境中运行：
+
+    python benchmarks/bench_e2e.py --users 20 --rounds 5 --llm-latency 0.8 --volcengine-latency 3
+
+也可以回放插件在真实环境中录制的外部调用（cassette_mode 设为 record 时生成的文件）：
+
+    python benchmarks/bench_e2e.py --cassette-mode replay --cassette-path data/cassette.jsonl
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+from standins import FakeContext, FakeEvent, FakeProvider, load_plugin_module, start_stand_in_server
+
+COMMANDS = ["中午吃什么", "晚饭吃什么好", "推荐点辣的吃的"]
+
+
+def percentile(ordered, q):
+    return ordered[int(round(q * (len(ordered) - 1)))] if ordered else 0.0
+
+
+class Recorder:
+    """记录每次操作的首条推荐消息时间和完成时间"""
+
+    def __init__(self):
+        # 操作名称 -> [(首条推荐消息耗时, 完成耗时)]
+        self.samples = {}
+        self.failures = 0
+
+    async def run(self, name, replies):
+        start = time.perf_counter()
+        first = None
+        count = 0
+        try:
+            async for _ in replies:
+                count += 1
+                # 第一条是"请稍候"提示，第二条才是推荐内容
+                if count == 2 and first is None:
+                    first = time.perf_counter() - start
+        except Exception as e:
+            self.failures += 1
+            print(f"{name} 失败: {e}", file=sys.stderr)
+            return
+        total = time.perf_counter() - start
+        self.samples.setdefault(name, []).append((first if first is not None else total, total))
+
+    def report(self, wall):
+        operations = sum(len(samples) for samples in self.samples.values())
+        print(f"\n共 {operations} 次操作，失败 {self.failures} 次，耗时 {wall:.2f} 秒，吞吐量 {operations / wall:.2f} 次/秒")
+        print(f"{'操作':<28}{'次数':>6}{'首条 p50':>10}{'p95':>8}{'p99':>8}{'完成 p50':>10}{'p95':>8}{'p99':>8}")
+        for name, samples in sorted(self.samples.items()):
+            firsts = sorted(first for first, _ in samples)
+            totals = sorted(total for _, total in samples)
+            print(
+                f"{name:<28}{len(samples):>6}"
+                f"{percentile(firsts, 0.5):>10.2f}{percentile(firsts, 0.95):>8.2f}{percentile(firsts, 0.99):>8.2f}"
+                f"{percentile(totals, 0.5):>10.2f}{percentile(totals, 0.95):>8.2f}{percentile(totals, 0.99):>8.2f}"
+            )
+
+
+async def simulate_user(plugin, user_id, rounds, recorder):
+    for round_index in range(rounds):
+        event = FakeEvent(user_id, "推荐美食")
+        await recorder.run("recommend_food", plugin.recommend_food(event, None, "北京"))
+
+        event = FakeEvent(user_id, "换一个")
+        await recorder.run("change_food_recommendation", plugin.change_food_recommendation(event))
+
+        text = COMMANDS[round_index % len(COMMANDS)]
+        event = FakeEvent(user_id, text)
+        await recorder.run("food_command_handler", plugin.food_command_handler(event, text))
+
+
+async def main(args):
+    plugin_module = load_plugin_module("main")
+    metrics_module = load_plugin_module("metrics")
+
+    runner, base_url, counts = await start_stand_in_server(
+        weather_latency=args.weather_latency,
+        volcengine_latency=args.volcengine_latency,
+        download_latency=args.download_latency,
+        image_kb=args.image_kb,
+        error_rate=args.http_error_rate
+    )
+    provider = FakeProvider(latency=args.llm_latency, error_rate=args.llm_error_rate, hang_rate=args.llm_hang_rate)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 输出目录和图片缓存放在临时目录中，不影响插件目录
+        plugin_module.OUTPUT_DIR = os.path.join(tmp, "output")
+        plugin_module.IMAGE_CACHE_DIR = os.path.join(tmp, "image_cache")
+        config = {
+            "volcengine_ak": "AK_BENCH",
+            "volcengine_sk": "SK_BENCH",
+            "image_cache_enabled": args.image_cache,
+            "progressive_reply": not args.no_progressive,
+            "image_return_mode": args.image_mode,
+            "user_state_persist": False,
+            "description_cache_persist": False,
+            "trace_enabled": False,
+            "image_rate_limit": args.image_rate,
+            "image_workers": args.image_workers,
+            "http_endpoint_overrides": {"weather": base_url, "volcengine": base_url, "image_download": base_url},
+            "ranking_mode": args.ranking,
+            "llm_call_mode": args.llm_call_mode,
+            "llm_timeout": args.llm_timeout,
+            "llm_hedge_delay": args.llm_hedge_delay,
+            "cassette_mode": args.cassette_mode,
+            "cassette_path": args.cassette_path,
+            "cassette_latency": args.cassette_latency,
+            "cassette_match": args.cassette_match,
+        }
+        plugin = plugin_module.FoodRecommenderPlugin(FakeContext(provider), config)
+        await plugin.initialize()
+
+        print(f"{args.users} 个并发用户，每人 {args.rounds} 轮；LLM延迟 {args.llm_latency} 秒，"
+              f"火山引擎延迟 {args.volcengine_latency} 秒，图片 {args.image_mode} 模式，候选食物 {args.ranking} 模式，LLM调用 {args.llm_call_mode} 模式")
+        recorder = Recorder()
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(
+                simulate_user(plugin, f"bench_user_{i}", args.rounds, recorder) for i in range(args.users)
+            ))
+            wall = time.perf_counter() - start
+        finally:
+            await plugin.terminate()
+            await runner.cleanup()
+
+    recorder.report(wall)
+    print(f"\nLLM调用 {provider.calls} 次，替身服务器请求: {counts}")
+    if args.stages:
+        print("\n" + metrics_module.METRICS.format_text())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="食物推荐插件离线端到端基准测试")
+    parser.add_argument("--users", type=int, default=10, help="并发用户数")
+    parser.add_argument("--rounds", type=int, default=3, help="每个用户的轮数，每轮执行三种操作")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="LLM平均延迟（秒）")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="LLM出错的概率")
+    parser.add_argument("--llm-hang-rate", type=float, default=0.0, help="LLM一直不返回的概率")
+    parser.add_argument("--llm-timeout", type=float, default=20, help="LLM调用期限（秒）")
+    parser.add_argument("--llm-hedge-delay", type=float, default=0, help="LLM对冲请求延迟（秒），0 表示不对冲")
+    parser.add_argument("--weather-latency", type=float, default=0.1, help="天气接口延迟（秒）")
+    parser.add_argument("--volcengine-latency", type=float, default=2.0, help="火山引擎生成图片延迟（秒）")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="天气和火山引擎接口返回503的概率")
+    parser.add_argument("--download-latency", type=float, default=0.1, help="图片下载延迟（秒）")
+    parser.add_argument("--image-kb", type=int, default=256, help="图片大小（KB）")
+    parser.add_argument("--image-mode", choices=("bytes", "url"), default="bytes", help="图片返回方式")
+    parser.add_argument("--image-rate", type=float, default=0, help="图片生成限速（次/秒），0 表示不限速")
+    parser.add_argument("--image-workers", type=int, default=4, help="图片生成队列的工作协程数")
+    parser.add_argument("--image-cache", action="store_true", help="启用图片缓存")
+    parser.add_argument("--no-progressive", action="store_true", help="关闭渐进式回复")
+    parser.add_argument("--ranking", choices=("local", "rerank", "llm"), default="local", help="候选食物的生成方式")
+    parser.add_argument("--llm-call-mode", choices=("separate", "combined"), default="separate",
+                        help="分别调用LLM生成候选、描述和推荐理由，或一次调用同时生成")
+    parser.add_argument("--stages", action="store_true", help="同时输出插件内部各阶段的性能指标")
+    parser.add_argument("--cassette-mode", choices=("off", "record", "replay"), default="off",
+                        help="录制外部调用，或用录制的结果代替LLM和替身服务器")
+    parser.add_argument("--cassette-path", default="cassette.jsonl", help="录制文件路径")
+    parser.add_argument("--cassette-latency", choices=("original", "zero"), default="original", help="回放时的耗时")
+    parser.add_argument("--cassette-match", choices=("exact", "kind"), default="kind",
+                        help="回放时没有完全相同的请求时，是否使用同类型调用的下一条记录")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,94 @@
+"""
+生成图片两种返回方式的对比测试
+
+在本地启动一个模拟火山引擎接口和图片下载地址的替身服务器，分别以 url 模式（返回地址后再下载）
+和 bytes 模式（响应中直接返回base64图片数据）调用 generate_food_image，比较每张图片的耗时。
+替身服务器对每个请求增加固定延迟，模拟到真实服务的网络往返。需要在安装了AstrBot的环境中运行：
+
+    python benchmarks/bench_image_modes.py [次数] [往返延迟毫秒] [图片KB]
+"""
+import os
+import sys
+import time
+import base64
+import asyncio
+import tempfile
+import importlib
+from types import SimpleNamespace
+
+from aiohttp import web
+
+# 把插件目录作为包导入，插件内部使用相对导入
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+PACKAGE = os.path.basename(PLUGIN_DIR)
+image_generator = importlib.import_module(f"{PACKAGE}.image_generator")
+http_client_module = importlib.import_module(f"{PACKAGE}.http_client")
+
+
+async def start_stand_in(latency, image_bytes):
+    """启动替身服务器，返回 (runner, 基础地址)"""
+    encoded = base64.b64encode(image_bytes).decode()
+
+    async def volcengine(request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        if body.get("return_url", True):
+            return web.json_response({"code": 10000, "data": {"image_urls": [f"http://{request.host}/image.jpg"]}})
+        return web.json_response({"code": 10000, "data": {"binary_data_base64": [encoded]}})
+
+    async def image(request):
+        await asyncio.sleep(latency)
+        return web.Response(body=image_bytes, content_type="image/jpeg")
+
+    app = web.Application(client_max_size=0)
+    app.router.add_post("/", volcengine)
+    app.router.add_get("/image.jpg", image)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def bench(mode, base_url, iterations, output_dir):
+    client = http_client_module.HttpClient(base_urls={"volcengine": base_url, "image_download": base_url})
+    await client.start()
+    context = SimpleNamespace(
+        config={"volcengine_ak": "AK_BENCH", "volcengine_sk": "SK_BENCH", "image_return_mode": mode},
+        http_client=client,
+        OUTPUT_DIR=output_dir,
+    )
+    timings = []
+    try:
+        for i in range(iterations):
+            start = time.perf_counter()
+            path = await image_generator.generate_food_image(f"bench{i}", context=context)
+            timings.append(time.perf_counter() - start)
+            assert path and os.path.exists(path), f"{mode} 模式生成图片失败"
+            os.remove(path)
+    finally:
+        await client.close()
+    timings.sort()
+    print(f"{mode:<6} 平均 {sum(timings) / len(timings) * 1000:>8.1f} 毫秒  "
+          f"中位数 {timings[len(timings) // 2] * 1000:>8.1f} 毫秒  最大 {timings[-1] * 1000:>8.1f} 毫秒")
+
+
+async def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+    image_bytes = os.urandom(int(sys.argv[3]) * 1024 if len(sys.argv) > 3 else 512 * 1024)
+
+    runner, base_url = await start_stand_in(latency, image_bytes)
+    print(f"{iterations} 次，往返延迟 {latency * 1000:.0f} 毫秒，图片 {len(image_bytes) // 1024} KB")
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            await bench("url", base_url, iterations, output_dir)
+            await bench("bytes", base_url, iterations, output_dir)
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+"""
+本地食物排序的微基准测试
+
+用合成的食物目录对比逐个情境排序与一次批量排序的吞吐量，
+并对比NumPy实现与纯Python实现。需要在安装了AstrBot的环境中运行：
+
+    python benchmarks/bench_ranking.py [食物数量] [情境数量]
+"""
+import sys
+import time
+import random
+
+from standins import load_plugin_module
+from bench_catalog import MEAL_TYPES, SEASONS, make_catalog_data
+
+catalog_module = load_plugin_module("food_catalog")
+ranker_module = load_plugin_module("food_ranker")
+
+WEATHERS = ["Sunny", "Light rain", "Partly cloudy", "Snow", "晴朗"]
+PREFERENCES = [[], ["辣"], ["甜"], ["素食"], ["海鲜", "辣"], ["肉类"]]
+
+
+def make_contexts(count):
+    rng = random.Random(1)
+    return [
+        {
+            "meal_type": rng.choice(MEAL_TYPES),
+            "weather": rng.choice(WEATHERS),
+            "temperature": str(rng.randint(-5, 35)),
+            "season": rng.choice(SEASONS),
+            "preferences": rng.choice(PREFERENCES),
+            "exclude": [f"食物{rng.randrange(100)}" for _ in range(5)],
+        }
+        for _ in range(count)
+    ]
+
+
+def bench(name, func, contexts):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {len(contexts) / elapsed:>12,.0f} 情境/秒  {elapsed / len(contexts) * 1e6:>10.2f} 微秒/情境")
+
+
+def run(ranker, contexts, label):
+    bench(f"{label} 逐个", lambda: [ranker.rank(**context, k=5, sampling_temperature=0.5) for context in contexts], contexts)
+    bench(f"{label} 批量", lambda: ranker.rank_batch(contexts, k=5, sampling_temperature=0.5), contexts)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    catalog = catalog_module.FoodCatalog()
+    catalog.build(make_catalog_data(size))
+    contexts = make_contexts(count)
+    print(f"{size} 道食物，{count} 个情境")
+
+    if ranker_module.NUMPY_AVAILABLE:
+        run(ranker_module.FoodRanker(catalog), contexts, "NumPy")
+    else:
+        print("未安装NumPy，只测试纯Python实现")
+
+    # 纯Python实现只测少量情境
+    ranker_module.NUMPY_AVAILABLE = False
+    run(ranker_module.FoodRanker(catalog), contexts[:max(1, count // 10)], "纯Python")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+火山引擎请求签名的微基准测试
+
+对比每次请求都重新派生签名密钥（旧实现）与 VolcengineClient 缓存签名密钥后的签名吞吐量。
+需要在安装了AstrBot的环境中运行：
+
+    python benchmarks/bench_signing.py [次数]
+"""
+import os
+import sys
+import json
+import hmac
+import time
+import hashlib
+import importlib
+from datetime import datetime, timezone
+
+# 把插件目录作为包导入，插件内部使用相对导入
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+doubao = importlib.import_module(f"{os.path.basename(PLUGIN_DIR)}.doubao_image.main")
+
+
+def sign_uncached(access_key, secret_key, region, service, req_query, req_body, now):
+    """旧实现：每次签名都重新计算完整的HMAC密钥链"""
+    current_date = now.strftime('%Y%m%dT%H%M%SZ')
+    datestamp = now.strftime('%Y%m%d')
+    payload_hash = hashlib.sha256(req_body.encode('utf-8')).hexdigest()
+    canonical_headers = 'content-type:' + doubao.content_type + '\n' + 'host:' + doubao.host + \
+        '\n' + 'x-content-sha256:' + payload_hash + \
+        '\n' + 'x-date:' + current_date + '\n'
+    canonical_request = doubao.method + '\n' + '/' + '\n' + req_query + \
+        '\n' + canonical_headers + '\n' + doubao.signed_headers + '\n' + payload_hash
+    credential_scope = datestamp + '/' + region + '/' + service + '/' + 'request'
+    string_to_sign = doubao.algorithm + '\n' + current_date + '\n' + credential_scope + '\n' + hashlib.sha256(
+        canonical_request.encode('utf-8')).hexdigest()
+    signing_key = doubao.getSignatureKey(secret_key, datestamp, region, service)
+    signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    return {
+        'X-Date': current_date,
+        'Authorization': doubao.algorithm + ' ' + 'Credential=' + access_key + '/' + credential_scope + ', ' +
+                         'SignedHeaders=' + doubao.signed_headers + ', ' + 'Signature=' + signature,
+        'X-Content-Sha256': payload_hash,
+        'Content-Type': doubao.content_type
+    }
+
+
+def bench(name, func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<12} {iterations / elapsed:>12,.0f} 次/秒  {elapsed / iterations * 1e6:>8.2f} 微秒/次")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    client = doubao.VolcengineClient("AK_BENCH", "SK_BENCH", "cn-north-1", "cv")
+    req_query = doubao.formatQuery({'Action': 'CVProcess', 'Version': '2022-08-31'})
+    req_body = json.dumps({"req_key": "high_aes_general_v21_L", "prompt": "高质量、写实风格的美食照片，红烧肉",
+                           "width": 1024, "height": 1024, "return_url": True})
+    now = datetime.now(timezone.utc)
+
+    # 两种实现的签名结果必须一致
+    assert client.sign(req_query, req_body, now) == sign_uncached(
+        "AK_BENCH", "SK_BENCH", "cn-north-1", "cv", req_query, req_body, now)
+
+    bench("uncached", lambda: sign_uncached("AK_BENCH", "SK_BENCH", "cn-north-1", "cv", req_query, req_body, now), iterations)
+    bench("cached", lambda: client.sign(req_query, req_body, now), iterations)
+
+
+if __name__ == "__main__":
+    main()
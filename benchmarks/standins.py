@@ -0,0 +1,163 @@
+"""
+离线基准测试使用的本地替身
+
+- FakeProvider / FakeContext：模拟AstrBot的LLM提供商和上下文，按配置的延迟返回固定格式的文本
+- FakeEvent：模拟消息事件
+- start_stand_in_server：本地aiohttp服务器，替代wttr.in、火山引擎接口和图片下载地址
+
+插件通过 http_endpoint_overrides 配置把外部请求指向替身服务器，整个测试不需要网络。
+"""
+import os
+import sys
+import json
+import random
+import base64
+import asyncio
+import importlib
+
+from aiohttp import web
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FOODS = ["红烧肉", "麻婆豆腐", "宫保鸡丁", "牛肉面", "小笼包", "火锅", "煲仔饭", "酸菜鱼",
+         "回锅肉", "鱼香肉丝", "饺子", "炸酱面", "烤鸭", "寿司", "沙拉", "粥"]
+
+
+def load_plugin_module(name):
+    """把插件目录作为包导入其中的模块，插件内部使用相对导入"""
+    if os.path.dirname(PLUGIN_DIR) not in sys.path:
+        sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+    return importlib.import_module(f"{os.path.basename(PLUGIN_DIR)}.{name}")
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.completion_text = text
+
+
+class FakeProvider:
+    """按提示词类型返回固定格式文本的LLM提供商"""
+
+    def __init__(self, latency=0.5, jitter=0.2, error_rate=0.0, hang_rate=0.0):
+        """
+        Args:
+            latency: 平均延迟（秒）
+            jitter: 延迟的随机波动比例
+            error_rate: 抛出异常的概率
+            hang_rate: 一直不返回的概率
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.calls = 0
+
+    def respond(self, prompt):
+        """根据提示词生成回复文本"""
+        if "以JSON对象返回" in prompt:
+            reply = {}
+            if not prompt.startswith("请为美食"):
+                if "从以下候选中选择：" in prompt:
+                    candidates = prompt.split("从以下候选中选择：", 1)[1].split("。", 1)[0].split("、")
+                    reply["food"] = random.choice(candidates)
+                else:
+                    reply["food"] = random.choice(FOODS)
+            if "description" in prompt:
+                reply["description"] = "这是一道经典的家常美食，口感鲜美，营养丰富。"
+            reply["reason"] = "天气和时间都很合适，来一份暖暖胃。"
+            return json.dumps(reply, ensure_ascii=False)
+        if "重新排列" in prompt:
+            candidates = prompt.split("以下是候选美食：", 1)[1].split("。", 1)[0].split("、")
+            return "\n".join(random.sample(candidates, len(candidates)))
+        if "只返回美食名称" in prompt:
+            return "\n".join(f"{i + 1}. {food}" for i, food in enumerate(random.sample(FOODS, 5)))
+        if "推荐理由" in prompt:
+            return "天气和时间都很合适，来一份暖暖胃。"
+        return "这是一道经典的家常美食，口感鲜美，营养丰富。"
+
+    async def text_chat(self, prompt, session_id=None, **kwargs):
+        self.calls += 1
+        if self.hang_rate and random.random() < self.hang_rate:
+            await asyncio.Event().wait()
+        await asyncio.sleep(max(0.0, self.latency * (1 + random.uniform(-self.jitter, self.jitter))))
+        if self.error_rate and random.random() < self.error_rate:
+            raise RuntimeError("模拟的LLM错误")
+        return FakeResponse(self.respond(prompt))
+
+
+class FakeContext:
+    """模拟AstrBot的Context，只实现插件用到的方法"""
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def get_using_provider(self):
+        return self.provider
+
+    def activate_llm_tool(self, name):
+        pass
+
+
+class FakeEvent:
+    """模拟消息事件"""
+
+    def __init__(self, user_id, message_str="", admin=False):
+        self.user_id = user_id
+        self.message_str = message_str
+        self.admin = admin
+
+    def is_admin(self):
+        return self.admin
+
+    def get_message_str(self):
+        return self.message_str
+
+    def chain_result(self, chain):
+        return chain
+
+
+async def start_stand_in_server(weather_latency=0.1, volcengine_latency=2.0, download_latency=0.1, image_kb=256, error_rate=0.0):
+    """
+    启动替身服务器，天气和火山引擎接口按 error_rate 的概率返回503
+
+    Returns:
+        tuple: (web.AppRunner, 基础地址, 请求计数字典)
+    """
+    image_bytes = os.urandom(image_kb * 1024)
+    encoded = base64.b64encode(image_bytes).decode()
+    counts = {"weather": 0, "volcengine": 0, "image_download": 0}
+
+    async def weather(request):
+        counts["weather"] += 1
+        await asyncio.sleep(weather_latency)
+        if error_rate and random.random() < error_rate:
+            return web.Response(status=503)
+        return web.json_response({
+            "current_condition": [{"temp_C": str(random.randint(-5, 35)), "weatherDesc": [{"value": "多云"}]}]
+        })
+
+    async def volcengine(request):
+        counts["volcengine"] += 1
+        body = await request.json()
+        await asyncio.sleep(volcengine_latency)
+        if error_rate and random.random() < error_rate:
+            return web.Response(status=503)
+        if body.get("return_url", True):
+            return web.json_response({"code": 10000, "data": {"image_urls": [f"http://{request.host}/image.jpg"]}})
+        return web.json_response({"code": 10000, "data": {"binary_data_base64": [encoded]}})
+
+    async def image(request):
+        counts["image_download"] += 1
+        await asyncio.sleep(download_latency)
+        return web.Response(body=image_bytes, content_type="image/jpeg")
+
+    app = web.Application(client_max_size=0)
+    app.router.add_post("/", volcengine)
+    app.router.add_get("/image.jpg", image)
+    app.router.add_get("/{city}", weather)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}", counts
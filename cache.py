@@ -0,0 +1,294 @@
+import os
+import json
+import asyncio
+import time
+from collections import OrderedDict
+from astrbot.api import logger
+
+
+class SingleFlight:
+    """
+    合并同一个键上的并发调用
+
+    同一时刻对同一个键的多次调用只会真正执行一次，其余调用方等待同一个结果。
+    所有调用方都被取消时，正在进行的调用也会被取消。
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        # 键 -> 正在等待的调用方数量
+        self._waiters = {}
+
+    def pending(self, key):
+        """判断某个键是否有正在进行的调用"""
+        return key in self._inflight
+
+    async def do(self, key, func):
+        """
+        执行或加入一次调用
+
+        Args:
+            key: 合并调用使用的键
+            func: 无参数的异步函数，只有第一个调用方会执行它
+
+        Returns:
+            func 的返回值，异常会传递给所有调用方
+        """
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # 使用shield，避免某个调用方被取消时连带取消其他调用方共享的请求
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # 最后一个调用方也放弃时，取消共享的请求
+            if self._waiters.get(key) == 1 and not future.done():
+                future.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def _forget(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        # 读取一次异常，避免没有调用方等待时出现"exception was never retrieved"
+        if not future.cancelled():
+            future.exception()
+
+
+class TTLCache:
+    """
+    带过期时间的异步缓存
+
+    - 未过期的值直接返回
+    - 过期但仍在 stale_ttl 内的值会立即返回，同时在后台刷新
+    - 同一个键的并发加载只会执行一次
+    """
+
+    def __init__(self, ttl, stale_ttl=None, maxsize=256, name="cache"):
+        """
+        Args:
+            ttl: 值的新鲜时间（秒）
+            stale_ttl: 过期后仍可返回旧值的时间（秒），None 表示一直可以返回旧值
+            maxsize: 最多保存的键数量，超出时淘汰最早写入的键
+            name: 缓存名称，用于日志
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self.name = name
+        self._data = {}
+        self._flight = SingleFlight()
+        self._refresh_tasks = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key):
+        """获取未过期的值，不存在或已过期时返回None"""
+        entry = self._data.get(key)
+        if entry is None or time.monotonic() - entry[1] >= self.ttl:
+            return None
+        return entry[0]
+
+    def set(self, key, value):
+        """写入一个值"""
+        self._data.pop(key, None)
+        self._data[key] = (value, time.monotonic())
+        while self.maxsize and len(self._data) > self.maxsize:
+            self._data.pop(next(iter(self._data)))
+
+    def clear(self):
+        self._data.clear()
+
+    async def get_or_fetch(self, key, fetch):
+        """
+        获取缓存值，必要时调用 fetch 加载
+
+        Args:
+            key: 缓存键
+            fetch: 无参数的异步函数，返回None表示加载失败，失败的结果不会被缓存
+
+        Returns:
+            缓存值或 fetch 的返回值
+        """
+        entry = self._data.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age < self.ttl:
+                self.hits += 1
+                return value
+            if self.stale_ttl is None or age < self.ttl + self.stale_ttl:
+                # 先返回旧值，后台刷新
+                self.stale_hits += 1
+                self._refresh_in_background(key, fetch)
+                return value
+
+        self.misses += 1
+        return await self._load(key, fetch)
+
+    async def _load(self, key, fetch):
+        return await self._flight.do(key, lambda: self._fetch_and_store(key, fetch))
+
+    async def _fetch_and_store(self, key, fetch):
+        value = await fetch()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def _refresh_in_background(self, key, fetch):
+        if self._flight.pending(key):
+            return
+
+        async def refresh():
+            try:
+                await self._load(key, fetch)
+            except Exception as e:
+                logger.error(f"{self.name} 后台刷新 {key} 失败: {e}")
+
+        # 保存任务引用，防止任务在完成前被回收
+        task = asyncio.ensure_future(refresh())
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+
+class LRUCache:
+    """
+    带过期时间和可选持久化的LRU缓存
+
+    超出 maxsize 时淘汰最久未使用的键。设置 path 后可以把内容保存为JSON文件，
+    插件重载后继续使用；每写入 autosave_every 次在线程池中自动保存一次，不阻塞事件循环。
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, path=None, autosave_every=20, name="cache"):
+        """
+        Args:
+            maxsize: 最多保存的键数量
+            ttl: 值的有效时间（秒），None 表示永不过期
+            path: 持久化文件路径，None 表示只保存在内存中
+            autosave_every: 每写入多少次自动保存一次
+            name: 缓存名称，用于日志
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.autosave_every = autosave_every
+        self.name = name
+        # 键 -> (值, 写入时间戳)，使用墙上时间以便持久化后仍能判断过期
+        self._data = OrderedDict()
+        self._dirty = 0
+        # 正在线程池中进行的自动保存
+        self._save_future = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and time.time() - stored_at >= self.ttl
+
+    def get(self, key):
+        """获取值，不存在或已过期时返回None"""
+        entry = self._data.get(key)
+        if entry is None or self._expired(entry[1]):
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value):
+        """写入一个值"""
+        self._data[key] = (value, time.time())
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        self._dirty += 1
+        if self.path and self.autosave_every and self._dirty >= self.autosave_every:
+            self._save_in_background()
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        """返回命中统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
+
+    def load(self):
+        """从持久化文件加载，已过期的条目会被丢弃"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+            for key, value, stored_at in items:
+                if not self._expired(stored_at):
+                    self._data[key] = (value, stored_at)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            logger.info(f"{self.name} 从 {self.path} 加载了 {len(self._data)} 条记录")
+        except Exception as e:
+            logger.error(f"{self.name} 加载失败: {e}")
+
+    def _snapshot(self):
+        """在事件循环线程中复制当前内容，供线程池写入"""
+        self._dirty = 0
+        return [[key, value, stored_at] for key, (value, stored_at) in self._data.items()]
+
+    def _save_in_background(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中（例如脚本直接调用）时同步保存
+            self.save()
+            return
+        # 上一次保存还没完成时先不保存，_dirty 保留，之后的写入会再次触发
+        if self._save_future is not None and not self._save_future.done():
+            return
+        self._save_future = loop.run_in_executor(None, self._write, self.path, self._snapshot())
+
+    def save(self):
+        """同步保存到持久化文件"""
+        if not self.path:
+            return
+        self._write(self.path, self._snapshot())
+
+    async def close(self):
+        """等待进行中的自动保存完成，然后在线程池中保存最终内容"""
+        if self._save_future is not None:
+            await self._save_future
+            self._save_future = None
+        if self.path:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, self.path, self._snapshot())
+
+    def _write(self, path, items):
+        """写入持久化文件，先写临时文件再替换，避免写到一半时文件损坏"""
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(items, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"{self.name} 保存失败: {e}")
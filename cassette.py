@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import hashlib
+import asyncio
+from collections import deque
+from astrbot.api import logger
+
+from .metrics import METRICS
+
+# 超过该长度的字符串（如bytes模式返回的base64图片）不写入录制文件，只记录摘要和长度
+MAX_INLINE_CHARS = 4096
+OMITTED_KEY = "$omitted"
+
+
+def _compact(value):
+    """把响应中的长字符串替换为摘要和长度"""
+    if isinstance(value, str) and len(value) > MAX_INLINE_CHARS:
+        return {OMITTED_KEY: hashlib.sha256(value.encode()).hexdigest(), "chars": len(value)}
+    if isinstance(value, dict):
+        return {key: _compact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_compact(item) for item in value]
+    return value
+
+
+class OmittedPayload(str):
+    """回放时代替被省略字符串的占位数据，调用方可以据此区分，不能当作真实数据保存"""
+
+
+def _restore(value):
+    """回放时用相同长度的占位数据代替被省略的字符串，保持解码和写入的开销"""
+    if isinstance(value, dict):
+        if OMITTED_KEY in value:
+            # "A" 组成的字符串是合法的base64，解码为全零字节
+            return OmittedPayload("A" * value.get("chars", 0))
+        return {key: _restore(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_restore(item) for item in value]
+    return value
+
+
+class CassetteError(Exception):
+    """回放录制时出错的调用"""
+
+
+class Cassette:
+    """
+    外部调用的录制和回放
+
+    - record：正常调用外部服务，同时记录每次调用的请求键、响应和耗时，在线程池中逐条追加到JSONL文件；
+      超过 MAX_INLINE_CHARS 的字符串只记录摘要和长度，回放时以 OmittedPayload 占位
+    - replay：从文件中读取记录，按请求键返回录制的响应，并按原始耗时（或零耗时）等待；
+      同一个键有多条记录时依次返回。没有完全匹配的记录时真正调用外部服务；
+      match 为 kind 时改为返回同类型调用的下一条记录（例如其他城市的天气），只适合离线基准测试，
+      该类型没有任何记录时才真正调用外部服务
+    - off：直接调用外部服务
+
+    录制的响应需要可以序列化为JSON。
+    """
+
+    def __init__(self):
+        self.mode = "off"
+        self.path = None
+        self.zero_latency = False
+        self.match_kind = False
+        # 等待写入文件的记录和正在写入的任务
+        self._buffer = []
+        self._writer = None
+        # (类型, 键) -> 记录队列
+        self._by_key = {}
+        # 类型 -> 记录队列，用于没有完全匹配时按顺序返回
+        self._by_kind = {}
+
+    @property
+    def active(self):
+        return self.mode != "off"
+
+    def configure(self, mode="off", path=None, latency="original", match="exact"):
+        """
+        Args:
+            mode: off、record 或 replay
+            path: 录制文件路径
+            latency: replay 时使用录制的原始耗时（original）或不等待（zero）
+            match: replay 时只返回请求键完全相同的记录（exact），或没有时返回同类型的下一条记录（kind）
+        """
+        self.mode = mode if mode in ("record", "replay") and path else "off"
+        self.path = path
+        self.zero_latency = latency == "zero"
+        self.match_kind = match == "kind"
+        self._buffer = []
+        self._by_key = {}
+        self._by_kind = {}
+        if self.mode == "replay":
+            self._load()
+        if self.mode != "off":
+            logger.info(f"外部调用{'录制' if self.mode == 'record' else '回放'}已开启: {path}")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            logger.warning(f"录制文件不存在，所有调用都将访问外部服务: {self.path}")
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._by_key.setdefault((entry["kind"], entry["key"]), deque()).append(entry)
+                self._by_kind.setdefault(entry["kind"], deque()).append(entry)
+        logger.info(f"已加载 {sum(len(q) for q in self._by_kind.values())} 条录制的调用")
+
+    @staticmethod
+    def _next(entries):
+        """依次返回记录，用完后从头开始"""
+        entry = entries[0]
+        entries.rotate(-1)
+        return entry
+
+    async def _replay(self, entry):
+        if not self.zero_latency:
+            await asyncio.sleep(entry.get("latency", 0))
+        if "error" in entry:
+            raise CassetteError(entry["error"])
+        return _restore(entry.get("response"))
+
+    async def call(self, kind, key, func):
+        """
+        执行或回放一次外部调用
+
+        Args:
+            kind: 调用类型，如 llm、weather、volcengine
+            key: 请求键，相同请求的键应当相同
+            func: 无参数的异步函数，真正调用外部服务
+
+        Returns:
+            func 的返回值，或录制的响应
+        """
+        if self.mode == "replay":
+            entries = self._by_key.get((kind, key))
+            if entries:
+                METRICS.inc("cassette_replays", kind=kind, match="exact")
+                return await self._replay(self._next(entries))
+            entries = self._by_kind.get(kind) if self.match_kind else None
+            if entries:
+                METRICS.inc("cassette_replays", kind=kind, match="kind")
+                return await self._replay(self._next(entries))
+            METRICS.inc("cassette_replays", kind=kind, match="live")
+            return await func()
+
+        if self.mode != "record":
+            return await func()
+
+        start = time.perf_counter()
+        entry = {"kind": kind, "key": key}
+        try:
+            result = await func()
+            entry["response"] = result
+            return result
+        except Exception as e:
+            entry["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            # 被取消的调用没有结果，不记录
+            if "response" in entry or "error" in entry:
+                entry["latency"] = round(time.perf_counter() - start, 6)
+                self._record(entry)
+
+    def _record(self, entry):
+        """把记录交给后台写入任务，同一时刻只有一个写入任务，保证记录按顺序写入"""
+        self._buffer.append(entry)
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.ensure_future(self._write_loop())
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while self._buffer:
+            entries, self._buffer = self._buffer, []
+            try:
+                await loop.run_in_executor(None, self._append, self.path, entries)
+            except Exception as e:
+                logger.error(f"写入录制文件失败: {e}")
+
+    @staticmethod
+    def _append(path, entries):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(_compact(entry), ensure_ascii=False, default=str) + "\n")
+
+    async def close(self):
+        """等待尚未写入的记录写入文件"""
+        if self._writer is not None:
+            await self._writer
+            self._writer = None
+        if self._buffer:
+            await self._write_loop()
+
+
+# 插件共享的录制/回放器，在插件初始化时配置
+CASSETTE = Cassette()
@@ -0,0 +1,151 @@
+import json
+from astrbot.api import logger
+
+from .llm_utils import call_llm
+from .generate_description import (
+    DESCRIPTION_CACHE, normalize_food_name, get_template_description, get_template_reason
+)
+from .metrics import METRICS
+
+# 各字段的最大长度，超过时视为无效
+FIELD_LIMITS = {
+    "food": 20,
+    "description": 120,
+    "reason": 120,
+}
+
+# 各字段在提示词中的说明
+FIELD_HINTS = {
+    "food": "美食名称",
+    "description": "不超过50个字的美食描述，包含其特点和口感",
+    "reason": "不超过50个字的推荐理由",
+}
+
+
+def parse_combined_response(text, fields=tuple(FIELD_LIMITS)):
+    """
+    严格解析LLM返回的JSON对象
+
+    只接受一个JSON对象，允许外面包着 ```json 代码块标记，不从其他文字中猜测内容。
+    每个字段必须是长度不超过限制的非空字符串，不符合的字段会被丢弃。
+
+    Args:
+        text: LLM返回的文本
+        fields: 需要的字段
+
+    Returns:
+        dict: 有效的字段，无法解析时为空字典
+    """
+    if not text:
+        return {}
+    text = text.strip()
+    if text.startswith("```"):
+        text = text[3:]
+        # 去掉代码块的语言标记
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rstrip()
+        if text.endswith("```"):
+            text = text[:-3]
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+
+    result = {}
+    for field in fields:
+        value = data.get(field)
+        if isinstance(value, str):
+            value = value.strip()
+            if value and len(value) <= FIELD_LIMITS[field]:
+                result[field] = value
+    return result
+
+
+def build_combined_prompt(fields, food=None, meal_type=None, weather=None, temperature=None, date=None,
+                          time_of_day=None, season=None, city=None, preferences=None, candidates=None, exclude=()):
+    """构建一次返回多个字段的提示词"""
+    example = json.dumps({field: FIELD_HINTS[field] for field in fields}, ensure_ascii=False)
+    if food:
+        prompt = f"请为美食\"{food}\"生成描述和推荐理由，以JSON对象返回，不要包含其他任何文字：\n{example}"
+    else:
+        prompt = f"请推荐一道适合现在吃的美食，以JSON对象返回，不要包含其他任何文字：\n{example}"
+
+    prompt += "\n考虑以下因素："
+    for label, value in (("餐点类型", meal_type), ("天气", weather), ("日期", date), ("时间", time_of_day),
+                         ("季节", season), ("城市", city)):
+        if value:
+            prompt += f"\n- {label}：{value}"
+    if temperature:
+        prompt += f"\n- 温度：{temperature}°C"
+    if preferences:
+        prompt += f"\n- 偏好：{', '.join(preferences)}"
+
+    if not food and candidates:
+        prompt += f"\n从以下候选中选择：{'、'.join(candidates)}。"
+    if not food and exclude:
+        prompt += f"\n不要推荐以下食物：{'、'.join(sorted(exclude))}。"
+    return prompt
+
+
+async def generate_combined(food=None, candidates=None, fallback_foods=None, exclude=(), meal_type=None, weather=None, temperature=None,
+                            date=None, time_of_day=None, season=None, city=None, preferences=None, context=None):
+    """
+    一次LLM调用生成食物、描述和推荐理由
+
+    - 指定 food 时只生成描述和推荐理由
+    - 否则由LLM选择食物；给出 candidates 时只能从中选择，且不能是 exclude 中的食物
+
+    每个字段单独回退：食物无效时使用 fallback_foods（默认为 candidates）中第一个不在 exclude 中的食物
+    （此时同一次回复中的描述和理由也不再使用），
+    描述使用缓存或模板，推荐理由使用模板。描述缓存中已有的食物不再让LLM生成描述。
+
+    Returns:
+        dict: food、description、reason，以及 fallbacks（使用了回退的字段列表）
+    """
+    exclude = set(exclude or ())
+    candidates = list(candidates or ())
+    fallback_foods = list(fallback_foods or candidates)
+    fields = ["reason"] if food else ["food", "reason"]
+    cached_description = DESCRIPTION_CACHE.get(normalize_food_name(food)) if food else None
+    if not cached_description:
+        fields.insert(-1, "description")
+
+    prompt = build_combined_prompt(
+        fields, food=food, meal_type=meal_type, weather=weather, temperature=temperature, date=date,
+        time_of_day=time_of_day, season=season, city=city, preferences=preferences,
+        candidates=candidates, exclude=exclude
+    )
+    text = await call_llm(context, prompt, session_id_prefix="food_combined")
+    parsed = parse_combined_response(text, fields)
+
+    fallbacks = []
+    if not food:
+        food = parsed.get("food")
+        if food is None or food in exclude or (candidates and food not in candidates):
+            # 食物无效时，同一次回复中的描述和理由也不再可信
+            if food is not None:
+                logger.info(f"LLM选择的食物\"{food}\"不可用，使用候选食物")
+            parsed = {}
+            fallbacks.append("food")
+            food = next((item for item in fallback_foods if item not in exclude), fallback_foods[0] if fallback_foods else None)
+            if food is None:
+                return {"food": None, "description": None, "reason": None, "fallbacks": fallbacks}
+        cached_description = DESCRIPTION_CACHE.get(normalize_food_name(food))
+
+    description = cached_description or parsed.get("description")
+    if description is None:
+        fallbacks.append("description")
+        description = get_template_description(food)
+    elif not cached_description:
+        DESCRIPTION_CACHE.set(normalize_food_name(food), description)
+
+    reason = parsed.get("reason")
+    if reason is None:
+        fallbacks.append("reason")
+        reason = get_template_reason(food, weather, temperature, date, time_of_day, season, city)
+
+    for field in fallbacks:
+        METRICS.inc("combined_fallbacks", field=field)
+    return {"food": food, "description": description, "reason": reason, "fallbacks": fallbacks}
@@ -1,3 +1,3 @@
-from .main import generate_image
+from .main import VolcengineClient, generate_image, VOLCENGINE_BREAKER
 
-__all__ = ['generate_image']
+__all__ = ['VolcengineClient', 'generate_image', 'VOLCENGINE_BREAKER']
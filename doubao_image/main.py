@@ -1,16 +1,33 @@
 import json
+import time
 from datetime import datetime, timezone
 import hashlib
 import hmac
-import aiohttp
 
 # 使用AstrBot的日志系统
 from astrbot.api import logger
 
+from ..http_client import open_request
+from ..tracing import span
+from ..metrics import METRICS
+from ..cassette import CASSETTE
+from ..resilience import circuit_breaker, RETRYABLE_STATUS, RetryableError, ServiceError
+
 method = 'POST'
 host = 'visual.volcengineapi.com'
 endpoint = 'https://visual.volcengineapi.com'
 
+algorithm = 'HMAC-SHA256'
+content_type = 'application/json'
+
+# 可以重试的错误码：限流（50429）、并发超限（50430）和服务内部错误（50500、50501）
+RETRYABLE_CODES = {50429, 50430, 50500, 50501}
+
+# 火山引擎接口的熔断器，打开期间不再发起请求。
+# 重试和熔断由调用方在图片生成队列之外进行，每次重试都重新排队取得令牌
+VOLCENGINE_BREAKER = circuit_breaker("volcengine", failure_threshold=5, reset_timeout=60.0)
+signed_headers = 'content-type;host;x-content-sha256;x-date'
+
 def sign(key, msg):
     return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
 
@@ -28,71 +45,185 @@ def formatQuery(parameters):
     request_parameters = request_parameters_init[:-1]
     return request_parameters
 
-async def signV4Request(access_key, secret_key, service, req_query, req_body, region="cn-north-1"):
-    if access_key is None or secret_key is None:
-        logger.error('No access key is available.')
-        return None
-
-    t = datetime.now(timezone.utc)
-    current_date = t.strftime('%Y%m%dT%H%M%SZ')
-    datestamp = t.strftime('%Y%m%d')  # Date w/o time, used in credential scope
-    canonical_uri = '/'
-    canonical_querystring = req_query
-    signed_headers = 'content-type;host;x-content-sha256;x-date'
-    payload_hash = hashlib.sha256(req_body.encode('utf-8')).hexdigest()
-    content_type = 'application/json'
-    canonical_headers = 'content-type:' + content_type + '\n' + 'host:' + host + \
-        '\n' + 'x-content-sha256:' + payload_hash + \
-        '\n' + 'x-date:' + current_date + '\n'
-    canonical_request = method + '\n' + canonical_uri + '\n' + canonical_querystring + \
-        '\n' + canonical_headers + '\n' + signed_headers + '\n' + payload_hash
-    logger.info("Canonical request:")
-    logger.info(canonical_request)
-    algorithm = 'HMAC-SHA256'
-    credential_scope = datestamp + '/' + region + '/' + service + '/' + 'request'
-    string_to_sign = algorithm + '\n' + current_date + '\n' + credential_scope + '\n' + hashlib.sha256(
-        canonical_request.encode('utf-8')).hexdigest()
-    logger.info("String to sign:")
-    logger.info(string_to_sign)
-    signing_key = getSignatureKey(secret_key, datestamp, region, service)
-    signature = hmac.new(signing_key, (string_to_sign).encode(
-        'utf-8'), hashlib.sha256).hexdigest()
-    logger.info("Signature:")
-    logger.info(signature)
-
-    authorization_header = algorithm + ' ' + 'Credential=' + access_key + '/' + \
-        credential_scope + ', ' + 'SignedHeaders=' + \
-        signed_headers + ', ' + 'Signature=' + signature
-    headers = {'X-Date': current_date,
-               'Authorization': authorization_header,
-               'X-Content-Sha256': payload_hash,
-               'Content-Type': content_type
-               }
-
-    # ************* SEND THE REQUEST *************
-    request_url = endpoint + '?' + canonical_querystring
-
-    logger.info('\nBEGIN REQUEST++++++++++++++++++++++++++++++++++++')
-    logger.info('Request URL = ' + request_url)
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(request_url, headers=headers, data=req_body) as response:
-                logger.info('\nRESPONSE++++++++++++++++++++++++++++++++++++')
-                logger.info(f'Response code: {response.status}\n')
-                # 读取响应内容
-                response_text = await response.text()
-                # 使用 replace 方法将 \u0026 替换为 &
-                resp_str = response_text.replace("\\u0026", "&")
-                logger.info(f'Response body: {resp_str}\n')
-                return await response.json()
-    except Exception as err:
-        logger.error(f'error occurred: {err}')
-        raise
-
-
-async def generate_image(access_key, secret_key, prompt, width=1024, height=1024, model="high_aes_general_v21_L", schedule_conf="general_v20_9B_pe", region="cn-north-1", service="cv"):
+
+class VolcengineClient:
     """
-    生成图片的函数
+    火山引擎视觉API客户端
+
+    派生的签名密钥按 (日期, 区域, 服务) 缓存，同一天内的请求只需计算一次HMAC密钥链；
+    请求通过共享的HttpClient连接池发送。日志中只记录耗时和状态码，不记录签名等敏感信息。
+    """
+
+    # 最多缓存的签名密钥数量，日期变化后旧的密钥不再使用
+    MAX_SIGNING_KEYS = 8
+
+    def __init__(self, access_key, secret_key, region="cn-north-1", service="cv", http_client=None):
+        """
+        Args:
+            access_key: 火山引擎API的访问密钥
+            secret_key: 火山引擎API的密钥
+            region: 区域，默认为cn-north-1
+            service: 服务名称，默认为cv
+            http_client: 共享的HttpClient连接池，为None时使用一次性会话
+        """
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.service = service
+        self.http_client = http_client
+        # (日期, 区域, 服务) -> 签名密钥
+        self._signing_keys = {}
+
+    def signing_key(self, datestamp, region=None, service=None):
+        """获取某一天的签名密钥，同一组参数只计算一次"""
+        cache_key = (datestamp, region or self.region, service or self.service)
+        signing_key = self._signing_keys.get(cache_key)
+        if signing_key is None:
+            if len(self._signing_keys) >= self.MAX_SIGNING_KEYS:
+                self._signing_keys.clear()
+            signing_key = getSignatureKey(self.secret_key, *cache_key)
+            self._signing_keys[cache_key] = signing_key
+        return signing_key
+
+    def sign(self, req_query, req_body, now=None):
+        """
+        为请求生成签名后的请求头
+
+        Args:
+            req_query: 格式化后的查询字符串
+            req_body: 请求体字符串
+            now: 签名时间，默认为当前UTC时间
+
+        Returns:
+            dict: 请求头
+        """
+        t = now or datetime.now(timezone.utc)
+        current_date = t.strftime('%Y%m%dT%H%M%SZ')
+        datestamp = current_date[:8]  # Date w/o time, used in credential scope
+        payload_hash = hashlib.sha256(req_body.encode('utf-8')).hexdigest()
+        canonical_request = (
+            f"{method}\n/\n{req_query}\n"
+            f"content-type:{content_type}\nhost:{host}\n"
+            f"x-content-sha256:{payload_hash}\nx-date:{current_date}\n"
+            f"\n{signed_headers}\n{payload_hash}"
+        )
+        credential_scope = f"{datestamp}/{self.region}/{self.service}/request"
+        string_to_sign = (
+            f"{algorithm}\n{current_date}\n{credential_scope}\n"
+            + hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+        )
+        signature = hmac.new(self.signing_key(datestamp), string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+        return {
+            'X-Date': current_date,
+            'Authorization': f"{algorithm} Credential={self.access_key}/{credential_scope}, "
+                             f"SignedHeaders={signed_headers}, Signature={signature}",
+            'X-Content-Sha256': payload_hash,
+            'Content-Type': content_type
+        }
+
+    async def request(self, query_params, body_params):
+        """
+        发送签名请求
+
+        Args:
+            query_params: 查询参数字典
+            body_params: 请求体字典
+
+        Returns:
+            dict: API返回的JSON结果，code 为10000
+
+        Raises:
+            RetryableError: 限流或服务端错误，可以稍后重试
+            ServiceError: 其他非200状态码，或错误码不是10000，计入熔断器的失败
+        """
+        if not self.access_key or not self.secret_key:
+            logger.error('No access key is available.')
+            return None
+
+        req_query = formatQuery(query_params)
+        req_body = json.dumps(body_params)
+        start = time.perf_counter()
+        headers = self.sign(req_query, req_body)
+        signed_at = time.perf_counter()
+
+        request_url = endpoint + '?' + req_query
+
+        async def post():
+            async with open_request(self.http_client, "volcengine", "POST", request_url, headers=headers, data=req_body) as response:
+                if response.status in RETRYABLE_STATUS:
+                    raise RetryableError(f"状态码 {response.status}")
+                if response.status != 200:
+                    raise ServiceError(f"状态码 {response.status}")
+                result = await response.json(content_type=None)
+                if not isinstance(result, dict):
+                    raise ServiceError("响应不是JSON对象")
+                if result.get("code") in RETRYABLE_CODES:
+                    raise RetryableError(f"错误码 {result.get('code')}: {result.get('message')}")
+                if result.get("code") != 10000:
+                    raise ServiceError(f"错误码 {result.get('code')}: {result.get('message')}")
+                return response.status, result
+
+        METRICS.inc("volcengine_requests")
+        try:
+            with span("volcengine.request", action=query_params.get('Action'),
+                      sign_ms=round((signed_at - start) * 1000, 3)) as attrs:
+                # 录制和回放时以Action和请求体作为请求键，签名中的时间戳不参与匹配
+                status, result = await CASSETTE.call("volcengine", f"{query_params.get('Action')}:{req_body}", post)
+                attrs["status_code"] = status
+            logger.info(
+                f"火山引擎请求 {query_params.get('Action')} 完成，状态码: {status}，"
+                f"签名耗时 {(signed_at - start) * 1000:.2f} 毫秒，总耗时 {time.perf_counter() - start:.2f} 秒"
+            )
+            return result
+        except Exception as err:
+            METRICS.inc("volcengine_errors")
+            logger.error(f"火山引擎请求失败，耗时 {time.perf_counter() - start:.2f} 秒: {err}")
+            raise
+
+    async def generate_image(self, prompt, width=1024, height=1024, model="high_aes_general_v21_L", schedule_conf="general_v20_9B_pe", return_url=True):
+        """
+        生成图片
+
+        Args:
+            prompt: 图片生成提示词
+            width: 图片宽度，默认1024
+            height: 图片高度，默认1024
+            model: 模型名称，默认为high_aes_general_v21_L
+            schedule_conf: 调度配置，默认为general_v20_9B_pe
+            return_url: 为True时返回图片地址（data.image_urls），
+                为False时在响应中直接返回base64编码的图片数据（data.binary_data_base64）
+
+        Returns:
+            dict: API返回的JSON结果
+        """
+        # 请求Query，按照接口文档中填入即可
+        query_params = {
+            'Action': 'CVProcess',
+            'Version': '2022-08-31',
+        }
+
+        # 请求Body，按照接口文档中填入即可
+        body_params = {
+            "req_key": model,
+            "prompt": prompt,
+            "width": width,
+            "height": height,
+            "use_pre_llm": True,
+            "use_sr": True,
+            "return_url": return_url,
+            "schedule_conf": schedule_conf,
+            "logo_info": {
+                "add_logo": False
+            }
+        }
+
+        return await self.request(query_params, body_params)
+
+
+async def generate_image(access_key, secret_key, prompt, width=1024, height=1024, model="high_aes_general_v21_L", schedule_conf="general_v20_9B_pe", region="cn-north-1", service="cv", http_client=None, return_url=True):
+    """
+    生成图片的函数，每次调用创建一个临时的 VolcengineClient，需要复用签名密钥时请直接使用 VolcengineClient
 
     Args:
         access_key: 火山引擎API的访问密钥
@@ -104,31 +235,11 @@ async def generate_image(access_key, secret_key, prompt, width=1024, height=1024
         schedule_conf: 调度配置，默认为general_v20_9B_pe
         region: 区域，默认为cn-north-1
         service: 服务名称，默认为cv
+        http_client: 共享的HttpClient连接池，为None时使用一次性会话
+        return_url: 为True时返回图片地址，为False时直接返回base64编码的图片数据
 
     Returns:
         dict: API返回的JSON结果
     """
-    # 请求Query，按照接口文档中填入即可
-    query_params = {
-        'Action': 'CVProcess',
-        'Version': '2022-08-31',
-    }
-    formatted_query = formatQuery(query_params)
-
-    # 请求Body，按照接口文档中填入即可
-    body_params = {
-        "req_key": model,
-        "prompt": prompt,
-        "width": width,
-        "height": height,
-        "use_pre_llm": True,
-        "use_sr": True,
-        "return_url": True,
-        "schedule_conf": schedule_conf,
-        "logo_info": {
-            "add_logo": False
-        }
-    }
-    formatted_body = json.dumps(body_params)
-
-    return await signV4Request(access_key, secret_key, service, formatted_query, formatted_body, region)
+    client = VolcengineClient(access_key, secret_key, region, service, http_client)
+    return await client.generate_image(prompt, width, height, model, schedule_conf, return_url)
@@ -1,41 +1,69 @@
 import random
-import logging
 from astrbot.api import logger
 
-# 一些备用的食物列表，当LLM不可用时使用
-BACKUP_FOODS = {
-    "早餐": [
-        "豆浆油条", "煎饼果子", "馄饨", "包子", "饺子", "茶叶蛋", "小米粥", "八宝粥",
-        "烧饼", "肉夹馍", "手抓饼", "生煎包", "麻球", "三明治", "鸡蛋饼", "馒头", "茶鸡蛋"
-    ],
-    "中餐": [
-        "红烧肉", "回锅肉", "宫保鸡丁", "麻婆豆腐", "水煮鱼", "东坡肉", "糖醋排骨",
-        "鱼香肉丝", "西红柿炒鸡蛋", "小龙虾", "火锅", "酸菜鱼", "北京烤鸭", "清蒸鲈鱼",
-        "葱爆羊肉", "辣子鸡", "酸辣土豆丝", "蒜蓉西兰花", "红烧排骨", "红烧猪蹄"
-    ],
-    "晚餐": [
-        "红烧肉", "回锅肉", "宫保鸡丁", "麻婆豆腐", "水煮鱼", "东坡肉", "糖醋排骨",
-        "鱼香肉丝", "西红柿炒鸡蛋", "小龙虾", "火锅", "酸菜鱼", "北京烤鸭", "清蒸鲈鱼",
-        "葱爆羊肉", "辣子鸡", "酸辣土豆丝", "蒜蓉西兰花", "红烧排骨", "红烧猪蹄"
-    ],
-    "快餐": [
-        "汉堡", "炸鸡", "披萨", "薯条", "热狗", "墨西哥卷饼", "寿司", "炒面", "盖浇饭",
-        "麻辣烫", "煎饼果子", "肉夹馍", "米线", "串串香", "烤肉饭", "卤肉饭", "土豆饼",
-        "鸡肉卷"
-    ],
-    "面食": [
-        "重庆小面", "担担面", "阳春面", "牛肉面", "刀削面", "兰州拉面", "热干面", "炸酱面",
-        "麻辣面", "海鲜面", "打卤面", "酸辣面", "葱油拌面", "鸡汤面", "肉丝面", "榨菜肉丝面"
-    ],
-    "甜点": [
-        "冰淇淋", "蛋糕", "巧克力", "饼干", "奶茶", "果冻", "布丁", "芝士蛋糕", "蛋挞",
-        "豆花", "豆腐脑", "凉粉", "杨枝甘露", "西米露", "绿豆沙", "红豆沙冰", "芒果捞"
-    ]
-}
+from .keyword_matcher import KeywordMatcher
+from .tracing import span
+from .metrics import METRICS
+from .llm_utils import provider_chat
+from .resilience import CircuitOpenError
+from .food_catalog import FOOD_CATALOG
+
+def _pick_backup_foods(meal_type, count, exclude=(), temperature=None, season=None, preferences=None):
+    """从本地食物目录中随机选出最多count个不在exclude中、适合当前季节、温度和偏好的食物"""
+    return FOOD_CATALOG.sample(
+        meal_type, count, exclude,
+        tags=preferences or (),
+        season=season,
+        temperature=temperature
+    )
+
+def extract_preferences(user_text):
+    """提取用户文本中可能包含的食物偏好关键词"""
+    if not user_text:
+        return []
+    found = PREFERENCE_MATCHER.find_labels(user_text)
+    return [preference for preference in PREFERENCE_KEYWORDS if preference in found]
+
+def _clean_food_name(text):
+    """清理LLM返回的单个食物名称，去掉序号和多余的文字"""
+    food = text.strip().lstrip("-*•").strip()
+    # 去掉"1."、"1、"、"1)"之类的序号
+    index = 0
+    while index < len(food) and food[index].isdigit():
+        index += 1
+    if index and index < len(food) and food[index] in ".、)）:：":
+        food = food[index + 1:].strip()
+    # 如果返回的内容太长，可能不是单纯的食物名称，进行处理
+    if len(food) > 20:
+        # 尝试提取第一个句子或短语
+        food = food.split('。')[0].split('，')[0].split('、')[0].strip()
+    return food
+
+def parse_food_candidates(text):
+    """
+    解析LLM返回的候选食物列表
+
+    Args:
+        text: LLM返回的文本，每行一个食物，也兼容用逗号或顿号分隔
 
-async def generate_food(meal_type=None, weather=None, temperature=None, season=None, user_text=None, context=None):
+    Returns:
+        list: 去重后的食物名称列表，保持原有顺序
+    """
+    if not text:
+        return []
+    lines = [line for line in text.replace("\r", "").split("\n") if line.strip()]
+    # 只有一行时，尝试按分隔符拆分
+    if len(lines) == 1:
+        for separator in ["、", "，", ","]:
+            if separator in lines[0]:
+                lines = lines[0].split(separator)
+                break
+    foods = [_clean_food_name(line) for line in lines]
+    return list(dict.fromkeys(food for food in foods if food))
+
+async def generate_food_candidates(meal_type=None, weather=None, temperature=None, season=None, user_text=None, context=None, count=5, exclude=(), preferences=None):
     """
-    动态生成食物推荐
+    一次生成多个按推荐程度排序的候选食物
 
     Args:
         meal_type: 餐点类型（早餐、中餐、晚餐等）
@@ -44,28 +72,30 @@ async def generate_food(meal_type=None, weather=None, temperature=None, season=N
         season: 季节
         user_text: 用户输入的文本
         context: 上下文对象，用于调用LLM
+        count: 候选食物数量
+        exclude: 需要避开的食物（如最近推荐过的）
+        preferences: 已解析的偏好标签，为None时从user_text中提取
 
     Returns:
-        str: 推荐的食物名称
+        list: 候选食物名称列表，已过滤掉exclude中的食物；全部被过滤时保留原列表
     """
-    # 检查是否可以使用LLM
-    can_use_llm = context
+    exclude = set(exclude or ())
+    # 用户文本中可能包含的偏好
+    if preferences is None:
+        preferences = extract_preferences(user_text)
 
-    if not can_use_llm:
+    # 检查是否可以使用LLM
+    if not context:
         # 如果无法使用LLM，使用备选方法
         logger.info(f"无法使用LLM，使用备选方法")
-        if meal_type and meal_type in BACKUP_FOODS:
-            return random.choice(BACKUP_FOODS[meal_type])
-        else:
-            # 从所有食物中随机选择
-            all_foods = []
-            for foods in BACKUP_FOODS.values():
-                all_foods.extend(foods)
-            return random.choice(all_foods)
+        return _pick_backup_foods(meal_type, count, exclude, temperature, season, preferences)
 
     try:
         # 构建提示词
-        prompt = "请推荐一道适合现在吃的美食，只返回美食名称，不要有任何其他文字。"
+        if count == 1:
+            prompt = "请推荐一道适合现在吃的美食，只返回美食名称，不要有任何其他文字。"
+        else:
+            prompt = f"请推荐{count}道适合现在吃的不同美食，按推荐程度从高到低排列，每行一个，只返回美食名称，不要有序号或任何其他文字。"
 
         # 添加餐点类型信息
         if meal_type:
@@ -80,86 +110,110 @@ async def generate_food(meal_type=None, weather=None, temperature=None, season=N
             prompt += f"\n当前季节：{season}。"
 
         # 添加用户文本中可能包含的偏好
-        if user_text:
-            # 提取可能的食物偏好关键词
-            preferences = []
-            if "辣" in user_text:
-                preferences.append("辣")
-            if "甜" in user_text:
-                preferences.append("甜")
-            if "酸" in user_text:
-                preferences.append("酸")
-            if "咸" in user_text:
-                preferences.append("咸")
-            if "素" in user_text or "蔬菜" in user_text:
-                preferences.append("素食")
-            if "肉" in user_text:
-                preferences.append("肉类")
-            if "海鲜" in user_text or "鱼" in user_text:
-                preferences.append("海鲜")
-
-            if preferences:
-                prompt += f"\n考虑以下偏好：{', '.join(preferences)}。"
-
-        # 使用context调用LLM生成食物推荐
-        food = ""
-
-        # 尝试使用context.llm_recommend_food方法
-        if hasattr(context, 'llm_recommend_food'):
-            try:
-                # 我们应该使用context.get_using_provider()来调用大模型
-                # 而不是使用context.llm_recommend_food方法
-                # 所以这里直接跳过，使用下面的get_using_provider方法
-                raise Exception("跳过llm_recommend_food方法，使用get_using_provider方法")
-            except Exception as e:
-                logger.error(f"使用context.llm_recommend_food生成食物失败: {e}")
+        if preferences:
+            prompt += f"\n考虑以下偏好：{', '.join(preferences)}。"
+
+        # 避开最近推荐过的食物
+        if exclude:
+            # 排序后提示词与集合的遍历顺序无关，相同的历史得到相同的提示词
+            prompt += f"\n不要推荐以下食物：{'、'.join(sorted(exclude))}。"
 
-        # 如果使用context.llm_recommend_food失败，尝试使用context.get_using_provider()
-        if not food and hasattr(context, 'get_using_provider') and callable(getattr(context, 'get_using_provider')):
+        # 使用context.get_using_provider()调用LLM
+        text = ""
+        if hasattr(context, 'get_using_provider') and callable(getattr(context, 'get_using_provider')):
             try:
                 provider = context.get_using_provider()
                 if provider:
                     session_id = f"food_recommendation_{random.randint(1000, 9999)}"
-                    llm_response = await provider.text_chat(
-                        prompt=prompt,
-                        session_id=session_id
-                    )
+                    with span("llm", session="food_recommendation", prompt_chars=len(prompt)):
+                        text = await provider_chat(provider, prompt, session_id)
                     logger.info(f"成功使用context.get_using_provider()调用大模型")
-                    food = llm_response.completion_text.strip() if hasattr(llm_response, 'completion_text') else llm_response.strip()
                 else:
                     logger.warning(f"无法获取provider，跳过")
+            except CircuitOpenError:
+                logger.info("LLM熔断中，直接使用本地食物目录")
             except Exception as e:
                 logger.error(f"使用context.get_using_provider()生成食物失败: {e}")
 
-        # 如果两种方法都失败，使用备选方法
-        if not food:
-            logger.error(f"所有LLM方法都失败，使用备选方法")
-            if meal_type and meal_type in BACKUP_FOODS:
-                return random.choice(BACKUP_FOODS[meal_type])
-            else:
-                # 从所有食物中随机选择
-                all_foods = []
-                for foods in BACKUP_FOODS.values():
-                    all_foods.extend(foods)
-                return random.choice(all_foods)
-
-        # 如果返回的内容太长，可能不是单纯的食物名称，进行处理
-        if len(food) > 20:
-            # 尝试提取第一个句子或短语
-            sentences = food.split('。')[0].split('，')[0].split('、')[0]
-            food = sentences.strip()
-
-        logger.info(f"LLM生成的食物推荐: {food}")
-        return food
+        candidates = parse_food_candidates(text)[:count]
+        if not candidates:
+            logger.error(f"LLM没有返回可用的食物，使用备选方法")
+            return _pick_backup_foods(meal_type, count, exclude, temperature, season, preferences)
+
+        # 过滤掉最近推荐过的食物
+        filtered = [food for food in candidates if food not in exclude]
+        if len(filtered) < len(candidates):
+            METRICS.inc("dedupe_filtered", len(candidates) - len(filtered))
+        if not filtered:
+            METRICS.inc("dedupe_backfill")
+            logger.info(f"LLM返回的候选食物都与历史重复，补充备用食物")
+            filtered = _pick_backup_foods(meal_type, count, exclude, temperature, season, preferences)
+
+        logger.info(f"LLM生成的候选食物: {filtered}")
+        return filtered
 
     except Exception as e:
-        logger.error(f"动态生成食物失败: {e}")
+        logger.error(f"动态生成候选食物失败: {e}")
         # 出错时使用备选方法
-        if meal_type and meal_type in BACKUP_FOODS:
-            return random.choice(BACKUP_FOODS[meal_type])
-        else:
-            # 从所有食物中随机选择
-            all_foods = []
-            for foods in BACKUP_FOODS.values():
-                all_foods.extend(foods)
-            return random.choice(all_foods)
+        return _pick_backup_foods(meal_type, count, exclude, temperature, season, preferences)
+
+async def rerank_food_candidates(candidates, meal_type=None, weather=None, temperature=None, season=None, preferences=None, context=None):
+    """
+    让LLM按推荐程度重新排列本地排序得到的候选食物
+
+    Args:
+        candidates: 候选食物名称列表
+        其余参数同 generate_food_candidates
+
+    Returns:
+        list: 重新排列后的候选食物，只包含原有的食物；LLM不可用或出错时返回原列表
+    """
+    if len(candidates) < 2 or not context or not hasattr(context, 'get_using_provider'):
+        return candidates
+
+    prompt = f"以下是候选美食：{'、'.join(candidates)}。\n请按适合现在吃的程度从高到低重新排列，每行一个，只返回美食名称，不要有序号或任何其他文字。"
+    if meal_type:
+        prompt += f"\n考虑这是{meal_type}时段。"
+    if weather and temperature:
+        prompt += f"\n当前天气：{weather}，温度：{temperature}°C。"
+    if season:
+        prompt += f"\n当前季节：{season}。"
+    if preferences:
+        prompt += f"\n考虑以下偏好：{', '.join(preferences)}。"
+
+    try:
+        provider = context.get_using_provider()
+        if not provider:
+            return candidates
+        session_id = f"food_rerank_{random.randint(1000, 9999)}"
+        with span("llm", session="food_rerank", prompt_chars=len(prompt)):
+            text = await provider_chat(provider, prompt, session_id)
+    except CircuitOpenError:
+        logger.info("LLM熔断中，保持本地排序的顺序")
+        return candidates
+    except Exception as e:
+        logger.error(f"LLM重新排序候选食物失败: {e}")
+        return candidates
+
+    # 只保留原有的候选，LLM漏掉的按原顺序补在后面
+    known = set(candidates)
+    ranked = [food for food in parse_food_candidates(text) if food in known]
+    ranked.extend(food for food in candidates if food not in ranked)
+    logger.info(f"LLM重新排序后的候选食物: {ranked}")
+    return ranked
+
+# 用户文本中的偏好关键词，偏好标签 -> 关键词列表
+PREFERENCE_KEYWORDS = {
+    "辣": ["辣"],
+    "甜": ["甜"],
+    "酸": ["酸"],
+    "咸": ["咸"],
+    "素食": ["素", "蔬菜"],
+    "肉类": ["肉"],
+    "海鲜": ["海鲜", "鱼"]
+}
+
+PREFERENCE_MATCHER = KeywordMatcher()
+for _preference, _keywords in PREFERENCE_KEYWORDS.items():
+    PREFERENCE_MATCHER.add_all(_keywords, _preference)
+PREFERENCE_MATCHER.build()
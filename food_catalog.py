@@ -0,0 +1,233 @@
+import os
+import json
+import random
+from array import array
+from astrbot.api import logger
+
+# 随插件发布的食物目录
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "food_catalog.json")
+
+# 没有温度限制的食物使用的范围
+TEMPERATURE_MIN = -128
+TEMPERATURE_MAX = 127
+
+# 缓存的查询结果数量上限，超过后清空
+MAX_CACHED_QUERIES = 4096
+
+
+def parse_temperature(temperature):
+    """把温度转换为整数，无法解析时返回None"""
+    if temperature is None:
+        return None
+    try:
+        return max(TEMPERATURE_MIN, min(TEMPERATURE_MAX, int(round(float(temperature)))))
+    except (TypeError, ValueError):
+        return None
+
+
+class FoodCatalog:
+    """
+    本地食物目录
+
+    每道食物包含适合的餐点类型、口味标签、季节和温度范围。加载时把这些属性转换为紧凑的数组：
+    餐点类型、标签和季节各用一个位掩码表示，温度用两个有符号字节表示；
+    同时为每个餐点类型、标签和季节建立食物编号的索引。
+
+    查询从最小的索引开始，用位掩码检查其余条件，结果按条件缓存，
+    不使用大模型时的推荐只需要一次字典查找和一次随机抽样。
+    """
+
+    def __init__(self, path=None):
+        self._reset()
+        if path:
+            self.load(path)
+
+    def _reset(self):
+        self.names = []
+        self.meal_types = []
+        self.tags = []
+        self.seasons = []
+        # 食物名称 -> 编号
+        self._ids = {}
+        self._meal_masks = array("H")
+        self._tag_masks = array("H")
+        self._season_masks = array("B")
+        self._temperature_min = array("b")
+        self._temperature_max = array("b")
+        # 餐点类型 / 标签 / 季节 -> 食物编号数组
+        self._by_meal_type = {}
+        self._by_tag = {}
+        self._by_season = {}
+        # (餐点类型, 标签, 季节, 温度) -> 食物编号数组
+        self._queries = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    def index(self, name):
+        """返回食物的编号，不在目录中时返回None"""
+        return self._ids.get(name)
+
+    def columns(self):
+        """
+        返回按食物编号排列的属性数组，供批量计算使用
+
+        Returns:
+            dict: meal_types、tags、seasons 为位掩码（第 i 位对应同名列表中的第 i 项），
+                temperature_min、temperature_max 为适宜温度范围
+        """
+        return {
+            "meal_types": self._meal_masks,
+            "tags": self._tag_masks,
+            "seasons": self._season_masks,
+            "temperature_min": self._temperature_min,
+            "temperature_max": self._temperature_max,
+        }
+
+    def load(self, path):
+        """从JSON文件加载目录"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.build(json.load(f))
+            logger.info(f"已加载食物目录: {len(self)} 道食物")
+        except Exception as e:
+            logger.error(f"加载食物目录失败 {path}: {e}")
+
+    def build(self, data):
+        """
+        根据目录数据建立数组和索引
+
+        Args:
+            data: 包含 meal_types、tags、seasons 和 foods 的字典；每道食物包含 name、meal_types，
+                可选 tags、seasons（省略表示四季皆宜）和 temperature（[最低, 最高]，省略表示不限）
+        """
+        self._reset()
+        self.meal_types = list(data.get("meal_types", []))
+        self.tags = list(data.get("tags", []))
+        self.seasons = list(data.get("seasons", []))
+        meal_bits = {name: 1 << i for i, name in enumerate(self.meal_types)}
+        tag_bits = {name: 1 << i for i, name in enumerate(self.tags)}
+        season_bits = {name: 1 << i for i, name in enumerate(self.seasons)}
+        all_seasons = (1 << len(self.seasons)) - 1
+
+        for food in data.get("foods", []):
+            name = food["name"]
+            if name in self._ids:
+                continue
+            food_id = len(self.names)
+            self._ids[name] = food_id
+            self.names.append(name)
+
+            meal_mask = 0
+            for meal_type in food.get("meal_types", []):
+                if meal_type in meal_bits:
+                    meal_mask |= meal_bits[meal_type]
+                    self._by_meal_type.setdefault(meal_type, array("I")).append(food_id)
+            tag_mask = 0
+            for tag in food.get("tags", []):
+                if tag in tag_bits:
+                    tag_mask |= tag_bits[tag]
+                    self._by_tag.setdefault(tag, array("I")).append(food_id)
+            season_mask = 0
+            for season in food.get("seasons") or self.seasons:
+                if season in season_bits:
+                    season_mask |= season_bits[season]
+                    self._by_season.setdefault(season, array("I")).append(food_id)
+
+            self._meal_masks.append(meal_mask)
+            self._tag_masks.append(tag_mask)
+            self._season_masks.append(season_mask or all_seasons)
+            low, high = food.get("temperature") or (TEMPERATURE_MIN, TEMPERATURE_MAX)
+            self._temperature_min.append(parse_temperature(low))
+            self._temperature_max.append(parse_temperature(high))
+
+    def query(self, meal_type=None, tags=(), season=None, temperature=None):
+        """
+        查找同时满足所有条件的食物
+
+        目录中没有的餐点类型、标签和季节会被忽略。
+
+        Args:
+            meal_type: 餐点类型
+            tags: 口味标签，需要全部满足
+            season: 季节
+            temperature: 当前温度，只返回适合该温度的食物
+
+        Returns:
+            array: 食物编号
+        """
+        tags = tuple(sorted(tag for tag in set(tags or ()) if tag in self.tags))
+        meal_type = meal_type if meal_type in self.meal_types else None
+        season = season if season in self.seasons else None
+        temperature = parse_temperature(temperature)
+        key = (meal_type, tags, season, temperature)
+        result = self._queries.get(key)
+        if result is not None:
+            return result
+
+        # 从最小的索引开始，其余条件用位掩码检查
+        indexes = [self._by_tag.get(tag, array("I")) for tag in tags]
+        if meal_type is not None:
+            indexes.append(self._by_meal_type.get(meal_type, array("I")))
+        if season is not None:
+            indexes.append(self._by_season.get(season, array("I")))
+        base = min(indexes, key=len) if indexes else range(len(self.names))
+
+        meal_mask = 1 << self.meal_types.index(meal_type) if meal_type is not None else 0
+        tag_mask = 0
+        for tag in tags:
+            tag_mask |= 1 << self.tags.index(tag)
+        season_mask = 1 << self.seasons.index(season) if season is not None else 0
+        meal_masks, tag_masks, season_masks = self._meal_masks, self._tag_masks, self._season_masks
+        low, high = self._temperature_min, self._temperature_max
+        result = array("I", (
+            food_id for food_id in base
+            if (not meal_mask or meal_masks[food_id] & meal_mask)
+            and tag_masks[food_id] & tag_mask == tag_mask
+            and (not season_mask or season_masks[food_id] & season_mask)
+            and (temperature is None or low[food_id] <= temperature <= high[food_id])
+        ))
+
+        if len(self._queries) >= MAX_CACHED_QUERIES:
+            self._queries.clear()
+        self._queries[key] = result
+        return result
+
+    def sample(self, meal_type=None, count=1, exclude=(), tags=(), season=None, temperature=None):
+        """
+        随机选出最多 count 个满足条件且不在 exclude 中的食物
+
+        没有满足条件的食物时，依次放宽温度、季节和口味条件；
+        所有食物都在 exclude 中时，忽略 exclude。
+
+        Returns:
+            list: 食物名称
+        """
+        excluded = {self._ids[name] for name in exclude or () if name in self._ids}
+        fallback = None
+        for conditions in (
+            (tags, season, temperature),
+            (tags, season, None),
+            (tags, None, None),
+            ((), None, None),
+        ):
+            pool = self.query(meal_type, *conditions)
+            if not pool:
+                continue
+            if fallback is None:
+                fallback = pool
+            # 多抽 len(excluded) 个，去掉需要排除的之后仍然足够
+            picked = random.sample(pool, min(len(pool), count + len(excluded)))
+            picked = [food_id for food_id in picked if food_id not in excluded][:count]
+            if picked:
+                return [self.names[food_id] for food_id in picked]
+        if fallback is None:
+            return []
+        return [self.names[food_id] for food_id in random.sample(fallback, min(count, len(fallback)))]
+
+
+# 插件共享的食物目录
+FOOD_CATALOG = FoodCatalog(CATALOG_PATH)
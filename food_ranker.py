@@ -0,0 +1,236 @@
+import math
+import heapq
+import random
+from astrbot.api import logger
+
+from .food_catalog import FOOD_CATALOG, parse_temperature
+
+# NumPy 是可选依赖，没有安装时使用纯Python实现，结果相同但较慢
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+    logger.info("未安装NumPy，食物排序使用纯Python实现")
+
+# 各类特征的默认权重
+DEFAULT_WEIGHTS = {
+    # 餐点类型匹配，权重最大，保证推荐的食物符合当前时段
+    "meal_type": 4.0,
+    # 每个匹配的口味偏好
+    "tag": 1.5,
+    # 适合当前季节
+    "season": 1.0,
+    # 当前温度在食物的适宜温度范围内
+    "temperature": 2.0,
+    # 雨雪天气时偏向适合低温的食物
+    "weather": 0.5,
+}
+
+# 雨雪天气的关键词，wttr.in 默认返回英文描述
+BAD_WEATHER_KEYWORDS = ("雨", "雪", "rain", "snow", "drizzle", "shower", "sleet", "thunder")
+# 适宜温度下限不高于该值的食物视为适合低温
+COLD_TEMPERATURE = 5
+
+
+def is_bad_weather(weather):
+    """判断天气描述是否是雨雪天气"""
+    if not weather:
+        return False
+    weather = str(weather).lower()
+    return any(keyword in weather for keyword in BAD_WEATHER_KEYWORDS)
+
+
+class FoodRanker:
+    """
+    在本地为整个食物目录打分排序，不调用大模型
+
+    每道食物是一个特征向量：餐点类型、口味标签、季节的独热编码，以及"适合低温"一列；
+    当前情境（餐点类型、天气、季节、偏好）转换为同样维度的权重向量，
+    分数是两者的点积，再加上当前温度是否在适宜温度范围内的得分。
+    多个情境可以组成矩阵一次算出所有分数。
+
+    从分数中选出前 k 个时使用 Gumbel-top-k 抽样：sampling_temperature 为0时总是取分数最高的，
+    越大结果越随机，相当于按 softmax(分数 / sampling_temperature) 不放回抽样。
+    """
+
+    def __init__(self, catalog, weights=None):
+        self.catalog = catalog
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self._size = None
+        self._features = None
+        self._temperature_min = None
+        self._temperature_max = None
+        self._rng = np.random.default_rng() if NUMPY_AVAILABLE else None
+
+    def _ensure_features(self):
+        """根据食物目录建立特征矩阵，目录重新加载后重建"""
+        if self._size == len(self.catalog) and self._features is not None:
+            return
+        columns = self.catalog.columns()
+        widths = (len(self.catalog.meal_types), len(self.catalog.tags), len(self.catalog.seasons))
+        if NUMPY_AVAILABLE:
+            blocks = []
+            for name, width in zip(("meal_types", "tags", "seasons"), widths):
+                masks = np.asarray(columns[name], dtype=np.int64)
+                blocks.append((masks[:, None] >> np.arange(width)) & 1)
+            low = np.asarray(columns["temperature_min"], dtype=np.float32)
+            blocks.append((low <= COLD_TEMPERATURE)[:, None])
+            self._features = np.hstack(blocks).astype(np.float32)
+            self._temperature_min = low
+            self._temperature_max = np.asarray(columns["temperature_max"], dtype=np.float32)
+        else:
+            self._features = []
+            for food_id in range(len(self.catalog)):
+                row = []
+                for name, width in zip(("meal_types", "tags", "seasons"), widths):
+                    mask = columns[name][food_id]
+                    row.extend((mask >> bit) & 1 for bit in range(width))
+                row.append(1 if columns["temperature_min"][food_id] <= COLD_TEMPERATURE else 0)
+                self._features.append(row)
+            self._temperature_min = list(columns["temperature_min"])
+            self._temperature_max = list(columns["temperature_max"])
+        self._size = len(self.catalog)
+
+    def context_vector(self, meal_type=None, weather=None, season=None, preferences=()):
+        """
+        把情境转换为与食物特征同维度的权重向量，目录中没有的餐点类型、偏好和季节会被忽略
+
+        Returns:
+            list: 权重
+        """
+        catalog = self.catalog
+        vector = [0.0] * (len(catalog.meal_types) + len(catalog.tags) + len(catalog.seasons) + 1)
+        offset = 0
+        if meal_type in catalog.meal_types:
+            vector[catalog.meal_types.index(meal_type)] = self.weights["meal_type"]
+        offset += len(catalog.meal_types)
+        for tag in set(preferences or ()):
+            if tag in catalog.tags:
+                vector[offset + catalog.tags.index(tag)] = self.weights["tag"]
+        offset += len(catalog.tags)
+        if season in catalog.seasons:
+            vector[offset + catalog.seasons.index(season)] = self.weights["season"]
+        if is_bad_weather(weather):
+            vector[-1] = self.weights["weather"]
+        return vector
+
+    def score_batch(self, contexts):
+        """
+        一次为多个情境的所有食物打分
+
+        Args:
+            contexts: 情境字典的列表，包含 meal_type、weather、temperature、season、preferences
+
+        Returns:
+            情境数 x 食物数的分数矩阵（安装了NumPy时为ndarray，否则为嵌套列表）
+        """
+        self._ensure_features()
+        vectors = [
+            self.context_vector(
+                context.get("meal_type"), context.get("weather"),
+                context.get("season"), context.get("preferences")
+            )
+            for context in contexts
+        ]
+        temperatures = [parse_temperature(context.get("temperature")) for context in contexts]
+        weight = self.weights["temperature"]
+
+        if NUMPY_AVAILABLE:
+            scores = np.asarray(vectors, dtype=np.float32).reshape(len(contexts), -1) @ self._features.T
+            # 没有温度的情境不计温度得分
+            known = np.array([t is not None for t in temperatures])
+            current = np.array([t if t is not None else 0 for t in temperatures], dtype=np.float32)[:, None]
+            suitable = (self._temperature_min <= current) & (current <= self._temperature_max) & known[:, None]
+            scores += np.float32(weight) * suitable
+            return scores
+
+        scores = []
+        for vector, temperature in zip(vectors, temperatures):
+            row = []
+            for food_id, features in enumerate(self._features):
+                score = sum(w * f for w, f in zip(vector, features) if w and f)
+                if temperature is not None and self._temperature_min[food_id] <= temperature <= self._temperature_max[food_id]:
+                    score += weight
+                row.append(score)
+            scores.append(row)
+        return scores
+
+    def score(self, **context):
+        """为单个情境的所有食物打分"""
+        return self.score_batch([context])[0]
+
+    def _excluded_ids(self, exclude):
+        ids = (self.catalog.index(name) for name in exclude or ())
+        return [food_id for food_id in ids if food_id is not None]
+
+    def rank_batch(self, contexts, k=5, sampling_temperature=0.0):
+        """
+        为多个情境各选出 k 个食物
+
+        Args:
+            contexts: 情境字典的列表，除打分用的字段外，可以包含需要避开的食物 exclude
+            k: 每个情境选出的食物数量
+            sampling_temperature: 抽样的随机程度，0 表示按分数从高到低
+
+        Returns:
+            list: 每个情境的食物名称列表，按抽样顺序排列
+        """
+        if not contexts or not len(self.catalog) or k <= 0:
+            return [[] for _ in contexts]
+        scores = self.score_batch(contexts)
+        names = self.catalog.names
+        # 为0时只加极小的噪声，使分数相同的食物随机排列
+        scale = max(float(sampling_temperature or 0.0), 1e-6)
+        results = []
+
+        if NUMPY_AVAILABLE:
+            size = scores.shape[1]
+            k = min(k, size)
+            rng = self._rng or np.random.default_rng()
+            uniform = rng.random(scores.shape, dtype=np.float32)
+            keys = scores / scale - np.log(-np.log(np.clip(uniform, 1e-12, None)))
+            rows, cols = [], []
+            for row, context in enumerate(contexts):
+                excluded = self._excluded_ids(context.get("exclude"))
+                # 所有食物都需要避开时，忽略 exclude
+                if excluded and len(set(excluded)) < size:
+                    rows.extend([row] * len(excluded))
+                    cols.extend(excluded)
+            if rows:
+                keys[rows, cols] = -np.inf
+            # 每行取出最大的 k 个，再按从大到小排列
+            top = np.argpartition(-keys, k - 1, axis=1)[:, :k] if k < size else np.tile(np.arange(size), (len(contexts), 1))
+            top = np.take_along_axis(top, np.argsort(-np.take_along_axis(keys, top, axis=1), axis=1), axis=1)
+            finite = np.isfinite(np.take_along_axis(keys, top, axis=1))
+            for food_ids, valid in zip(top.tolist(), finite.tolist()):
+                results.append([names[food_id] for food_id, ok in zip(food_ids, valid) if ok])
+            return results
+
+        for row, context in zip(scores, contexts):
+            excluded = set(self._excluded_ids(context.get("exclude")))
+            if len(excluded) >= len(row):
+                excluded = set()
+            keys = (
+                (score / scale - math.log(-math.log(random.random() or 1e-12)), food_id)
+                for food_id, score in enumerate(row) if food_id not in excluded
+            )
+            results.append([names[food_id] for _, food_id in heapq.nlargest(k, keys)])
+        return results
+
+    def rank(self, meal_type=None, weather=None, temperature=None, season=None, preferences=(), k=5, exclude=(), sampling_temperature=0.0):
+        """为单个情境选出 k 个食物，参数含义同 rank_batch"""
+        context = {
+            "meal_type": meal_type,
+            "weather": weather,
+            "temperature": temperature,
+            "season": season,
+            "preferences": preferences,
+            "exclude": exclude,
+        }
+        return self.rank_batch([context], k=k, sampling_temperature=sampling_temperature)[0]
+
+
+# 插件共享的食物排序器，使用共享的食物目录
+FOOD_RANKER = FoodRanker(FOOD_CATALOG)
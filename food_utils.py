@@ -1,33 +1,13 @@
 import datetime
 import random
-import aiohttp
 from astrbot.api import logger
 
-# 食物列表，分为不同类别
-FOOD_CATEGORIES = {
-    "中餐": [
-        "红烧肉", "回锅肉", "宫保鸡丁", "麻婆豆腐", "水煮鱼", "东坡肉", "糖醋排骨",
-        "鱼香肉丝", "西红柿炒鸡蛋", "小龙虾", "火锅", "酸菜鱼", "北京烤鸭", "清蒸鲈鱼",
-        "葱爆羊肉", "辣子鸡", "酸辣土豆丝", "蒜蓉西兰花", "红烧排骨", "红烧猪蹄"
-    ],
-    "快餐": [
-        "汉堡", "炸鸡", "披萨", "薯条", "热狗", "墨西哥卷饼", "寿司", "炒面", "盖浇饭",
-        "麻辣烫", "煎饼果子", "肉夹馍", "米线", "串串香", "烤肉饭", "卤肉饭", "土豆饼",
-        "鸡肉卷"
-    ],
-    "面食": [
-        "重庆小面", "担担面", "阳春面", "牛肉面", "刀削面", "兰州拉面", "热干面", "炸酱面",
-        "麻辣面", "海鲜面", "打卤面", "酸辣面", "葱油拌面", "鸡汤面", "肉丝面", "榨菜肉丝面"
-    ],
-    "早餐": [
-        "豆浆油条", "煎饼果子", "馄饨", "包子", "饺子", "茶叶蛋", "小米粥", "八宝粥",
-        "烧饼", "肉夹馍", "手抓饼", "生煎包", "麻球", "三明治", "鸡蛋饼", "馒头", "茶鸡蛋"
-    ],
-    "甜点": [
-        "冰淇淋", "蛋糕", "巧克力", "饼干", "奶茶", "果冻", "布丁", "芝士蛋糕", "蛋挞",
-        "豆花", "豆腐脑", "凉粉", "杨枝甘露", "西米露", "绿豆沙", "红豆沙冰", "芒果捞"
-    ]
-}
+from .cache import TTLCache
+from .http_client import open_request
+from .tracing import span
+from .metrics import METRICS
+from .cassette import CASSETTE
+from .resilience import circuit_breaker, HTTP_RETRY, RETRYABLE_STATUS, RetryableError, ServiceError, CircuitOpenError
 
 # 推荐理由模板 - 使用动态生成替代
 REASON_TEMPLATES = [
@@ -60,47 +40,89 @@ CHINA_CITIES = [
     "珠海", "惠州", "徐州", "海口", "乌鲁木齐", "绍兴", "中山", "台州", "兰州"
 ]
 
-# 获取天气信息的函数
-async def get_weather(user_text=None):
-    try:
-        # 默认城市为上海或北京
-        city = random.choice(["上海", "北京"])
+# wttr.in 的熔断器，打开期间直接使用缓存或默认天气
+WEATHER_BREAKER = circuit_breaker("weather", failure_threshold=5, reset_timeout=60.0)
 
-        # 如果提供了用户文本，尝试从中识别城市
-        if user_text:
-            # 首先检查user_text是否直接是一个城市名
-            if user_text in CHINA_CITIES:
-                city = user_text
-                logger.info(f"直接使用指定的城市: {city}")
-            else:
-                # 否则尝试从文本中识别城市
-                for c in CHINA_CITIES:
-                    if c in user_text:
-                        city = c
-                        logger.info(f"从用户文本中识别到城市: {city}")
-                        break
+# 天气缓存，按城市缓存，过期后先返回旧值并在后台刷新
+WEATHER_CACHE = TTLCache(ttl=1800, stale_ttl=6 * 3600, name="天气缓存")
+
+def configure_weather_cache(ttl=None, stale_ttl=None):
+    """根据配置调整天气缓存的过期时间（秒）"""
+    if ttl is not None:
+        WEATHER_CACHE.ttl = ttl
+    if stale_ttl is not None:
+        WEATHER_CACHE.stale_ttl = stale_ttl
+
+# 从用户文本中识别城市
+def detect_city(user_text=None):
+    # 默认城市为上海或北京
+    city = random.choice(["上海", "北京"])
+
+    # 如果提供了用户文本，尝试从中识别城市
+    if user_text:
+        # 首先检查user_text是否直接是一个城市名
+        if user_text in CHINA_CITIES:
+            city = user_text
+            logger.info(f"直接使用指定的城市: {city}")
+        else:
+            # 否则尝试从文本中识别城市
+            for c in CHINA_CITIES:
+                if c in user_text:
+                    city = c
+                    logger.info(f"从用户文本中识别到城市: {city}")
+                    break
+    return city
 
-        # 使用wttr.in API获取指定城市的天气
-        url = f"https://wttr.in/{city}?format=j1"
-        logger.info(f"获取城市 {city} 的天气信息")
+# 请求wttr.in获取天气，失败时返回None
+async def fetch_weather(city, http_client=None):
+    # 使用wttr.in API获取指定城市的天气
+    url = f"https://wttr.in/{city}?format=j1"
+    logger.info(f"获取城市 {city} 的天气信息")
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    current = data.get("current_condition", [{}])[0]
-                    temp_c = current.get("temp_C", "20")
-                    weather_desc = current.get("weatherDesc", [{"value": "晴朗"}])[0].get("value", "晴朗")
-                    return {
-                        "temperature": temp_c,
-                        "weather": weather_desc,
-                        "city": city
-                    }
-                else:
-                    # 如果API请求失败，返回默认值
-                    logger.warning(f"获取 {city} 天气失败，状态码: {response.status}")
-                    return {"temperature": "20", "weather": "晴朗", "city": city}
+    async def request():
+        async with open_request(http_client, "weather", "GET", url) as response:
+            attrs["status_code"] = response.status
+            if response.status == 200:
+                data = await response.json(content_type=None)
+                current = data.get("current_condition", [{}])[0]
+                temp_c = current.get("temp_C", "20")
+                weather_desc = current.get("weatherDesc", [{"value": "晴朗"}])[0].get("value", "晴朗")
+                return {
+                    "temperature": temp_c,
+                    "weather": weather_desc,
+                    "city": city
+                }
+            elif response.status in RETRYABLE_STATUS:
+                raise RetryableError(f"状态码 {response.status}")
+            else:
+                # 在熔断器内抛出，使持续返回错误状态码的服务也会熔断
+                raise ServiceError(f"状态码 {response.status}")
+
+    METRICS.inc("weather_requests")
+    try:
+        with span("weather.fetch", city=city) as attrs:
+            # 限流和服务端错误按退避时间重试，连续失败后熔断
+            return await HTTP_RETRY.run(lambda: CASSETTE.call("weather", city, request), WEATHER_BREAKER)
+    except CircuitOpenError:
+        logger.info(f"天气服务熔断中，跳过获取 {city} 的天气")
+        return None
+    except ServiceError as e:
+        METRICS.inc("weather_errors")
+        logger.warning(f"获取 {city} 天气失败，{e}")
+        return None
     except Exception as e:
+        METRICS.inc("weather_errors")
         logger.error(f"获取天气信息失败: {e}")
-        # 出错时返回默认值
-        return {"temperature": "20", "weather": "晴朗", "city": city if 'city' in locals() else "上海"}
+        return None
+
+# 获取天气信息的函数
+async def get_weather(user_text=None, http_client=None):
+    city = detect_city(user_text)
+    # 缓存命中时只有这一个span，未命中时其中还有 weather.fetch
+    with span("weather", city=city):
+        weather_info = await WEATHER_CACHE.get_or_fetch(city, lambda: fetch_weather(city, http_client))
+    if weather_info is None:
+        # 如果API请求失败，返回默认值
+        return {"temperature": "20", "weather": "晴朗", "city": city}
+    # 返回副本，避免调用方修改缓存中的数据
+    return dict(weather_info)
@@ -1,6 +1,31 @@
 import hashlib
 from astrbot.api import logger
 from .llm_utils import call_llm
+from .cache import LRUCache
+
+# 食物描述与天气、时间无关，按规范化后的食物名称缓存
+DESCRIPTION_CACHE = LRUCache(maxsize=2048, ttl=7 * 86400, name="食物描述缓存")
+
+def configure_description_cache(maxsize=None, ttl=None, path=None):
+    """
+    根据配置调整食物描述缓存
+
+    Args:
+        maxsize: 最多缓存的食物数量
+        ttl: 描述的有效时间（秒）
+        path: 持久化文件路径，设置后会立即加载已有的缓存
+    """
+    if maxsize is not None:
+        DESCRIPTION_CACHE.maxsize = maxsize
+    if ttl is not None:
+        DESCRIPTION_CACHE.ttl = ttl
+    if path is not None and path != DESCRIPTION_CACHE.path:
+        DESCRIPTION_CACHE.path = path
+        DESCRIPTION_CACHE.load()
+
+def normalize_food_name(food_name):
+    """规范化食物名称，去掉空白、引号和大小写差异，作为缓存键"""
+    return "".join(food_name.split()).strip("\"'“”‘’「」《》").lower()
 
 # 预定义的食物描述模板
 DESCRIPTION_TEMPLATES = [
@@ -21,7 +46,13 @@ def get_template_description(food_name):
 
 # 动态生成食物描述的函数
 async def generate_food_description(food_name, context=None):
-    """使用大模型生成食物描述"""
+    """使用大模型生成食物描述，结果按食物名称缓存"""
+    cache_key = normalize_food_name(food_name)
+    cached = DESCRIPTION_CACHE.get(cache_key)
+    if cached:
+        logger.info(f"使用缓存的\"{food_name}\"描述")
+        return cached
+
     # 构建提示词
     prompt = f"""请为食物"{food_name}"生成一段简短的描述，包含其特点、口感和鲜明特点。不超过50个字。
 只返回描述文本，不要包含其他内容。"""
@@ -29,10 +60,11 @@ async def generate_food_description(food_name, context=None):
     # 调用LLM
     description = await call_llm(context, prompt, session_id_prefix="food_description")
 
-    # 如果LLM调用失败，使用模板
+    # 如果LLM调用失败，使用模板，模板描述不写入缓存，下次仍会尝试LLM
     if not description:
         return get_template_description(food_name)
 
+    DESCRIPTION_CACHE.set(cache_key, description)
     return description
 
 # 预定义的推荐理由模板
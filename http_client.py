@@ -0,0 +1,193 @@
+import os
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit, urlunsplit
+
+import aiohttp
+from astrbot.api import logger
+
+from .tracing import span
+
+# 各外部接口的默认超时时间（秒）
+DEFAULT_TIMEOUTS = {
+    "weather": 10,
+    "volcengine": 60,
+    "image_download": 30,
+}
+
+# 流式下载时每次读取的字节数
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class DownloadTooLarge(Exception):
+    """下载内容超过允许的最大字节数"""
+
+
+class HttpClient:
+    """
+    插件共享的HTTP连接池
+
+    所有外部请求复用同一个 aiohttp.ClientSession，以便保持长连接、缓存DNS，
+    并按主机限制并发连接数。每个接口（endpoint）可以单独设置超时时间，
+    也可以把接口的地址重定向到本地替身服务器，便于测试。
+    """
+
+    def __init__(self, limit=100, limit_per_host=10, dns_ttl=300, keepalive_timeout=30,
+                 timeouts=None, base_urls=None):
+        """
+        Args:
+            limit: 连接池总连接数上限
+            limit_per_host: 每个主机的连接数上限
+            dns_ttl: DNS缓存时间（秒）
+            keepalive_timeout: 空闲连接保持时间（秒）
+            timeouts: 接口名称 -> 超时时间（秒），未设置的接口使用 DEFAULT_TIMEOUTS
+            base_urls: 接口名称 -> 替代地址（如 http://127.0.0.1:8080），
+                设置后该接口请求的协议和主机会被替换，用于接入本地替身服务器
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        self.base_urls = dict(base_urls or {})
+        self._session = None
+
+    @property
+    def closed(self):
+        return self._session is None or self._session.closed
+
+    async def start(self):
+        """创建连接池，必须在事件循环中调用"""
+        if not self.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self._session = aiohttp.ClientSession(connector=connector)
+        logger.info(f"HTTP连接池已创建，每个主机最多 {self.limit_per_host} 个连接")
+
+    async def close(self):
+        """关闭连接池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP连接池已关闭")
+        self._session = None
+
+    def timeout_for(self, endpoint):
+        """获取某个接口的超时设置"""
+        return aiohttp.ClientTimeout(total=self.timeouts.get(endpoint, 30))
+
+    def resolve_url(self, endpoint, url):
+        """如果接口配置了替代地址，替换URL中的协议和主机"""
+        base_url = self.base_urls.get(endpoint)
+        if not base_url:
+            return url
+        base = urlsplit(base_url)
+        parts = urlsplit(url)
+        return urlunsplit((base.scheme, base.netloc, parts.path, parts.query, parts.fragment))
+
+    def request(self, endpoint, method, url, **kwargs):
+        """
+        发送请求，用法与 aiohttp.ClientSession.request 相同
+
+        Args:
+            endpoint: 接口名称，用于选择超时时间和替代地址
+            method: HTTP方法
+            url: 请求地址
+        """
+        if self.closed:
+            raise RuntimeError("HTTP连接池尚未创建或已关闭")
+        kwargs.setdefault("timeout", self.timeout_for(endpoint))
+        return self._session.request(method, self.resolve_url(endpoint, url), **kwargs)
+
+
+@asynccontextmanager
+async def open_request(http_client, endpoint, method, url, **kwargs):
+    """
+    使用共享连接池发送请求；没有可用的连接池时，退回到一次性的会话
+
+    Args:
+        http_client: HttpClient对象，可以为None
+        endpoint: 接口名称
+        method: HTTP方法
+        url: 请求地址
+
+    Yields:
+        aiohttp.ClientResponse: 响应对象
+    """
+    if http_client is not None and not http_client.closed:
+        async with http_client.request(endpoint, method, url, **kwargs) as response:
+            yield response
+        return
+
+    kwargs.setdefault("timeout", aiohttp.ClientTimeout(total=DEFAULT_TIMEOUTS.get(endpoint, 30)))
+    async with aiohttp.ClientSession() as session:
+        async with session.request(method, url, **kwargs) as response:
+            yield response
+
+
+async def download_to_file(http_client, url, dest_path, endpoint="image_download", max_bytes=None, timeout=None):
+    """
+    流式下载文件到磁盘
+
+    响应按块读取并写入同目录下的临时文件，文件写入在线程池中执行，不阻塞事件循环；
+    下载完成后原子地重命名为目标文件，失败时删除临时文件，目标路径上不会出现不完整的文件。
+
+    Args:
+        http_client: HttpClient对象，可以为None
+        url: 下载地址
+        dest_path: 目标文件路径
+        endpoint: 接口名称
+        max_bytes: 允许的最大字节数，None 表示不限制
+        timeout: 整个下载的超时时间（秒），None 时使用接口的超时设置
+
+    Returns:
+        int: 下载的字节数
+
+    Raises:
+        DownloadTooLarge: 内容超过 max_bytes
+        aiohttp.ClientError: 请求失败或状态码不是200
+        asyncio.TimeoutError: 下载超时
+    """
+    kwargs = {}
+    if timeout is not None:
+        kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
+    loop = asyncio.get_running_loop()
+    tmp_path = os.path.join(os.path.dirname(dest_path) or ".", f".{uuid.uuid4().hex}.part")
+    size = 0
+    f = None
+    try:
+        with span("download", endpoint=endpoint) as attrs:
+            async with open_request(http_client, endpoint, "GET", url, **kwargs) as response:
+                attrs["status_code"] = response.status
+                response.raise_for_status()
+                if max_bytes and response.content_length and response.content_length > max_bytes:
+                    raise DownloadTooLarge(f"文件大小 {response.content_length} 字节超过限制 {max_bytes} 字节")
+
+                f = await loop.run_in_executor(None, open, tmp_path, "wb")
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if max_bytes and size > max_bytes:
+                        raise DownloadTooLarge(f"下载内容超过限制 {max_bytes} 字节")
+                    await loop.run_in_executor(None, f.write, chunk)
+
+            await loop.run_in_executor(None, f.close)
+            f = None
+            os.replace(tmp_path, dest_path)
+            attrs["bytes"] = size
+            return size
+    finally:
+        if f is not None:
+            await loop.run_in_executor(None, f.close)
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError as e:
+                logger.error(f"删除临时文件失败 {tmp_path}: {e}")
@@ -1,9 +1,41 @@
 import os
+import time
 import uuid
-import aiohttp
+import base64
+import asyncio
 from astrbot.api import logger
 
-async def generate_food_image(food_name, prompt=None, context=None, output_dir=None, width=1024, height=1024):
+from .http_client import download_to_file, DownloadTooLarge
+from .image_queue import PRIORITY_RECOMMENDATION
+from .cache import SingleFlight
+from .tracing import span
+from .metrics import METRICS
+from .cassette import CASSETTE, OmittedPayload
+
+# 合并并发的相同图片生成请求
+IMAGE_FLIGHT = SingleFlight()
+
+def _write_base64_image(encoded, dest_path, max_bytes=None):
+    """
+    把base64编码的图片解码后写入文件，先写入临时文件再原子地重命名
+
+    Returns:
+        int: 写入的字节数
+    """
+    data = base64.b64decode(encoded)
+    if max_bytes and len(data) > max_bytes:
+        raise DownloadTooLarge(f"图片大小 {len(data)} 字节超过限制 {max_bytes} 字节")
+    tmp_path = os.path.join(os.path.dirname(dest_path) or ".", f".{uuid.uuid4().hex}.part")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, dest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return len(data)
+
+async def generate_food_image(food_name, prompt=None, context=None, output_dir=None, width=1024, height=1024, priority=PRIORITY_RECOMMENDATION):
     """
     使用AI生成食物图片
 
@@ -14,6 +46,7 @@ async def generate_food_image(food_name, prompt=None, context=None, output_dir=N
         output_dir: 输出目录，如果为None则使用context中的OUTPUT_DIR
         width: 图片宽度，默认为1024
         height: 图片高度，默认为1024
+        priority: 在图片生成队列中的优先级，推荐图片优先于通用图片
 
     Returns:
         str: 生成的图片路径，如果失败则返回None
@@ -59,57 +92,132 @@ async def generate_food_image(food_name, prompt=None, context=None, output_dir=N
     try:
         # 导入doubao_image模块
         try:
-            from .doubao_image import generate_image
+            from .doubao_image import VolcengineClient, VOLCENGINE_BREAKER
+            from .resilience import HTTP_RETRY, ServiceError
 
             # 获取模型和配置
             model = context.config.get("volcengine_model", "high_aes_general_v21_L") if context and hasattr(context, 'config') else "high_aes_general_v21_L"
             schedule_conf = context.config.get("schedule_conf", "general_v20_9B_pe") if context and hasattr(context, 'config') else "general_v20_9B_pe"
             region = context.config.get("region", "cn-north-1") if context and hasattr(context, 'config') else "cn-north-1"
             service = context.config.get("service", "cv") if context and hasattr(context, 'config') else "cv"
+            # bytes：在生成接口的响应中直接返回图片数据；url：返回图片地址，再单独下载
+            return_url = (context.config.get("image_return_mode", "bytes") if context and hasattr(context, 'config') else "bytes") == "url"
+            # 使用插件共享的连接池
+            http_client = getattr(context, 'http_client', None)
+            # 优先使用插件共享的客户端，复用缓存的签名密钥
+            volcengine_client = getattr(context, 'volcengine_client', None)
+            if volcengine_client is None or (volcengine_client.access_key, volcengine_client.secret_key,
+                                             volcengine_client.region, volcengine_client.service) != (access_key, secret_key, region, service):
+                volcengine_client = VolcengineClient(access_key, secret_key, region, service, http_client)
+
+            # 相同参数生成过足够多的图片时，直接使用缓存
+            # 回放时不使用图片缓存，避免回放的占位图片被保存为缓存，关闭回放后仍被使用
+            image_store = getattr(context, 'image_store', None) if CASSETTE.mode != "replay" else None
+            cache_key = None
+            if image_store is not None:
+                cache_key = image_store.make_key(prompt, model, schedule_conf, width, height)
+                cached_path = image_store.get(cache_key)
+                if cached_path:
+                    logger.info(f"使用缓存的图片: {cached_path}")
+                    return cached_path
+
+            # 参数相同的并发请求合并为一次生成，所有调用方得到同一张图片
+            async def produce():
+                # 调用API生成图片，通过队列限制并发数和调用速率
+                submitted_at = time.perf_counter()
+
+                async def call_api():
+                    # queue_wait_ms 是在图片生成队列中等待的时间
+                    with span("image.generate", queue_wait_ms=round((time.perf_counter() - submitted_at) * 1000, 3)):
+                        return await volcengine_client.generate_image(
+                            prompt,
+                            width=width,
+                            height=height,
+                            model=model,
+                            schedule_conf=schedule_conf,
+                            return_url=return_url
+                        )
+
+                image_queue = getattr(context, 'image_queue', None)
+
+                async def attempt():
+                    # 每次尝试（包括重试）都重新排队并取得令牌，退避等待期间不占用队列的工作协程
+                    if image_queue is not None:
+                        return await image_queue.submit(call_api, priority=priority, label=food_name or prompt[:20])
+                    return await call_api()
 
-            # 调用API生成图片
-            result = await generate_image(
-                access_key,
-                secret_key,
-                prompt,
-                width=width,
-                height=height,
-                model=model,
-                schedule_conf=schedule_conf,
-                region=region,
-                service=service
-            )
-
-            # 检查结果
-            if result.get("code") == 10000:
-                # 成功生成图片
-                image_url = result["data"]["image_urls"][0]
-                logger.info(f"成功生成图片URL: {image_url}")
-
-                # 下载图片
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(image_url) as response:
-                            if response.status == 200:
-                                img_data = await response.read()
-                                local_path = os.path.join(output_dir, f"{food_name}_{uuid.uuid4().hex[:8]}.jpg")
-
-                                with open(local_path, "wb") as f:
-                                    f.write(img_data)
-
-                                # 记录临时图片
-                                if context and hasattr(context, 'temp_images'):
-                                    context.temp_images.add(local_path)
-                                    # 清理旧图片
-                                    if hasattr(context, '_cleanup_old_images'):
-                                        context._cleanup_old_images()
-
-                                logger.info(f"已下载生成的图片到: {local_path}")
-                                return local_path
+                    if not VOLCENGINE_BREAKER.available():
+                        # 熔断期间不再排队等待，直接使用缓存中的图片
+                        METRICS.inc("circuit_rejected", endpoint=VOLCENGINE_BREAKER.name)
+                        result = {"code": -1, "message": "火山引擎熔断中"}
+                    else:
+                        # 限流和服务端错误按退避时间重试，整个过程计入熔断器一次
+                        result = await HTTP_RETRY.run(attempt, VOLCENGINE_BREAKER)
+                except ServiceError as e:
+                    # 服务返回了错误响应，已计入熔断器的失败，尝试使用缓存中的图片
+                    logger.warning(f"火山引擎返回错误，{e}")
+                    result = {"code": -1, "message": str(e)}
                 except Exception as e:
-                    logger.error(f"下载生成的图片失败: {e}")
-            else:
-                logger.error(f"生成图片失败，错误码: {result.get('code')}, 消息: {result.get('message')}")
+                    # 重试后仍然失败或熔断时，同样尝试使用缓存中的图片
+                    result = {"code": -1, "message": str(e)}
+                result = result or {"code": -1, "message": "没有返回结果"}
+
+                # 检查结果
+                if result.get("code") == 10000:
+                    # 成功生成图片，保存到图片缓存或输出目录
+                    data = result.get("data") or {}
+                    if image_store is not None:
+                        local_path = image_store.new_path(cache_key)
+                    else:
+                        local_path = os.path.join(output_dir, f"{food_name}_{uuid.uuid4().hex[:8]}.jpg")
+                    max_bytes = getattr(context, 'image_download_max_bytes', None)
+                    try:
+                        if data.get("binary_data_base64"):
+                            if isinstance(data["binary_data_base64"][0], OmittedPayload):
+                                logger.info(f"{food_name or prompt[:20]}的图片数据是回放的占位数据，只作为临时图片保存")
+                            # 响应中已包含图片数据，在线程池中解码并写入，不需要再下载
+                            with span("image.decode") as attrs:
+                                size = await asyncio.get_running_loop().run_in_executor(
+                                    None, _write_base64_image, data["binary_data_base64"][0], local_path, max_bytes
+                                )
+                                attrs["bytes"] = size
+                        else:
+                            # 流式下载图片
+                            image_url = data["image_urls"][0]
+                            logger.info(f"成功生成图片URL: {image_url}")
+                            size = await download_to_file(http_client, image_url, local_path, max_bytes=max_bytes)
+
+                        # 缓存中的图片由缓存自己管理，不作为临时图片删除
+                        if image_store is not None:
+                            image_store.add_file(cache_key, local_path)
+                            logger.info(f"已保存生成的图片到缓存: {local_path}，{size // 1024} KB")
+                            return local_path
+
+                        # 记录临时图片，同时清理超出数量的旧图片
+                        if context and hasattr(context, 'output_manager'):
+                            context.output_manager.add(local_path, temporary=True)
+
+                        logger.info(f"已保存生成的图片到: {local_path}，{size // 1024} KB")
+                        return local_path
+                    except Exception as e:
+                        logger.error(f"保存生成的图片失败: {e}")
+                else:
+                    logger.error(f"生成图片失败，错误码: {result.get('code')}, 消息: {result.get('message')}")
+
+                # 生成失败时，如果缓存中有相同参数的图片，使用它
+                if image_store is not None:
+                    fallback_path = image_store.get_any(cache_key)
+                    if fallback_path:
+                        logger.info(f"生成失败，使用缓存中的图片: {fallback_path}")
+                        return fallback_path
+
+                return None
+
+            flight_key = (prompt, model, schedule_conf, width, height, output_dir, image_store is not None)
+            if IMAGE_FLIGHT.pending(flight_key):
+                METRICS.inc("coalesced", kind="image")
+            return await IMAGE_FLIGHT.do(flight_key, produce)
         except ImportError:
             logger.error("未找到doubao_image模块，无法生成图片")
         except Exception as e:
@@ -0,0 +1,179 @@
+import time
+import asyncio
+import itertools
+import contextvars
+from astrbot.api import logger
+
+# 任务优先级，数值越小越先执行
+PRIORITY_RECOMMENDATION = 0
+PRIORITY_GENERAL = 10
+# 预热任务在用户请求之后执行
+PRIORITY_PREWARM = 20
+
+
+class TokenBucket:
+    """令牌桶限流器，平均速率为 rate 次/秒，最多允许 capacity 次突发"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        """取得一个令牌，令牌不足时等待"""
+        if not self.rate or self.rate <= 0:
+            return
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class _Job:
+    __slots__ = ("factory", "future", "enqueued_at", "label", "context")
+
+    def __init__(self, factory, future, label):
+        self.factory = factory
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.label = label
+        # 提交任务时的上下文，任务在该上下文中执行，保留请求ID等信息
+        self.context = contextvars.copy_context()
+
+
+class ImageJobQueue:
+    """
+    图片生成任务队列
+
+    固定数量的工作协程从队列中取任务执行，每个任务开始前从令牌桶取得令牌，
+    使调用速率不超过账号的QPS配额。支持按优先级或先进先出的顺序执行，
+    并记录队列长度和等待时间。
+    """
+
+    def __init__(self, workers=2, rate=1.0, burst=1, ordering="priority"):
+        """
+        Args:
+            workers: 同时执行的任务数量
+            rate: 每秒最多开始的任务数量，0 表示不限速
+            burst: 令牌桶容量，即允许的突发任务数量
+            ordering: "priority" 按优先级执行，"fifo" 按提交顺序执行
+        """
+        self.workers = max(1, workers)
+        self.ordering = ordering
+        self.bucket = TokenBucket(rate, burst)
+        self._queue = None
+        self._seq = itertools.count()
+        self._worker_tasks = []
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    @property
+    def running(self):
+        return bool(self._worker_tasks)
+
+    @property
+    def depth(self):
+        """当前排队中的任务数量"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """启动工作协程，必须在事件循环中调用"""
+        if self.running:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._worker_tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        logger.info(f"图片生成队列已启动，{self.workers} 个工作协程，限速 {self.bucket.rate} 次/秒")
+
+    async def close(self):
+        """停止工作协程，取消尚未执行的任务"""
+        for task in self._worker_tasks:
+            task.cancel()
+        for task in self._worker_tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._worker_tasks = []
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, _, job = self._queue.get_nowait()
+                if not job.future.done():
+                    job.future.cancel()
+
+    async def submit(self, factory, priority=PRIORITY_RECOMMENDATION, label=""):
+        """
+        提交一个任务并等待结果
+
+        Args:
+            factory: 无参数的异步函数，轮到该任务时才会调用
+            priority: 优先级，ordering 为 "fifo" 时忽略
+            label: 任务说明，用于日志
+
+        Returns:
+            factory 的返回值
+        """
+        if not self.running:
+            # 队列未启动时直接执行
+            return await factory()
+
+        future = asyncio.get_running_loop().create_future()
+        if self.ordering == "fifo":
+            priority = 0
+        self._queue.put_nowait((priority, next(self._seq), _Job(factory, future, label)))
+        self.submitted += 1
+        return await future
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            if job.future.done():
+                # 调用方已经放弃等待
+                continue
+            await self.bucket.acquire()
+            wait = time.monotonic() - job.enqueued_at
+            self.last_wait = wait
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if wait > 1:
+                logger.info(f"图片任务 {job.label} 排队 {wait:.1f} 秒，当前队列长度 {self.depth}")
+            try:
+                result = await job.context.run(asyncio.ensure_future, job.factory())
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+                continue
+            self.completed += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def stats(self):
+        """返回队列统计信息"""
+        started = self.completed + self.failed
+        return {
+            "depth": self.depth,
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait": self.total_wait / started if started else 0.0,
+            "max_wait": self.max_wait,
+            "last_wait": self.last_wait,
+        }
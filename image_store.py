@@ -0,0 +1,152 @@
+import os
+import json
+import random
+import hashlib
+import uuid
+from collections import OrderedDict
+from astrbot.api import logger
+
+
+class ImageStore:
+    """
+    按内容寻址的生成图片缓存
+
+    以 (提示词, 模型, 调度配置, 宽, 高) 的哈希作为键，每个键最多保存
+    max_variants 张不同的图片。图片保存在磁盘上，按最近使用顺序淘汰，
+    总大小不超过 max_bytes。
+    """
+
+    def __init__(self, root_dir, max_bytes=200 * 1024 * 1024, max_variants=2):
+        """
+        Args:
+            root_dir: 缓存目录
+            max_bytes: 缓存目录的最大总字节数
+            max_variants: 每个键最多保存的图片数量，达到数量后直接复用已有图片
+        """
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.max_variants = max(1, max_variants)
+        # 路径 -> 文件大小，按最近使用时间从旧到新排列
+        self._files = OrderedDict()
+        # 键 -> 该键下的图片路径列表
+        self._variants = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.root_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def make_key(prompt, model, schedule_conf, width, height):
+        """根据生成参数计算缓存键"""
+        raw = json.dumps([prompt, model, schedule_conf, width, height], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _load_index(self):
+        """启动时扫描一次缓存目录，按修改时间建立LRU索引"""
+        entries = []
+        for file in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, file)
+            if file.endswith(".part"):
+                # 上次运行中断时留下的未完成下载
+                os.remove(path)
+                continue
+            key = file.split("_", 1)[0]
+            if not os.path.isfile(path) or len(key) != 64:
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, path, key, stat.st_size))
+
+        entries.sort()
+        for _, path, key, size in entries:
+            self._add(key, path, size)
+        logger.info(f"图片缓存已加载 {len(self._files)} 张图片，共 {self.total_bytes // 1024} KB")
+        self._evict()
+
+    def _add(self, key, path, size):
+        self._files[path] = size
+        self._variants.setdefault(key, []).append(path)
+        self.total_bytes += size
+
+    def _remove(self, path):
+        size = self._files.pop(path, 0)
+        self.total_bytes -= size
+        key = os.path.basename(path).split("_", 1)[0]
+        variants = self._variants.get(key)
+        if variants and path in variants:
+            variants.remove(path)
+            if not variants:
+                del self._variants[key]
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            logger.error(f"删除缓存图片失败 {path}: {e}")
+
+    def _touch(self, path):
+        """标记最近使用，同时更新修改时间，重启后仍能保持LRU顺序"""
+        self._files.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """超出总大小时，从最久未使用的图片开始删除"""
+        while self.total_bytes > self.max_bytes and len(self._files) > 1:
+            path = next(iter(self._files))
+            logger.info(f"图片缓存超出大小限制，删除: {path}")
+            self._remove(path)
+
+    def get(self, key):
+        """
+        获取一张缓存图片
+
+        只有当该键已保存足够数量的图片时才返回，否则返回None，
+        让调用方生成新的图片以增加多样性。
+
+        Returns:
+            str: 图片路径，或None
+        """
+        variants = self._variants.get(key)
+        if not variants or len(variants) < self.max_variants:
+            self.misses += 1
+            return None
+        path = random.choice(variants)
+        if not os.path.exists(path):
+            # 文件被外部删除，同步索引
+            self._remove(path)
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touch(path)
+        return path
+
+    def get_any(self, key):
+        """获取该键下的任意一张图片，用于生成失败时的降级，不存在时返回None"""
+        for path in list(self._variants.get(key, ())):
+            if os.path.exists(path):
+                self._touch(path)
+                return path
+            self._remove(path)
+        return None
+
+    def new_path(self, key, ext="jpg"):
+        """为该键生成一个新的图片路径，文件写入完成后通过 add_file 登记"""
+        return os.path.join(self.root_dir, f"{key}_{uuid.uuid4().hex[:8]}.{ext}")
+
+    def add_file(self, key, path):
+        """
+        登记一张已经写入缓存目录的图片
+
+        Args:
+            key: 缓存键
+            path: 由 new_path 生成的图片路径
+
+        Returns:
+            str: 图片路径
+        """
+        self._add(key, path, os.path.getsize(path))
+        self._evict()
+        return path
+
@@ -0,0 +1,184 @@
+from collections import deque
+
+
+class KeywordMatcher:
+    """
+    Aho–Corasick 多模式关键词匹配器
+
+    添加所有关键词后调用 build() 构建自动机，之后每次匹配只需扫描一遍文本，
+    耗时与文本长度和命中数量有关，与关键词数量无关。
+    每个关键词可以带有多个标签，匹配结果返回命中的标签。
+    """
+
+    def __init__(self):
+        # 状态转移表，每个状态是 字符 -> 下一个状态 的字典，0 是根状态
+        self._goto = [{}]
+        # 失败指针
+        self._fail = [0]
+        # 每个状态结束的关键词标签（包含通过失败指针继承的）
+        self._output = [[]]
+        self._built = False
+
+    def add(self, keyword, label):
+        """
+        添加一个关键词
+
+        Args:
+            keyword: 关键词，会去掉首尾空白并转为小写，空字符串会被忽略
+            label: 命中时返回的标签，可以是任意可哈希的对象
+        """
+        keyword = keyword.strip().lower()
+        if not keyword:
+            return self
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        if label not in self._output[state]:
+            self._output[state].append(label)
+        self._built = False
+        return self
+
+    def add_all(self, keywords, label):
+        """为一组关键词添加同一个标签"""
+        for keyword in keywords:
+            self.add(keyword, label)
+        return self
+
+    def build(self):
+        """按广度优先顺序计算失败指针"""
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            queue.append(state)
+
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                if self._fail[next_state] == next_state:
+                    self._fail[next_state] = 0
+                # 继承失败状态的输出，匹配时不必再沿失败链查找
+                for label in self._output[self._fail[next_state]]:
+                    if label not in self._output[next_state]:
+                        self._output[next_state].append(label)
+        self._built = True
+        return self
+
+    def find_labels(self, text):
+        """
+        扫描文本，返回所有命中的标签
+
+        Args:
+            text: 待匹配的文本，匹配前会转为小写
+
+        Returns:
+            set: 命中的标签集合
+        """
+        if not self._built:
+            self.build()
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        labels = set()
+        state = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                labels.update(output[state])
+        return labels
+
+
+class MessageClassifier:
+    """
+    基于 KeywordMatcher 的消息分类器
+
+    所有关键词列表构建成一个自动机，一次扫描同时得到命令类型、餐点类型、
+    偏好标签和城市。各类结果的优先级与关键词列表的顺序一致。
+    """
+
+    def __init__(self, commands, meal_time_keywords=(), food_question_keywords=(),
+                 meal_types=None, preferences=None, cities=()):
+        """
+        Args:
+            commands: [(命令类型, 关键词列表), ...]，按优先级从高到低排列
+            meal_time_keywords: 用餐时间关键词，与食物问题关键词同时出现时视为第一个命令（食物推荐）
+            food_question_keywords: 食物问题关键词
+            meal_types: {餐点类型: 关键词列表}，按字典顺序决定优先级
+            preferences: {偏好标签: 关键词列表}
+            cities: 城市列表，按列表顺序决定优先级
+        """
+        self.command_order = [command for command, _ in commands]
+        self.meal_type_order = list(meal_types or {})
+        self.preference_order = list(preferences or {})
+        self.city_order = list(cities)
+
+        matcher = KeywordMatcher()
+        for command, keywords in commands:
+            matcher.add_all(keywords, ("command", command))
+        matcher.add_all(meal_time_keywords, ("meal_time", None))
+        matcher.add_all(food_question_keywords, ("food_question", None))
+        for meal_type, keywords in (meal_types or {}).items():
+            matcher.add_all(keywords, ("meal_type", meal_type))
+        for preference, keywords in (preferences or {}).items():
+            matcher.add_all(keywords, ("preference", preference))
+        for city in cities:
+            matcher.add(city, ("city", city))
+        self.matcher = matcher.build()
+
+    def classify(self, text):
+        """
+        对消息进行分类
+
+        Args:
+            text: 消息文本
+
+        Returns:
+            dict: command（命令类型或None）、meal_type（餐点类型或None）、
+                preferences（偏好标签列表）、city（城市或None）、
+                is_food_question（是否是食物相关问题）
+        """
+        hits = {}
+        for kind, value in self.matcher.find_labels(text or ""):
+            hits.setdefault(kind, set()).add(value)
+
+        commands = hits.get("command", set())
+        is_food_question = "food_question" in hits
+        command = None
+        for index, name in enumerate(self.command_order):
+            if name in commands:
+                command = name
+                break
+            # 用餐时间关键词只有在食物相关问题中才算作食物推荐，优先级紧随食物推荐关键词之后
+            if index == 0 and "meal_time" in hits and is_food_question:
+                command = name
+                break
+
+        return {
+            "command": command,
+            "meal_type": self._first(self.meal_type_order, hits.get("meal_type")),
+            "preferences": [p for p in self.preference_order if p in hits.get("preference", ())],
+            "city": self._first(self.city_order, hits.get("city")),
+            "is_food_question": is_food_question,
+        }
+
+    @staticmethod
+    def _first(order, found):
+        if not found:
+            return None
+        for value in order:
+            if value in found:
+                return value
+        return None
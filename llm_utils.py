@@ -1,9 +1,50 @@
 import random
+import itertools
 from astrbot.api import logger
 
+from .cache import SingleFlight
+from .tracing import span
+from .metrics import METRICS
+from .cassette import CASSETTE
+from .resilience import circuit_breaker, with_deadline, hedged, CircuitOpenError
+
+# 合并并发的相同LLM请求
+LLM_FLIGHT = SingleFlight()
+
+# LLM调用的期限和对冲延迟（秒），hedge_delay 为0时不发起对冲请求
+LLM_SETTINGS = {
+    "timeout": 20.0,
+    "hedge_delay": 0.0,
+}
+
+# LLM provider 的熔断器，打开期间直接使用模板和本地食物目录
+LLM_BREAKER = circuit_breaker("llm", failure_threshold=3, reset_timeout=30.0, slow_threshold=15.0)
+
+# 熔断期间在后台探测provider使用的提示词
+PROBE_PROMPT = "你好，请只回复“好”。"
+
+def configure_llm_resilience(timeout=None, hedge_delay=None, failure_threshold=None, reset_timeout=None, slow_threshold=None):
+    """
+    根据配置调整LLM调用的期限、对冲和熔断
+
+    Args:
+        timeout: 每次调用的期限（秒），0 表示不限
+        hedge_delay: 超过该时间没有返回时再发起一次相同的请求（秒），0 表示不对冲
+        failure_threshold: 连续失败多少次后熔断
+        reset_timeout: 熔断后多久探测一次provider（秒）
+        slow_threshold: 耗时超过该值的调用视为失败（秒），0 表示不限
+    """
+    if timeout is not None:
+        LLM_SETTINGS["timeout"] = float(timeout)
+    if hedge_delay is not None:
+        LLM_SETTINGS["hedge_delay"] = float(hedge_delay)
+    LLM_BREAKER.configure(failure_threshold, reset_timeout, slow_threshold)
+
 async def call_llm(context, prompt, session_id_prefix="food"):
     """
     统一的LLM调用函数，简化LLM调用逻辑
+
+    同一个context上提示词相同的并发调用会合并为一次请求，所有调用方得到相同的结果。
     
     Args:
         context: 上下文对象，用于调用LLM
@@ -16,7 +57,57 @@ async def call_llm(context, prompt, session_id_prefix="food"):
     if not context:
         logger.warning("无法调用LLM：context对象为空")
         return None
-        
+
+    key = (id(context), session_id_prefix, prompt)
+    if LLM_FLIGHT.pending(key):
+        METRICS.inc("coalesced", kind="llm")
+    # shared 表示合并到了其他调用方正在进行的请求
+    with span("llm", session=session_id_prefix, prompt_chars=len(prompt), shared=LLM_FLIGHT.pending(key)):
+        return await LLM_FLIGHT.do(key, lambda: _call_llm(context, prompt, session_id_prefix))
+
+async def provider_chat(provider, prompt, session_id):
+    """
+    调用provider的text_chat并返回去掉首尾空白的文本
+
+    开启录制或回放时，调用会经过 CASSETTE，以提示词作为请求键。
+
+    每次调用最多等待 LLM_SETTINGS["timeout"] 秒；设置了 hedge_delay 时，超过该时间没有返回会用新的会话ID
+    再发起一次相同的请求，使用先返回的结果。连续失败或过慢时 LLM_BREAKER 打开，之后的调用直接抛出
+    CircuitOpenError，由调用方使用模板或本地食物目录，同时在后台探测provider，恢复后自动关闭。
+    """
+    attempts = itertools.count()
+
+    async def chat():
+        attempt = next(attempts)
+        # 对冲请求使用不同的会话ID，避免两次请求写入同一个会话
+        attempt_session_id = session_id if attempt == 0 else f"{session_id}_hedge{attempt}"
+        return await CASSETTE.call("llm", prompt, lambda: _text_chat(provider, prompt, attempt_session_id))
+
+    async def request():
+        METRICS.inc("llm_requests")
+        try:
+            return await with_deadline(hedged(chat, LLM_SETTINGS["hedge_delay"], "llm"), LLM_SETTINGS["timeout"], "llm")
+        except Exception:
+            METRICS.inc("llm_errors")
+            raise
+
+    async def probe():
+        session = f"food_probe_{random.randint(1000, 9999)}"
+        await with_deadline(
+            CASSETTE.call("llm", PROBE_PROMPT, lambda: _text_chat(provider, PROBE_PROMPT, session)),
+            LLM_SETTINGS["timeout"], "llm"
+        )
+
+    return await LLM_BREAKER.call(request, probe=probe)
+
+async def _text_chat(provider, prompt, session_id):
+    llm_response = await provider.text_chat(
+        prompt=prompt,
+        session_id=session_id
+    )
+    return llm_response.completion_text.strip() if hasattr(llm_response, 'completion_text') else llm_response.strip()
+
+async def _call_llm(context, prompt, session_id_prefix):
     try:
         # 使用context.get_using_provider()方法调用LLM
         if hasattr(context, 'get_using_provider') and callable(getattr(context, 'get_using_provider')):
@@ -26,13 +117,7 @@ async def call_llm(context, prompt, session_id_prefix="food"):
                 session_id = f"{session_id_prefix}_{random.randint(1000, 9999)}"
                 
                 # 调用LLM
-                llm_response = await provider.text_chat(
-                    prompt=prompt,
-                    session_id=session_id
-                )
-                
-                # 提取响应文本
-                response_text = llm_response.completion_text.strip() if hasattr(llm_response, 'completion_text') else llm_response.strip()
+                response_text = await provider_chat(provider, prompt, session_id)
                 logger.info(f"成功调用LLM，生成文本: {response_text[:30]}...")
                 return response_text
             else:
@@ -41,6 +126,9 @@ async def call_llm(context, prompt, session_id_prefix="food"):
         else:
             logger.warning("context对象不支持get_using_provider方法")
             return None
+    except CircuitOpenError:
+        logger.info("LLM熔断中，跳过调用")
+        return None
     except Exception as e:
         logger.error(f"调用LLM失败: {e}")
         return None
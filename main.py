@@ -1,6 +1,6 @@
 import os
+import time
 import asyncio
-import datetime
 import json
 
 from astrbot.api.event import AstrMessageEvent
@@ -9,7 +9,24 @@ from astrbot.api.message_components import Plain, Image
 from astrbot.api import logger, llm_tool
 
 # 导入拆分出去的模块
-from .recommendation import generate_food_recommendation
+from .recommendation import generate_food_recommendation, start_food_recommendation
+from .food_utils import configure_weather_cache, WEATHER_CACHE
+from .http_client import HttpClient
+from .doubao_image import VolcengineClient
+from .image_store import ImageStore
+from .generate_description import configure_description_cache, DESCRIPTION_CACHE
+from .keyword_matcher import MessageClassifier
+from .user_state import UserStateStore
+from .output_manager import OutputDirManager
+from .image_queue import ImageJobQueue, PRIORITY_GENERAL
+from .tracing import TRACER, traced_request
+from .metrics import METRICS
+from .cassette import CASSETTE
+from .llm_utils import configure_llm_resilience
+from .resilience import BREAKERS, STATE_VALUES, HTTP_RETRY, close_breakers, format_breakers
+from .prewarm import PrewarmScheduler
+from .food_utils import CHINA_CITIES
+from .dynamic_food_generator import PREFERENCE_KEYWORDS
 
 # 获取当前文件的绝对路径
 current_file_path = os.path.abspath(__file__)
@@ -19,6 +36,18 @@ current_directory = os.path.dirname(current_file_path)
 OUTPUT_DIR = os.path.join(current_directory, "output")
 # 确保输出目录存在
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+# 定义生成图片的缓存目录
+IMAGE_CACHE_DIR = os.path.join(current_directory, "image_cache")
+# 定义用户状态数据库文件
+USER_STATE_DB_PATH = os.path.join(current_directory, "data", "user_state.db")
+# 定义食物描述缓存的持久化文件
+DESCRIPTION_CACHE_PATH = os.path.join(current_directory, "data", "description_cache.json")
+# 请求追踪文件
+TRACE_PATH = os.path.join(current_directory, "data", "traces.jsonl")
+# Prometheus文本格式的性能指标文件
+METRICS_PATH = os.path.join(current_directory, "data", "metrics.prom")
+# 外部调用的录制文件
+CASSETTE_PATH = os.path.join(current_directory, "data", "cassette.jsonl")
 
 @register("food_recommender", "wayzinx", "美食推荐工具 - 根据时间、天气等因素随机推荐美食", "1.0.2")
 class FoodRecommenderPlugin(Star):
@@ -28,20 +57,58 @@ class FoodRecommenderPlugin(Star):
         os.makedirs(OUTPUT_DIR, exist_ok=True)
         # 保存配置
         self.config = config or {}
-        # 跟踪临时图片，以便能在使用后删除
-        self.temp_images = set()
-        # 记录上一次的推荐信息，用于"换一个"功能
-        self.last_recommendations = {}
-        # 记录最近的推荐历史，用于去重
-        self.recent_foods = {}
         # 添加OUTPUT_DIR到context，以便其他模块使用
         self.OUTPUT_DIR = OUTPUT_DIR
+        # 共享的HTTP连接池，在initialize中创建，在terminate中关闭
+        self.http_client = None
+        # 共享的火山引擎客户端，缓存签名密钥，在initialize中创建
+        self.volcengine_client = None
 
         # 初始化配置
         self._init_config()
 
-        # 清理输出目录中的旧图片
-        self._cleanup_old_images()
+        # 用户状态：上一次的推荐信息（用于"换一个"功能）和最近的推荐历史（用于去重）
+        self.user_state = UserStateStore(
+            max_users=self.user_state_max_users,
+            history_size=self.user_history_size,
+            db_path=USER_STATE_DB_PATH if self.user_state_persist else None
+        )
+
+        # 按生成参数缓存图片，重复的菜品直接从磁盘读取
+        self.image_store = None
+        if self.image_cache_enabled:
+            try:
+                self.image_store = ImageStore(
+                    IMAGE_CACHE_DIR,
+                    max_bytes=self.image_cache_max_mb * 1024 * 1024,
+                    max_variants=self.image_cache_variants
+                )
+            except Exception as e:
+                logger.error(f"初始化图片缓存失败: {e}")
+
+        # 图片生成队列，限制同时进行的生成数量和调用速率
+        self.image_queue = ImageJobQueue(
+            workers=self.image_workers,
+            rate=self.image_rate_limit,
+            burst=self.image_rate_burst,
+            ordering=self.image_queue_order
+        )
+
+        # 在用餐时段开始前预热天气、食物描述和图片缓存
+        self.prewarm = PrewarmScheduler(
+            self,
+            self.prewarm_cities,
+            lead_minutes=self.prewarm_lead_minutes,
+            foods_per_meal=self.prewarm_foods,
+            images=self.prewarm_images
+        )
+
+        # 输出目录管理器：启动时扫描一次目录，清理旧图片，并负责在使用后删除临时图片
+        self.output_manager = OutputDirManager(OUTPUT_DIR, max_images=self.max_output_images)
+        try:
+            self.output_manager.seed()
+        except Exception as e:
+            logger.error(f"扫描输出目录时出错: {e}")
 
     def _init_config(self):
         """初始化配置"""
@@ -67,6 +134,17 @@ class FoodRecommenderPlugin(Star):
         # 设置输出目录中保留的最大图片数量
         self.max_output_images = self.config.get("max_output_images", 1)  # 从配置中读取，默认为1
 
+        # 图片缓存设置
+        self.image_cache_enabled = self.config.get("image_cache_enabled", True)
+        self.image_cache_max_mb = self.config.get("image_cache_max_mb", 200)
+        self.image_cache_variants = self.config.get("image_cache_variants", 2)
+
+        # 图片生成队列设置
+        self.image_workers = self.config.get("image_workers", 2)
+        self.image_rate_limit = self.config.get("image_rate_limit", 1.0)
+        self.image_rate_burst = self.config.get("image_rate_burst", 2)
+        self.image_queue_order = self.config.get("image_queue_order", "priority")
+
         # 设置火山引擎相关配置
         if "volcengine_model" not in self.config:
             self.config["volcengine_model"] = "high_aes_general_v21_L"
@@ -80,6 +158,96 @@ class FoodRecommenderPlugin(Star):
         if "service" not in self.config:
             self.config["service"] = "cv"
 
+        # 渐进式回复：先发送文字，图片生成后再单独发送
+        self.progressive_reply = self.config.get("progressive_reply", True)
+        # 图片从请求开始算起的截止时间（秒），超过后不再发送
+        self.image_deadline = self.config.get("image_deadline", 30)
+
+        # 用户状态设置
+        self.user_state_max_users = self.config.get("user_state_max_users", 10000)
+        self.user_history_size = self.config.get("user_history_size", 5)
+        self.user_state_persist = self.config.get("user_state_persist", True)
+
+        # 每次推荐一次性生成的候选食物数量，用于避开最近推荐过的食物
+        self.candidate_count = self.config.get("candidate_count", 5)
+        # 候选食物的生成方式：local 本地排序，rerank 本地排序后由LLM重新排列，llm 由LLM生成
+        self.ranking_mode = self.config.get("ranking_mode", "local")
+        # 本地排序的随机程度，0 表示总是选择分数最高的食物
+        self.ranking_temperature = self.config.get("ranking_temperature", 0.5)
+        # LLM调用方式：separate 分别生成候选、描述和推荐理由，combined 一次调用同时生成
+        self.llm_call_mode = self.config.get("llm_call_mode", "separate")
+
+        # LLM调用的期限、对冲和熔断设置
+        configure_llm_resilience(
+            timeout=self.config.get("llm_timeout", 20),
+            hedge_delay=self.config.get("llm_hedge_delay", 0),
+            failure_threshold=self.config.get("llm_breaker_failures", 3),
+            reset_timeout=self.config.get("llm_breaker_reset", 30),
+            slow_threshold=self.config.get("llm_slow_threshold", 15)
+        )
+
+        # 设置天气缓存的过期时间
+        configure_weather_cache(
+            ttl=self.config.get("weather_cache_ttl", 1800),
+            stale_ttl=self.config.get("weather_stale_ttl", 21600)
+        )
+
+        # HTTP连接池设置
+        self.http_limit_per_host = self.config.get("http_limit_per_host", 10)
+        self.http_timeouts = {
+            "weather": self.config.get("weather_timeout", 10),
+            "volcengine": self.config.get("volcengine_timeout", 60),
+            "image_download": self.config.get("image_download_timeout", 30),
+        }
+        # 天气和火山引擎接口的重试和熔断设置
+        HTTP_RETRY.configure(
+            retries=self.config.get("http_retries", 2),
+            base_delay=self.config.get("http_retry_base_delay", 0.5),
+            max_delay=self.config.get("http_retry_max_delay", 8)
+        )
+        for name in ("weather", "volcengine"):
+            BREAKERS[name].configure(
+                failure_threshold=self.config.get("http_breaker_failures", 5),
+                reset_timeout=self.config.get("http_breaker_reset", 60)
+            )
+        # 下载生成图片的最大字节数，超过时放弃下载
+        self.image_download_max_bytes = int(self.config.get("image_download_max_mb", 20) * 1024 * 1024)
+        # 接口名称 -> 替代地址，仅用于把外部请求指向本地替身服务器进行测试
+        self.http_endpoint_overrides = self.config.get("http_endpoint_overrides", {})
+
+        # 请求追踪设置
+        self.trace_enabled = self.config.get("trace_enabled", True)
+        self.trace_max_mb = self.config.get("trace_max_mb", 5)
+        self.trace_backup_count = self.config.get("trace_backup_count", 3)
+
+        # 性能指标导出设置
+        self.metrics_export = self.config.get("metrics_export", False)
+        self.metrics_export_interval = self.config.get("metrics_export_interval", 60)
+
+        # 外部调用的录制和回放设置，用于离线复现真实流量
+        self.cassette_mode = self.config.get("cassette_mode", "off")
+        self.cassette_path = self.config.get("cassette_path") or CASSETTE_PATH
+        self.cassette_latency = self.config.get("cassette_latency", "original")
+        self.cassette_match = self.config.get("cassette_match", "exact")
+
+        # 用餐时段预热设置，未配置城市时不预热
+        prewarm_cities = [city.strip() for city in self.config.get("prewarm_cities", "").split(",") if city.strip()]
+        # 用户文本只会被识别为支持的城市，其他城市的天气预热后不会被用到
+        ignored_cities = [city for city in prewarm_cities if city not in CHINA_CITIES]
+        if ignored_cities:
+            logger.warning(f"预热城市不在支持的城市列表中，已忽略: {', '.join(ignored_cities)}")
+        self.prewarm_cities = [city for city in prewarm_cities if city in CHINA_CITIES]
+        self.prewarm_lead_minutes = self.config.get("prewarm_lead_minutes", 5)
+        self.prewarm_foods = self.config.get("prewarm_foods", 3)
+        self.prewarm_images = self.config.get("prewarm_images", True)
+
+        # 设置食物描述缓存
+        configure_description_cache(
+            maxsize=self.config.get("description_cache_size", 2048),
+            ttl=self.config.get("description_cache_ttl", 604800),
+            path=DESCRIPTION_CACHE_PATH if self.config.get("description_cache_persist", True) else None
+        )
+
         # 检查API密钥
         if "volcengine_ak" not in self.config or not self.config["volcengine_ak"]:
             logger.warning("未配置火山引擎AccessKey，请在_conf_schema.json中添加volcengine_ak")
@@ -98,6 +266,21 @@ class FoodRecommenderPlugin(Star):
         self.food_image_keywords = self.config.get("food_image_keywords", "生成美食图,画美食").split(",")
         self.image_generation_keywords = self.config.get("image_generation_keywords", "生成图片,画图,文生图").split(",")
 
+        # 把所有关键词构建成一个自动机，一次扫描得到命令类型、餐点类型、偏好和城市
+        self.message_classifier = MessageClassifier(
+            commands=[
+                ("food_recommendation", self.food_recommendation_keywords),
+                ("change_recommendation", self.change_recommendation_keywords),
+                ("food_image", self.food_image_keywords),
+                ("image_generation", self.image_generation_keywords),
+            ],
+            meal_time_keywords=self.meal_time_keywords,
+            food_question_keywords=self.FOOD_QUESTION_KEYWORDS,
+            meal_types=self.MEAL_TYPE_KEYWORDS,
+            preferences=PREFERENCE_KEYWORDS,
+            cities=CHINA_CITIES
+        )
+
         logger.info(f"食物推荐插件配置初始化完成")
 
     async def initialize(self):
@@ -107,60 +290,82 @@ class FoodRecommenderPlugin(Star):
         self.context.activate_llm_tool("food_command_handler")
         self.context.activate_llm_tool("change_food_recommendation")
         self.context.activate_llm_tool("generate_image")
-
-    def _cleanup_old_images(self):
-        """清理输出目录中的旧图片，只保留最新的几张"""
-        try:
-            # 获取输出目录中的所有图片文件
-            image_files = []
-
-            # 确保输出目录存在
-            if not os.path.exists(OUTPUT_DIR):
-                os.makedirs(OUTPUT_DIR, exist_ok=True)
-                logger.info(f"创建输出目录: {OUTPUT_DIR}")
-                return  # 如果目录是新创建的，则没有图片需要清理
-
-            # 获取所有图片文件
-            for file in os.listdir(OUTPUT_DIR):
-                file_path = os.path.join(OUTPUT_DIR, file)
-                if os.path.isfile(file_path) and file.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                    # 获取文件的修改时间（比创建时间更可靠）
-                    mod_time = os.path.getmtime(file_path)
-                    image_files.append((file_path, mod_time))
-
-            # 打印调试信息
-            logger.info(f"发现 {len(image_files)} 张图片在输出目录中")
-
-            # 按修改时间排序，最新的文件在前面
-            image_files.sort(key=lambda x: x[1], reverse=True)
-
-            # 如果图片数量超过最大限制，删除旧图片
-            if len(image_files) > self.max_output_images:
-                # 打印调试信息
-                logger.info(f"图片数量 ({len(image_files)}) 超过最大限制 ({self.max_output_images})，开始清理...")
-
-                # 保留最新的几张图片，删除其余的
-                for file_path, _ in image_files[self.max_output_images:]:
-                    try:
-                        # 确保文件存在且不在使用中
-                        if os.path.exists(file_path) and file_path not in self.temp_images:
-                            os.remove(file_path)
-                            logger.info(f"删除旧图片: {file_path}")
-                        elif file_path in self.temp_images:
-                            logger.info(f"跳过正在使用的图片: {file_path}")
-                    except Exception as e:
-                        logger.error(f"删除旧图片失败 {file_path}: {e}")
-
-            # 再次获取当前图片数量
-            current_images = [f for f in os.listdir(OUTPUT_DIR)
-                             if os.path.isfile(os.path.join(OUTPUT_DIR, f)) and
-                             f.lower().endswith(('.jpg', '.jpeg', '.png', '.gif'))]
-
-            logger.info(f"输出目录清理完成，当前保留 {len(current_images)} 张图片")
-        except Exception as e:
-            logger.error(f"清理旧图片时出错: {e}")
+        self.context.activate_llm_tool("food_stats")
+
+        # 开启请求追踪，各阶段耗时写入JSONL文件
+        if self.trace_enabled:
+            TRACER.configure(TRACE_PATH, max_bytes=int(self.trace_max_mb * 1024 * 1024), backup_count=self.trace_backup_count)
+
+        # 开启外部调用的录制或回放
+        CASSETTE.configure(self.cassette_mode, self.cassette_path, latency=self.cassette_latency, match=self.cassette_match)
+
+        # 创建共享的HTTP连接池
+        if self.http_client is None:
+            self.http_client = HttpClient(
+                limit_per_host=self.http_limit_per_host,
+                timeouts=self.http_timeouts,
+                base_urls=self.http_endpoint_overrides
+            )
+        await self.http_client.start()
+
+        # 创建火山引擎客户端，使用共享的连接池
+        if self.config.get("volcengine_ak") and self.config.get("volcengine_sk"):
+            self.volcengine_client = VolcengineClient(
+                self.config["volcengine_ak"],
+                self.config["volcengine_sk"],
+                region=self.config.get("region", "cn-north-1"),
+                service=self.config.get("service", "cv"),
+                http_client=self.http_client
+            )
+
+        # 启动用户状态的定时写入
+        self.user_state.start()
+
+        # 启动临时图片的清理任务
+        self.output_manager.start()
+
+        # 启动图片生成队列
+        self.image_queue.start()
+
+        # 启动用餐时段预热
+        self.prewarm.start()
+
+        # 注册性能指标中的即时值，并按配置定期导出
+        self._register_metrics()
+        if self.metrics_export:
+            METRICS.start_export(METRICS_PATH, self.metrics_export_interval)
+
+    def _register_metrics(self):
+        """注册缓存命中率、队列长度等在读取时计算的指标"""
+        METRICS.clear_gauges()
+
+        def ratio(hits, total):
+            return hits / total if total else 0.0
+
+        METRICS.register_gauge(
+            "cache_hit_ratio",
+            lambda: ratio(WEATHER_CACHE.hits + WEATHER_CACHE.stale_hits,
+                          WEATHER_CACHE.hits + WEATHER_CACHE.stale_hits + WEATHER_CACHE.misses),
+            cache="weather"
+        )
+        METRICS.register_gauge("cache_hit_ratio", lambda: DESCRIPTION_CACHE.stats()["hit_ratio"], cache="description")
+        if self.image_store is not None:
+            METRICS.register_gauge(
+                "cache_hit_ratio",
+                lambda: ratio(self.image_store.hits, self.image_store.hits + self.image_store.misses),
+                cache="image"
+            )
+            METRICS.register_gauge("image_cache_bytes", lambda: self.image_store.total_bytes)
+        METRICS.register_gauge("image_queue_depth", lambda: self.image_queue.depth)
+        METRICS.register_gauge("image_queue_avg_wait_seconds", lambda: self.image_queue.stats()["avg_wait"])
+        METRICS.register_gauge("image_queue_max_wait_seconds", lambda: self.image_queue.max_wait)
+        METRICS.register_gauge("users_in_memory", lambda: len(self.user_state))
+        # 熔断器状态：0 关闭，1 半开，2 打开
+        for name, breaker in BREAKERS.items():
+            METRICS.register_gauge("circuit_state", lambda breaker=breaker: STATE_VALUES[breaker.state], endpoint=name)
 
     @llm_tool(name="recommend_food")
+    @traced_request("recommend_food")
     async def recommend_food(self, event, meal_type: str = None, city: str = None):
         '''根据当前时间、天气等因素推荐美食
 
@@ -168,79 +373,100 @@ class FoodRecommenderPlugin(Star):
             meal_type(string): 用餐类型，可选值：早餐、中餐、晚餐，不提供则根据当前时间推荐
             city(string): 城市名称，用于获取当地天气信息，可选参数
         '''
+        user_text = getattr(event, 'message_str', None) or None
+        async for result in self._recommend(event, meal_type, city, user_text):
+            yield result
+
+    async def _recommend(self, event, meal_type=None, city=None, user_text=None, preferences=None):
+        """
+        发送等待消息并生成推荐
+
+        Args:
+            city: 用户指定的城市
+            user_text: 本次请求的用户文本，用于识别城市和偏好
+            preferences: 本次请求已解析的偏好标签，为None时从用户文本中提取
+        """
         # 发送等待消息
         yield event.chain_result([Plain(text=f"正在为你推荐{meal_type or '美食'}，请稍候...")])
 
-        # 保存城市信息到context中，供generate_food_recommendation使用
-        if city:
-            self.user_specified_city = city
-
         # 获取用户ID用于去重
         user_id = self._get_user_id(event)
 
-        # 初始化历史推荐列表（用于去重）
-        if not hasattr(self, 'recent_foods'):
-            self.recent_foods = {}
-        if user_id not in self.recent_foods:
-            self.recent_foods[user_id] = []
-
-        # 生成推荐，避免与最近推荐的相同
-        for attempt in range(10):  # 尝试最多10次以获取不同的推荐
-            # 确保每次尝试都设置正确的城市信息
-            if city:
-                self.user_specified_city = city
-            recommendation = await generate_food_recommendation(meal_type, self)
-            if recommendation['food'] not in self.recent_foods[user_id]:
-                break
-            logger.info(f"第{attempt+1}次尝试，推荐的{recommendation['food']}与历史重复，重新生成")
-
-        # 记录本次推荐，用于"换一个"功能
-        self.last_recommendations[user_id] = {
-            'meal_type': meal_type,
-            'food': recommendation['food'],
-            'timestamp': datetime.datetime.now(),
-            'city': city  # 记录城市信息
+        # 生成推荐并返回
+        async for result in self._produce_recommendation(
+            event, "我为你推荐：", meal_type, user_id, city, user_text=user_text, preferences=preferences
+        ):
+            yield result
+
+    async def _produce_recommendation(self, event, header, meal_type, user_id, city, user_text=None, preferences=None):
+        """
+        生成推荐、记录历史并产出回复消息
+
+        城市、用户文本和偏好作为本次请求的输入传给流水线，不保存在插件对象上。
+        渐进式回复开启时，先发送食物、推荐理由和描述，图片生成完成后再单独发送；
+        图片超过截止时间仍未完成则放弃发送。
+        """
+        request_start = time.monotonic()
+        await self.user_state.load(user_id)
+        recent_foods = self.user_state.recent_foods(user_id)
+        request = {
+            "exclude": recent_foods,
+            "city": city,
+            "user_text": user_text,
+            "preferences": preferences,
         }
+        # 生成推荐，候选食物在生成图片和描述之前就会避开最近推荐过的
+        if self.progressive_reply:
+            recommendation, image_task = await start_food_recommendation(meal_type, self, **request)
+        else:
+            recommendation = await generate_food_recommendation(meal_type, self, **request)
+            image_task = None
 
-        # 更新历史推荐列表
-        self.recent_foods[user_id].append(recommendation['food'])
-        if len(self.recent_foods[user_id]) > 5:
-            self.recent_foods[user_id] = self.recent_foods[user_id][-5:]
+        # 记录本次推荐（包括城市信息），用于"换一个"功能，同时更新历史推荐列表
+        self.user_state.record_recommendation(user_id, meal_type, recommendation['food'], city)
 
         # 构建消息链
         message_chain = [
-            Plain(text=f"我为你推荐：{recommendation['food']}\n\n"),
+            Plain(text=f"{header}{recommendation['food']}\n\n"),
             Plain(text=f"{recommendation['reason']}\n\n"),
             Plain(text=f"{recommendation['description']}")
         ]
 
-        # 如果有图片，添加图片
-        if recommendation['image_path'] and os.path.exists(recommendation['image_path']):
-            message_chain.append(Image(file=recommendation['image_path']))
+        if image_task is None:
+            # 如果有图片，添加图片
+            if self._prepare_image(recommendation['image_path']):
+                message_chain.append(Image(file=recommendation['image_path']))
+            yield event.chain_result(message_chain)
+            return
 
-            # 清理旧图片，只保留最新的几张
-            self._cleanup_old_images()
+        # 先发送文字部分
+        yield event.chain_result(message_chain)
 
-            # 如果是临时图片，延迟删除
-            if recommendation['image_path'] in self.temp_images:
-                async def delayed_delete(path, delay=10):
-                    await asyncio.sleep(delay)
-                    try:
-                        if os.path.exists(path):
-                            os.unlink(path)
-                            logger.info(f"已删除临时图片: {path}")
-                            self.temp_images.discard(path)
-                    except Exception as e:
-                        logger.error(f"删除临时图片失败 {path}: {e}")
+        # 在截止时间内等待图片
+        remaining = self.image_deadline - (time.monotonic() - request_start)
+        image_path = None
+        try:
+            image_path = await asyncio.wait_for(asyncio.shield(image_task), timeout=max(remaining, 0))
+        except asyncio.TimeoutError:
+            logger.info(f"{recommendation['food']}的图片超过{self.image_deadline}秒仍未生成，放弃发送")
+            # 有图片缓存时让生成继续，结果留给之后的请求使用
+            if self.image_store is None:
+                image_task.cancel()
+        except Exception as e:
+            logger.error(f"生成{recommendation['food']}的图片失败: {e}")
 
-                asyncio.create_task(delayed_delete(recommendation['image_path']))
+        if self._prepare_image(image_path):
+            yield event.chain_result([Image(file=image_path)])
 
-        # 清除临时存储的城市信息
-        if hasattr(self, 'user_specified_city'):
-            self.user_specified_city = None
+    def _prepare_image(self, image_path):
+        """检查图片是否可以发送，并安排删除临时图片"""
+        if not image_path or not os.path.exists(image_path):
+            return False
 
-        # 返回推荐
-        yield event.chain_result(message_chain)
+        # 如果是临时图片，延迟删除
+        if self.output_manager.is_temporary(image_path):
+            self.output_manager.schedule_delete(image_path, delay=10)
+        return True
 
     # 食物类型关键词映射
     MEAL_TYPE_KEYWORDS = {
@@ -252,52 +478,32 @@ class FoodRecommenderPlugin(Star):
         "快餐": ["快餐", "汉堡", "披萨"]
     }
 
+    # 食物相关问题关键词
+    FOOD_QUESTION_KEYWORDS = ["吃", "吃什么", "吃啥", "推荐"]
+
     # 从文本中检测餐点类型
     def _detect_meal_type(self, text):
         """从文本中检测餐点类型"""
-        for meal_type, keywords in self.MEAL_TYPE_KEYWORDS.items():
-            if any(keyword in text for keyword in keywords):
-                return meal_type
-        return None
+        return self.message_classifier.classify(text)["meal_type"]
 
     # 判断是否是食物相关问题
     def _is_food_question(self, text):
         """判断是否是食物相关问题"""
-        food_question_keywords = ["吃", "吃什么", "吃啥", "推荐"]
-        return any(keyword in text for keyword in food_question_keywords)
+        return self.message_classifier.classify(text)["is_food_question"]
+
+    # 从文本中检测城市
+    def _detect_city(self, text):
+        """从文本中检测城市，没有提到城市时返回None"""
+        return self.message_classifier.classify(text)["city"]
 
     # 判断命令类型
     def _get_command_type(self, text):
         """判断命令类型"""
-        # 检查是否是食物推荐命令
-        for cmd in self.food_recommendation_keywords:
-            if cmd in text:
-                return "food_recommendation"
-
-        # 检查是否是时间相关命令
-        for cmd in self.meal_time_keywords:
-            if cmd in text and self._is_food_question(text):
-                return "food_recommendation"
-
-        # 检查是否是换一个推荐命令
-        for cmd in self.change_recommendation_keywords:
-            if cmd in text:
-                return "change_recommendation"
-
-        # 检查是否是美食图片生成命令
-        for cmd in self.food_image_keywords:
-            if cmd in text:
-                return "food_image"
-
-        # 检查是否是通用图片生成命令
-        for cmd in self.image_generation_keywords:
-            if cmd in text:
-                return "image_generation"
-
-        return None
+        return self.message_classifier.classify(text)["command"]
 
     # 统一的命令处理函数
     @llm_tool(name="food_command_handler")
+    @traced_request("food_command_handler")
     async def food_command_handler(self, event, text: str = None, command_type: str = None, city: str = None):
         '''食物推荐插件的统一命令处理函数
 
@@ -321,51 +527,50 @@ class FoodRecommenderPlugin(Star):
         # 转换为小写
         text = text.lower()
 
+        # 一次扫描得到命令类型、餐点类型、偏好和城市
+        classification = self.message_classifier.classify(text)
+
         # 如果没有指定命令类型，自动检测
         if command_type is None:
-            command_type = self._get_command_type(text)
+            command_type = classification["command"]
 
         # 定义chain_result方法
         event.chain_result = lambda components: components
 
         # 处理不同类型的命令
         if command_type == "food_recommendation":
-            # 保存用户文本，供后续处理使用
-            self.last_user_text = text
+            # 检测餐点类型
+            meal_type = classification["meal_type"]
 
-            # 使用辅助方法检测餐点类型
-            meal_type = self._detect_meal_type(text)
-
-            # 如果没有传入城市参数，尝试从文本中检测
+            # 如果没有传入城市参数，使用从文本中检测到的城市
             if not city:
-                city = self._detect_city(text)
+                city = classification["city"]
 
-            # 使用recommend_food方法生成推荐
-            async for result in self.recommend_food(event, meal_type, city):
+            # 用户文本和偏好只用于本次推荐
+            async for result in self._recommend(event, meal_type, city, text, classification["preferences"]):
                 yield result
 
         elif command_type == "change_recommendation":
             # 处理换一个推荐命令 - 直接调用recommend_food方法
             user_id = self._get_user_id(event)
 
-            if user_id in self.last_recommendations:
-                last_rec = self.last_recommendations[user_id]
-                # 检查最后推荐是否在24小时内
-                time_diff = datetime.datetime.now() - last_rec['timestamp']
-                if time_diff.total_seconds() < 86400:  # 24小时 = 86400秒
-                    # 获取上次推荐的餐点类型
-                    meal_type = last_rec['meal_type']
-
-                    # 如果指定了新城市，使用新城市；否则尝试从文本检测或使用上次的城市
-                    if city:
-                        current_city = city
-                    else:
-                        current_city = self._detect_city(text) or last_rec.get('city', None)
-
-                    # 直接调用recommend_food方法，它会处理去重逻辑
-                    async for result in self.recommend_food(event, meal_type, current_city):
-                        yield result
-                    return
+            # 获取24小时内的最后推荐（24小时 = 86400秒）
+            await self.user_state.load(user_id)
+            last_rec = self.user_state.last_recommendation(user_id, max_age=86400)
+            if last_rec:
+                # 获取上次推荐的餐点类型
+                meal_type = last_rec['meal_type']
+
+                # 如果指定了新城市，使用新城市；否则尝试从文本检测或使用上次的城市
+                if city:
+                    current_city = city
+                else:
+                    current_city = classification["city"] or last_rec.get('city', None)
+
+                # 生成推荐时会处理去重逻辑
+                async for result in self._recommend(event, meal_type, current_city):
+                    yield result
+                return
 
             # 如果没有之前的推荐记录或已过期，提示用户
             yield event.chain_result([Plain(text="抱歉，我不记得之前给你推荐了什么。请先告诉我你想吃什么类型的食物？")])
@@ -404,6 +609,7 @@ class FoodRecommenderPlugin(Star):
             return
 
     @llm_tool(name="change_food_recommendation")
+    @traced_request("change_food_recommendation")
     async def change_food_recommendation(self, event, city: str = None):
         '''换一个美食推荐
 
@@ -412,99 +618,33 @@ class FoodRecommenderPlugin(Star):
         '''
         user_id = self._get_user_id(event)
 
-        if user_id in self.last_recommendations:
-            last_rec = self.last_recommendations[user_id]
-            # 检查最后推荐是否在24小时内
-            time_diff = datetime.datetime.now() - last_rec['timestamp']
-            if time_diff.total_seconds() < 86400:  # 24小时 = 86400秒
-                # 获取上次推荐的餐点类型
-                meal_type = last_rec['meal_type']
+        # 获取24小时内的最后推荐（24小时 = 86400秒）
+        await self.user_state.load(user_id)
+        last_rec = self.user_state.last_recommendation(user_id, max_age=86400)
+        if last_rec:
+            # 获取上次推荐的餐点类型
+            meal_type = last_rec['meal_type']
 
-                # 如果指定了新城市，使用新城市；否则使用上次的城市
-                if city:
-                    current_city = city
-                else:
-                    current_city = last_rec.get('city', None)
-
-                # 保存城市信息到context中，供generate_food_recommendation使用
-                if current_city:
-                    self.user_specified_city = current_city
-
-                # 初始化历史推荐列表（用于去重）
-                if not hasattr(self, 'recent_foods'):
-                    self.recent_foods = {}
-                if user_id not in self.recent_foods:
-                    self.recent_foods[user_id] = []
-
-                # 发送等待消息
-                city_text = f"（{current_city}）" if current_city else ""
-                yield event.chain_result([Plain(text=f"正在为你换一个推荐{city_text}，请稍候...")])
-
-                # 生成推荐，避免与最近推荐的相同
-                from .recommendation import generate_food_recommendation
-                for attempt in range(10):  # 尝试最多10次以获取不同的推荐
-                    # 确保每次尝试都设置正确的城市信息
-                    if current_city:
-                        self.user_specified_city = current_city
-                    recommendation = await generate_food_recommendation(meal_type, self)
-                    if recommendation['food'] not in self.recent_foods[user_id]:
-                        break
-                    logger.info(f"第{attempt+1}次尝试，推荐的{recommendation['food']}与历史重复，重新生成")
-
-                # 记录本次推荐
-                self.last_recommendations[user_id] = {
-                    'meal_type': meal_type,
-                    'food': recommendation['food'],
-                    'timestamp': datetime.datetime.now(),
-                    'city': current_city
-                }
-
-                # 更新历史推荐列表
-                self.recent_foods[user_id].append(recommendation['food'])
-                if len(self.recent_foods[user_id]) > 5:
-                    self.recent_foods[user_id] = self.recent_foods[user_id][-5:]
-
-                # 构建消息链
-                city_text = f"（{current_city}）" if current_city else ""
-                message_chain = [
-                    Plain(text=f"换一个推荐{city_text}：{recommendation['food']}\n\n"),
-                    Plain(text=f"{recommendation['reason']}\n\n"),
-                    Plain(text=f"{recommendation['description']}")
-                ]
-
-                # 如果有图片，添加图片
-                if recommendation['image_path'] and os.path.exists(recommendation['image_path']):
-                    message_chain.append(Image(file=recommendation['image_path']))
-
-                    # 清理旧图片，只保留最新的几张
-                    self._cleanup_old_images()
-
-                    # 如果是临时图片，延迟删除
-                    if recommendation['image_path'] in self.temp_images:
-                        async def delayed_delete(path, delay=10):
-                            await asyncio.sleep(delay)
-                            try:
-                                if os.path.exists(path):
-                                    os.unlink(path)
-                                    logger.info(f"已删除临时图片: {path}")
-                                    self.temp_images.discard(path)
-                            except Exception as e:
-                                logger.error(f"删除临时图片失败 {path}: {e}")
-
-                        asyncio.create_task(delayed_delete(recommendation['image_path']))
-
-                # 清除临时存储的城市信息
-                if hasattr(self, 'user_specified_city'):
-                    self.user_specified_city = None
-
-                # 返回推荐
-                yield event.chain_result(message_chain)
-                return
+            # 如果指定了新城市，使用新城市；否则使用上次的城市
+            if city:
+                current_city = city
+            else:
+                current_city = last_rec.get('city', None)
+
+            # 发送等待消息
+            city_text = f"（{current_city}）" if current_city else ""
+            yield event.chain_result([Plain(text=f"正在为你换一个推荐{city_text}，请稍候...")])
+
+            # 生成推荐并返回
+            async for result in self._produce_recommendation(event, f"换一个推荐{city_text}：", meal_type, user_id, current_city):
+                yield result
+            return
 
         # 如果没有之前的推荐记录或已过期，提示用户
         yield event.chain_result([Plain(text="抱歉，我不记得之前给你推荐了什么。请先告诉我你想吃什么类型的食物？")])
 
     @llm_tool(name="generate_image")
+    @traced_request("generate_image")
     async def generate_image(self, event, prompt: str, img_width: int = None, img_height: int = None):
         '''AI绘画，根据用户输入的提示词生成图片。
 
@@ -535,10 +675,11 @@ class FoodRecommenderPlugin(Star):
             context=self,
             output_dir=self.OUTPUT_DIR,
             width=width,
-            height=height
+            height=height,
+            priority=PRIORITY_GENERAL  # 推荐图片优先
         )
 
-        if image_path:
+        if self._prepare_image(image_path):
             yield event.chain_result([
                 Plain(text=f"已生成图片：\n"),
                 Image(file=image_path)
@@ -546,25 +687,56 @@ class FoodRecommenderPlugin(Star):
         else:
             yield event.chain_result([Plain(text=f"AI生成图片失败，请稍后再试。")])
 
+    @llm_tool(name="food_stats")
+    async def food_stats(self, event):
+        '''查看食物推荐插件的性能统计，包括各阶段耗时、缓存命中率、错误率、图片队列长度和外部服务的熔断状态。仅管理员可用。'''
+        is_admin = event.is_admin() if hasattr(event, 'is_admin') else False
+        if not is_admin:
+            yield event.chain_result([Plain(text="只有管理员可以查看性能统计。")])
+            return
+        yield event.chain_result([Plain(text=f"食物推荐插件性能统计\n\n{METRICS.format_text()}\n\n熔断器：\n{format_breakers()}")])
+
     # 消息处理器不再需要，因为我们使用LLM工具来处理命令
 
     async def terminate(self):
-        # 退出时清理临时文件
+        # 退出时取消清理任务，删除所有临时图片，并只保留最新的几张
         try:
-            # 清理所有记录的临时图片
-            for img_path in self.temp_images:
-                try:
-                    if os.path.isfile(img_path) and os.path.exists(img_path):
-                        os.unlink(img_path)
-                        logger.info(f"已删除临时图片: {img_path}")
-                except Exception as e:
-                    logger.error(f"清理临时图片失败 {img_path}: {e}")
-
-            # 清理输出目录中的文件，只保留最新的几张
-            self._cleanup_old_images()
+            await self.output_manager.close()
         except Exception as e:
             logger.error(f"清理过程出错: {e}")
 
+        # 停止预热，之后再停止图片生成队列
+        await self.prewarm.close()
+
+        # 停止图片生成队列
+        await self.image_queue.close()
+        stats = self.image_queue.stats()
+        logger.info(f"图片生成队列共完成 {stats['completed']} 个任务，平均等待 {stats['avg_wait']:.2f} 秒")
+
+        # 预热和图片生成队列都停止后再保存食物描述缓存，之后不会再有新的描述写入
+        await DESCRIPTION_CACHE.close()
+        stats = DESCRIPTION_CACHE.stats()
+        logger.info(f"食物描述缓存命中 {stats['hits']} 次，未命中 {stats['misses']} 次")
+
+        # 写入剩余的用户状态
+        await self.user_state.close()
+
+        # 停止熔断器的后台探测
+        await close_breakers()
+
+        # 停止性能指标导出，并写入最后一次
+        await METRICS.close(METRICS_PATH if self.metrics_export else None)
+
+        # 关闭共享的HTTP连接池
+        if self.http_client is not None:
+            await self.http_client.close()
+
+        # 写出剩余的追踪记录
+        TRACER.close()
+
+        # 写入剩余的录制记录
+        await CASSETTE.close()
+
     def _get_user_id(self, event):
         """从事件中获取用户ID"""
         try:
@@ -0,0 +1,230 @@
+import os
+import time
+import asyncio
+from collections import deque
+from astrbot.api import logger
+
+# 统计耗时分位数时使用的分位点
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """
+    滚动窗口的耗时统计
+
+    只保留最近 window 个样本用于计算分位数，累计的次数和总耗时不受窗口限制。
+    """
+
+    def __init__(self, window=1024):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self._samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        """返回累计次数、总耗时和窗口内样本的各分位数，没有样本时分位数为0"""
+        ordered = sorted(self._samples)
+        result = {"count": self.count, "sum": self.total}
+        for q in QUANTILES:
+            result[q] = ordered[int(round(q * (len(ordered) - 1)))] if ordered else 0.0
+        return result
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{str(value)}"' for key, value in sorted(labels.items()))
+    return "{" + pairs + "}"
+
+
+class Metrics:
+    """
+    进程内的性能指标
+
+    - 耗时：每个阶段（span）一个滚动窗口的直方图，输出 p50/p95/p99
+    - 计数器：请求次数、错误次数、合并和去重次数等，只增不减
+    - 即时值：缓存命中率、队列长度等，在读取时通过注册的函数计算
+
+    可以格式化为聊天消息，也可以定期以Prometheus文本格式写入文件。
+    """
+
+    def __init__(self, window=1024, prefix="food"):
+        self.window = window
+        self.prefix = prefix
+        self.started_at = time.time()
+        # 阶段名称 -> Histogram
+        self._latencies = {}
+        # (名称, 标签) -> 数值
+        self._counters = {}
+        # [(名称, 标签, 函数)]
+        self._gauges = []
+        self._export_task = None
+
+    def observe(self, stage, duration_ms):
+        """记录一个阶段的耗时（毫秒）"""
+        histogram = self._latencies.get(stage)
+        if histogram is None:
+            histogram = self._latencies[stage] = Histogram(self.window)
+        histogram.observe(duration_ms)
+
+    def inc(self, name, amount=1, **labels):
+        """增加一个计数器"""
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def counter(self, name, **labels):
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def register_gauge(self, name, func, **labels):
+        """
+        注册一个即时值，读取指标时调用 func() 获取
+
+        同名的即时值以标签区分，例如不同缓存的命中率。
+        """
+        self._gauges.append((name, labels, func))
+
+    def clear_gauges(self):
+        self._gauges = []
+
+    def _read_gauges(self):
+        values = []
+        for name, labels, func in self._gauges:
+            try:
+                value = func()
+            except Exception as e:
+                logger.error(f"读取指标 {name} 失败: {e}")
+                continue
+            if value is not None:
+                values.append((name, labels, float(value)))
+        return values
+
+    def error_rate(self, name):
+        """返回 {name}_errors / {name}_requests"""
+        requests = self.counter(f"{name}_requests")
+        return self.counter(f"{name}_errors") / requests if requests else 0.0
+
+    def snapshot(self):
+        """
+        返回所有指标的当前值
+
+        Returns:
+            dict: latencies（阶段 -> 分位数和次数）、counters、gauges
+        """
+        return {
+            "uptime": time.time() - self.started_at,
+            "latencies": {stage: histogram.summary() for stage, histogram in sorted(self._latencies.items())},
+            "counters": {(name, labels): value for (name, labels), value in sorted(self._counters.items())},
+            "gauges": self._read_gauges(),
+        }
+
+    def format_text(self):
+        """格式化为适合在聊天中发送的文本"""
+        snapshot = self.snapshot()
+        lines = [f"运行时间：{snapshot['uptime'] / 3600:.1f} 小时", "", "各阶段耗时（毫秒）：p50 / p95 / p99，次数"]
+        for stage, summary in snapshot["latencies"].items():
+            lines.append(
+                f"{stage}: {summary[0.5]:.0f} / {summary[0.95]:.0f} / {summary[0.99]:.0f}，{summary['count']}"
+            )
+
+        lines.extend(["", "错误率："])
+        for name in ("llm", "volcengine", "weather"):
+            requests = self.counter(f"{name}_requests")
+            lines.append(f"{name}: {self.error_rate(name):.1%}（{self.counter(f'{name}_errors')}/{requests}）")
+
+        lines.extend(["", "计数："])
+        for (name, labels), value in snapshot["counters"].items():
+            if name.endswith("_requests") or name.endswith("_errors"):
+                continue
+            lines.append(f"{name}{_format_labels(dict(labels))}: {value:g}")
+
+        lines.extend(["", "当前状态："])
+        for name, labels, value in snapshot["gauges"]:
+            if name.endswith("_ratio"):
+                lines.append(f"{name}{_format_labels(labels)}: {value:.1%}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)}: {value:g}")
+        return "\n".join(lines)
+
+    def to_prometheus(self):
+        """格式化为Prometheus文本格式"""
+        snapshot = self.snapshot()
+        prefix = self.prefix
+        lines = []
+
+        name = f"{prefix}_stage_latency_ms"
+        lines.append(f"# TYPE {name} summary")
+        for stage, summary in snapshot["latencies"].items():
+            for q in QUANTILES:
+                lines.append(f"{name}{_format_labels({'stage': stage, 'quantile': q})} {summary[q]:.3f}")
+            lines.append(f"{name}_sum{_format_labels({'stage': stage})} {summary['sum']:.3f}")
+            lines.append(f"{name}_count{_format_labels({'stage': stage})} {summary['count']}")
+
+        typed = set()
+        for (counter, labels), value in snapshot["counters"].items():
+            name = f"{prefix}_{counter}_total"
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_format_labels(dict(labels))} {value:g}")
+
+        for gauge, labels, value in snapshot["gauges"]:
+            name = f"{prefix}_{gauge}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        """把Prometheus文本写入文件，先写临时文件再替换，读取方不会看到写了一半的文件"""
+        self._write(path, self.to_prometheus())
+
+    async def _export_loop(self, path, interval):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                # 在事件循环线程中生成文本，在线程池中写入
+                text = self.to_prometheus()
+                await loop.run_in_executor(None, self._write, path, text)
+            except Exception as e:
+                logger.error(f"写入指标文件失败: {e}")
+
+    @staticmethod
+    def _write(path, text):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def start_export(self, path, interval=60):
+        """启动定期写入Prometheus文本文件的任务，必须在事件循环中调用"""
+        if self._export_task is not None:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._export_task = asyncio.ensure_future(self._export_loop(path, interval))
+        logger.info(f"性能指标每 {interval} 秒写入: {path}")
+
+    async def close(self, path=None):
+        """停止定期写入，设置 path 时最后写入一次"""
+        if self._export_task is not None:
+            self._export_task.cancel()
+            try:
+                await self._export_task
+            except asyncio.CancelledError:
+                pass
+            self._export_task = None
+        if path:
+            try:
+                self.export(path)
+            except Exception as e:
+                logger.error(f"写入指标文件失败: {e}")
+
+
+# 插件共享的性能指标
+METRICS = Metrics()
@@ -0,0 +1,150 @@
+import os
+import time
+import heapq
+import asyncio
+from astrbot.api import logger
+
+# 输出目录中视为图片的扩展名
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+
+
+class OutputDirManager:
+    """
+    输出目录管理器
+
+    启动时扫描一次输出目录，之后在内存中按修改时间维护一个最小堆，
+    新图片加入时只需 O(log n) 即可淘汰最旧的图片，不再重复扫描目录。
+    临时图片在发送后由一个统一的清理任务按时删除，terminate 时取消该任务并删除剩余的临时图片。
+    """
+
+    def __init__(self, output_dir, max_images=1):
+        """
+        Args:
+            output_dir: 输出目录
+            max_images: 目录中最多保留的图片数量
+        """
+        self.output_dir = output_dir
+        self.max_images = max_images
+        # 路径 -> 修改时间，是目录中图片的权威索引
+        self._files = {}
+        # (修改时间, 路径) 的最小堆，可能包含已删除的过期条目，弹出时跳过
+        self._heap = []
+        # 临时图片，在被清理任务删除之前不会被淘汰
+        self._temporary = set()
+        # (删除时间, 路径) 的最小堆
+        self._deadlines = []
+        self._wakeup = None
+        self._reaper_task = None
+
+    def __len__(self):
+        return len(self._files)
+
+    def seed(self):
+        """扫描一次输出目录，建立索引"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._files.clear()
+        for entry in os.scandir(self.output_dir):
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                self._files[entry.path] = entry.stat().st_mtime
+        self._heap = [(mtime, path) for path, mtime in self._files.items()]
+        heapq.heapify(self._heap)
+        logger.info(f"发现 {len(self._files)} 张图片在输出目录中")
+        self.enforce_limit()
+
+    def add(self, path, temporary=False):
+        """
+        登记一张新图片，并淘汰超出数量限制的旧图片
+
+        Args:
+            path: 图片路径
+            temporary: 是否是临时图片，临时图片需要通过 schedule_delete 安排删除
+        """
+        mtime = time.time()
+        self._files[path] = mtime
+        heapq.heappush(self._heap, (mtime, path))
+        if temporary:
+            self._temporary.add(path)
+        self.enforce_limit()
+
+    def is_temporary(self, path):
+        return path in self._temporary
+
+    def enforce_limit(self):
+        """从最旧的图片开始删除，直到数量不超过限制，临时图片会被跳过"""
+        skipped = []
+        while len(self._files) > self.max_images and self._heap:
+            mtime, path = heapq.heappop(self._heap)
+            if self._files.get(path) != mtime:
+                # 过期条目
+                continue
+            if path in self._temporary:
+                logger.info(f"跳过正在使用的图片: {path}")
+                skipped.append((mtime, path))
+                if len(self._files) - len(skipped) <= self.max_images:
+                    break
+                continue
+            self._delete(path)
+            logger.info(f"删除旧图片: {path}")
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+
+    def _delete(self, path):
+        self._files.pop(path, None)
+        self._temporary.discard(path)
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+                return True
+        except Exception as e:
+            logger.error(f"删除图片失败 {path}: {e}")
+        return False
+
+    def schedule_delete(self, path, delay=10):
+        """安排在delay秒后删除一张临时图片"""
+        heapq.heappush(self._deadlines, (time.monotonic() + delay, path))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        """启动统一的临时图片清理任务，必须在事件循环中调用"""
+        if self._reaper_task is None:
+            self._wakeup = asyncio.Event()
+            self._reaper_task = asyncio.ensure_future(self._reap())
+
+    async def _reap(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # 先清除唤醒标记再检查删除任务，期间没有await，不会漏掉新加入的任务
+            self._wakeup.clear()
+            timer = None
+            if self._deadlines:
+                delay = self._deadlines[0][0] - time.monotonic()
+                if delay <= 0:
+                    _, path = heapq.heappop(self._deadlines)
+                    if self._delete(path):
+                        logger.info(f"已删除临时图片: {path}")
+                    continue
+                # 到期时唤醒；有更早的删除任务加入时也会提前醒来
+                timer = loop.call_later(delay, self._wakeup.set)
+            try:
+                await self._wakeup.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+    async def close(self):
+        """取消清理任务，立即删除所有剩余的临时图片，并按数量限制清理"""
+        if self._reaper_task is not None:
+            self._reaper_task.cancel()
+            try:
+                await self._reaper_task
+            except asyncio.CancelledError:
+                pass
+            self._reaper_task = None
+
+        for path in list(self._temporary):
+            if self._delete(path):
+                logger.info(f"已删除临时图片: {path}")
+        self._deadlines.clear()
+        self.enforce_limit()
+        logger.info(f"输出目录清理完成，当前保留 {len(self._files)} 张图片")
@@ -0,0 +1,113 @@
+import asyncio
+import inspect
+from astrbot.api import logger
+
+from .tracing import span
+
+
+class Pipeline:
+    """
+    简单的依赖图执行器
+
+    每个阶段声明自己依赖的输入或其他阶段，执行时所有阶段同时创建任务，
+    每个阶段在依赖全部完成后立即开始，互不依赖的阶段并发执行。
+    """
+
+    def __init__(self, name="pipeline"):
+        self.name = name
+        # 阶段名称 -> (函数, 依赖列表)，按添加顺序保存，保证依赖总是先于使用者定义
+        self._stages = {}
+
+    def add_stage(self, name, func, deps=()):
+        """
+        添加一个阶段
+
+        Args:
+            name: 阶段名称，也是该阶段结果在结果字典中的键
+            func: 阶段函数（同步或异步），以依赖名称作为关键字参数调用
+            deps: 依赖的阶段名称或输入名称
+
+        Returns:
+            Pipeline: 自身，便于链式调用
+        """
+        if name in self._stages:
+            raise ValueError(f"阶段 {name} 已存在")
+        self._stages[name] = (func, tuple(deps))
+        return self
+
+    @property
+    def stages(self):
+        return list(self._stages)
+
+    async def _run_stage(self, name, tasks, results):
+        func, deps = self._stages[name]
+        # 等待依赖的阶段完成，输入值已经在results中
+        pending = [tasks[dep] for dep in deps if dep in tasks]
+        if pending:
+            await asyncio.gather(*pending)
+
+        with span(f"{self.name}.{name}"):
+            value = func(**{dep: results[dep] for dep in deps})
+            if inspect.isawaitable(value):
+                value = await value
+        results[name] = value
+        return value
+
+    def start(self, **inputs):
+        """
+        启动所有阶段，不等待完成
+
+        Args:
+            **inputs: 流水线的初始输入
+
+        Returns:
+            tuple: (阶段名称 -> asyncio.Task 的字典, 结果字典)
+        """
+        results = dict(inputs)
+        tasks = {}
+        for name, (_, deps) in self._stages.items():
+            for dep in deps:
+                if dep not in tasks and dep not in results:
+                    raise ValueError(f"阶段 {name} 依赖的 {dep} 既不是输入也不是已定义的阶段")
+            tasks[name] = asyncio.ensure_future(self._run_stage(name, tasks, results))
+        return tasks, results
+
+    async def run(self, **inputs):
+        """
+        运行流水线并收集所有阶段的结果
+
+        Args:
+            **inputs: 流水线的初始输入
+
+        Returns:
+            dict: 包含输入和所有阶段结果的字典
+        """
+        results, _ = await self.run_until(self.stages, **inputs)
+        return results
+
+    async def run_until(self, stages, **inputs):
+        """
+        运行流水线，只等待指定的阶段完成，其余阶段继续在后台运行
+
+        指定的阶段出错或调用方被取消时，取消所有尚未完成的阶段并重新抛出。
+
+        Args:
+            stages: 需要等待的阶段名称
+            **inputs: 流水线的初始输入
+
+        Returns:
+            tuple: (结果字典, 未等待的阶段名称 -> asyncio.Task)
+        """
+        tasks, results = self.start(**inputs)
+        try:
+            await asyncio.gather(*(tasks[name] for name in stages))
+        except BaseException as e:
+            if isinstance(e, Exception):
+                logger.error(f"{self.name} 执行失败: {e}")
+            # 出错或被取消时，不留下仍在运行的阶段
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+            raise
+        remaining = {name: task for name, task in tasks.items() if name not in stages}
+        return results, remaining
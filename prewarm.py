@@ -0,0 +1,159 @@
+import asyncio
+import datetime
+from astrbot.api import logger
+
+from .food_utils import WEATHER_CACHE, fetch_weather, get_season
+from .dynamic_food_generator import generate_food_candidates
+from .generate_description import generate_food_description
+from .image_generator import generate_food_image
+from .image_queue import PRIORITY_PREWARM
+from .food_ranker import FOOD_RANKER
+from .recommendation import MEAL_WINDOWS
+from .tracing import TRACER
+from .metrics import METRICS
+
+
+def next_prewarm(now, lead_minutes):
+    """
+    计算下一次预热的时间
+
+    Args:
+        now: 当前时间（datetime）
+        lead_minutes: 在用餐时段开始前多少分钟预热
+
+    Returns:
+        tuple: (预热时间, 用餐时段)
+    """
+    lead = datetime.timedelta(minutes=lead_minutes)
+    upcoming = []
+    for window in MEAL_WINDOWS:
+        at = now.replace(hour=window[0], minute=0, second=0, microsecond=0) - lead
+        if at <= now:
+            at += datetime.timedelta(days=1)
+        upcoming.append((at, window))
+    return min(upcoming, key=lambda item: item[0])
+
+
+class PrewarmScheduler:
+    """
+    用餐时段的缓存预热
+
+    在每个用餐时段开始前 lead_minutes 分钟，为配置的城市刷新天气，按该时段的每种餐点类型
+    生成候选食物，并预先生成它们的描述和图片，使时段开始时的请求尽量命中缓存。
+    使用本地排序时，所有城市和餐点类型的候选食物由一次批量打分得到。
+    图片以最低优先级提交到图片生成队列，不影响用户请求。
+    """
+
+    def __init__(self, plugin, cities, lead_minutes=5, foods_per_meal=3, images=True):
+        """
+        Args:
+            plugin: 插件对象，提供HTTP连接池、配置、图片缓存和生成队列
+            cities: 需要预热的城市列表
+            lead_minutes: 在用餐时段开始前多少分钟预热
+            foods_per_meal: 每个城市每种餐点类型预热的食物数量
+            images: 是否预先生成图片，需要开启图片缓存
+        """
+        self.plugin = plugin
+        self.cities = list(dict.fromkeys(cities))
+        self.lead_minutes = lead_minutes
+        self.foods_per_meal = foods_per_meal
+        self.images = images
+        self._task = None
+
+    def start(self):
+        """启动预热任务，必须在事件循环中调用"""
+        if self._task is None and self.cities:
+            self._task = asyncio.ensure_future(self._loop())
+            logger.info(f"已开启用餐时段预热，城市: {'、'.join(self.cities)}，提前 {self.lead_minutes} 分钟")
+
+    async def _loop(self):
+        while True:
+            at, window = next_prewarm(datetime.datetime.now(), self.lead_minutes)
+            await asyncio.sleep(max(0.0, (at - datetime.datetime.now()).total_seconds()))
+            try:
+                await self.run(window)
+            except Exception as e:
+                logger.error(f"预热{window[2]}时段失败: {e}")
+
+    async def run(self, window):
+        """为所有城市预热一个用餐时段"""
+        logger.info(f"开始预热{window[2]}时段: {'、'.join(self.cities)}")
+        METRICS.inc("prewarm_runs")
+        with TRACER.request("prewarm", time_of_day=window[2], cities=len(self.cities)):
+            weather = await asyncio.gather(*(self._refresh_weather(city) for city in self.cities))
+            foods = await self._pick_foods(window, weather)
+            # 描述和图片与城市无关，每道食物只预热一次
+            await asyncio.gather(*(self._prewarm_food(food) for food in foods))
+        logger.info(f"{window[2]}时段预热完成，共 {len(foods)} 道食物")
+
+    async def _refresh_weather(self, city):
+        # 强制刷新天气，时段开始时缓存中的天气是新鲜的
+        weather_info = await fetch_weather(city, self.plugin.http_client)
+        if weather_info is not None:
+            WEATHER_CACHE.set(city, weather_info)
+            return weather_info
+        return {"temperature": "20", "weather": "晴朗", "city": city}
+
+    async def _pick_foods(self, window, weather):
+        """为每个城市和该时段的每种餐点类型选出候选食物，返回去重后的食物"""
+        season = get_season()
+        foods = set()
+        if getattr(self.plugin, 'ranking_mode', 'local') != "llm":
+            # 与真实请求使用相同的随机程度抽样，预热的食物与请求会抽到的食物分布一致
+            contexts = [
+                {"meal_type": meal_type, "weather": info["weather"], "temperature": info["temperature"], "season": season}
+                for info in weather for meal_type in window[3]
+            ]
+            sampling_temperature = getattr(self.plugin, 'ranking_temperature', 0.5)
+            for candidates in FOOD_RANKER.rank_batch(contexts, k=self.foods_per_meal, sampling_temperature=sampling_temperature):
+                foods.update(candidates)
+            return foods
+
+        for info in weather:
+            for meal_type in window[3]:
+                try:
+                    candidates = await generate_food_candidates(
+                        meal_type,
+                        info["weather"],
+                        info["temperature"],
+                        season,
+                        None,
+                        self.plugin.context,
+                        count=self.foods_per_meal
+                    )
+                except Exception as e:
+                    logger.error(f"预热时生成{info['city']}的{meal_type}候选食物失败: {e}")
+                    continue
+                foods.update(candidates)
+        return foods
+
+    async def _prewarm_food(self, food):
+        try:
+            await generate_food_description(food, self.plugin.context)
+            METRICS.inc("prewarm_items", kind="description")
+        except Exception as e:
+            logger.error(f"预热\"{food}\"的描述失败: {e}")
+
+        image_store = self.plugin.image_store
+        if not self.images or image_store is None:
+            return
+        # 图片缓存中每个键生成满 max_variants 张后才会直接复用，已满时调用会立即返回
+        for _ in range(image_store.max_variants):
+            try:
+                path = await generate_food_image(food, context=self.plugin, priority=PRIORITY_PREWARM)
+            except Exception as e:
+                logger.error(f"预热\"{food}\"的图片失败: {e}")
+                return
+            if path is None:
+                return
+        METRICS.inc("prewarm_items", kind="image")
+
+    async def close(self):
+        """停止预热任务"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
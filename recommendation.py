@@ -2,8 +2,15 @@ import random
 import datetime
 from astrbot.api import logger
 
-from .food_utils import get_season, get_weather, REASON_TEMPLATES, FOOD_CATEGORIES
+from .food_utils import get_season, get_weather, REASON_TEMPLATES
+from .food_catalog import FOOD_CATALOG
+from .food_ranker import FOOD_RANKER
+from .tracing import span
 from .image_generator import get_food_image
+from .pipeline import Pipeline
+from .metrics import METRICS
+from .llm_utils import provider_chat
+from .resilience import CircuitOpenError
 
 # 实现llm_recommend_food方法
 async def llm_recommend_food(prompt, context=None):
@@ -30,42 +37,114 @@ async def llm_recommend_food(prompt, context=None):
         if hasattr(context, 'get_using_provider'):
             provider = context.get_using_provider()
             if provider:
-                # 使用provider调用大模型
-                import random
+                # 使用provider调用大模型，带有期限和熔断
                 session_id = f"food_recommendation_{random.randint(1000, 9999)}"
-                llm_response = await provider.text_chat(
-                    prompt=prompt,
-                    session_id=session_id
-                )
+                text = await provider_chat(provider, prompt, session_id)
                 logger.info(f"成功使用provider调用大模型")
-                return llm_response.completion_text.strip() if hasattr(llm_response, 'completion_text') else llm_response.strip()
+                return text
         else:
             logger.warning("无法获取provider，返回固定回复")
             return f"这是固定回复，因为无法获取provider"
+    except CircuitOpenError:
+        logger.info("大模型熔断中，返回固定回复")
+        return f"这是固定回复，因为大模型暂时不可用"
     except Exception as e:
         logger.error(f"调用大模型失败: {e}")
         return f"这是固定回复，因为调用大模型失败: {e}"
 
 # 尝试导入动态食物生成器
 try:
-    from .dynamic_food_generator import generate_food
+    from .dynamic_food_generator import generate_food_candidates, rerank_food_candidates, extract_preferences
     DYNAMIC_FOOD_GENERATOR_AVAILABLE = True
     logger.info("成功导入动态食物生成器")
 except ImportError as e:
     logger.warning(f"无法导入动态食物生成器，将使用静态食物列表: {e}")
     DYNAMIC_FOOD_GENERATOR_AVAILABLE = False
 
-# 生成食物推荐 - 更新为支持AI生成图片和动态描述
-async def generate_food_recommendation(meal_type=None, context=None):
-    # 导入动态生成描述和推荐理由的函数
-    try:
-        from .generate_description import generate_food_description, generate_recommendation_reason
-        dynamic_generation_available = True
-        logger.info("成功导入动态生成描述和推荐理由的函数")
-    except ImportError as e:
-        logger.warning(f"无法导入动态生成函数，将使用静态模板: {e}")
-        dynamic_generation_available = False
+# 尝试导入动态生成描述和推荐理由的函数
+try:
+    from .generate_description import generate_food_description, generate_recommendation_reason
+    from .combined_generation import generate_combined
+    DYNAMIC_GENERATION_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"无法导入动态生成函数，将使用静态模板: {e}")
+    DYNAMIC_GENERATION_AVAILABLE = False
+
+def _get_actual_context(context):
+    """如果context有context属性，则返回context.context，否则返回context本身"""
+    return context.context if hasattr(context, 'context') else context
+
+def resolve_preferences(preferences=None, user_text=None):
+    """返回本次请求的偏好标签，没有解析过时从用户文本中提取"""
+    if preferences is None and DYNAMIC_FOOD_GENERATOR_AVAILABLE:
+        preferences = extract_preferences(user_text)
+    return list(preferences or [])
+
+def _rank_local_foods(timing, weather_info, context, count, exclude, preferences):
+    """用本地排序器从食物目录中选出最多count个不在exclude中的食物"""
+    with span("rank", meal_type=timing["meal_type"]):
+        return FOOD_RANKER.rank(
+            meal_type=timing["meal_type"],
+            weather=weather_info["weather"],
+            temperature=weather_info["temperature"],
+            season=timing["season"],
+            preferences=preferences,
+            k=count,
+            exclude=exclude,
+            sampling_temperature=getattr(context, 'ranking_temperature', 0.5)
+        )
+
+# 食物目录中没有可用食物且LLM不可用时推荐的食物
+DEFAULT_FOODS = ["蛋炒饭", "牛肉面", "番茄鸡蛋面"]
+
+def _fallback_candidates(candidates, count, exclude):
+    """候选为空时依次使用食物目录中任意餐点类型的食物和默认食物，保证至少有一个候选"""
+    if candidates:
+        return candidates
+    candidates = FOOD_CATALOG.sample(count=count, exclude=exclude) or list(DEFAULT_FOODS)
+    METRICS.inc("candidate_fallbacks")
+    logger.warning(f"没有可用的候选食物，使用: {candidates}")
+    return candidates
 
+def _default_reason(food, timing, weather_info):
+    """使用推荐理由模板生成推荐理由"""
+    reason_template = random.choice(REASON_TEMPLATES)
+    city = weather_info.get("city", "上海")
+    city_text = f"在{city}" if city else ""
+    return reason_template.format(
+        food=food,
+        date=timing["date"],
+        time_of_day=timing["time_of_day"],
+        weather=weather_info["weather"],
+        temperature=weather_info["temperature"],
+        season=timing["season"],
+        city_text=city_text
+    )
+
+# 用餐时段：(开始小时, 结束小时, 时段, 可能推荐的餐点类型)
+MEAL_WINDOWS = [
+    (5, 10, "早上", ["早餐"]),
+    (10, 14, "中午", ["中餐", "快餐", "面食"]),
+    (14, 17, "下午", ["甜点"]),
+    (17, 21, "晚上", ["中餐", "快餐", "面食"]),
+]
+# 不在任何用餐时段内时（夜里）推荐的餐点类型
+NIGHT_MEAL_TYPES = ["快餐", "面食"]
+
+def meal_window(hour):
+    """返回某个小时所在的用餐时段，不在任何时段内时返回None"""
+    for window in MEAL_WINDOWS:
+        if window[0] <= hour < window[1]:
+            return window
+    return None
+
+def _window_meal_types():
+    """所有用餐时段中可能推荐的餐点类型"""
+    types = [meal_type for window in MEAL_WINDOWS for meal_type in window[3]] + NIGHT_MEAL_TYPES
+    return list(dict.fromkeys(types))
+
+# 阶段：根据时间确定日期、时段和餐点类型
+def resolve_timing(meal_type):
     # 获取当前日期和时间
     now = datetime.datetime.now()
     date = now.strftime("%Y年%m月%d日")
@@ -73,21 +152,13 @@ async def generate_food_recommendation(meal_type=None, context=None):
 
     # 根据时间确定推荐的餐点类型
     if meal_type is None:
-        if 5 <= hour < 10:
-            time_of_day = "早上"
-            meal_type = "早餐"
-        elif 10 <= hour < 14:
-            time_of_day = "中午"
-            meal_type = random.choice(["中餐", "快餐", "面食"])
-        elif 14 <= hour < 17:
-            time_of_day = "下午"
-            meal_type = "甜点"
-        elif 17 <= hour < 21:
-            time_of_day = "晚上"
-            meal_type = random.choice(["中餐", "快餐", "面食"])
+        window = meal_window(hour)
+        if window is not None:
+            time_of_day = window[2]
+            meal_type = random.choice(window[3])
         else:
             time_of_day = "夜里"
-            meal_type = random.choice(["快餐", "面食"])
+            meal_type = random.choice(NIGHT_MEAL_TYPES)
     else:
         # 如果明确指定了用餐类型
         if "早" in meal_type:
@@ -101,156 +172,285 @@ async def generate_food_recommendation(meal_type=None, context=None):
             meal_type = random.choice(["中餐", "快餐", "面食"])
         else:
             time_of_day = "现在"
-            meal_type = random.choice(list(FOOD_CATEGORIES.keys()))
+            # 食物目录为空时从用餐时段的餐点类型中选择
+            meal_type = random.choice(FOOD_CATALOG.meal_types or _window_meal_types())
 
-    # 获取天气信息，将用户文本传入以识别城市
-    user_text = None
-    if hasattr(context, 'last_user_text'):
-        user_text = context.last_user_text
+    return {
+        "date": date,
+        "time_of_day": time_of_day,
+        "meal_type": meal_type,
+        # 获取当前季节
+        "season": get_season()
+    }
 
+# 阶段：获取天气信息
+async def fetch_weather(context, city, user_text):
+    http_client = getattr(context, 'http_client', None)
     # 检查是否有用户指定的城市
-    if hasattr(context, 'user_specified_city') and context.user_specified_city:
-        specified_city = context.user_specified_city
-        logger.info(f"用户指定了城市: {specified_city}")
+    if city:
+        logger.info(f"用户指定了城市: {city}")
         # 如果用户指定了城市，使用指定的城市获取天气
-        weather_info = await get_weather(specified_city)
-        # 注意：不清除城市信息，因为可能需要重试
+        weather_info = await get_weather(city, http_client)
     else:
         # 否则使用用户文本识别城市
-        weather_info = await get_weather(user_text)
+        weather_info = await get_weather(user_text, http_client)
 
-    temperature = weather_info["temperature"]
-    weather = weather_info["weather"]
-    city = weather_info.get("city", "上海")
+    logger.info(f"最终使用的城市: {weather_info.get('city', '上海')}, 温度: {weather_info['temperature']}, 天气: {weather_info['weather']}")
+    return weather_info
+
+# 阶段：一次生成多个候选食物，并过滤掉最近推荐过的
+async def pick_candidates(timing, weather_info, context, exclude, user_text, preferences):
+    meal_type = timing["meal_type"]
+    exclude = set(exclude or ())
+    count = getattr(context, 'candidate_count', 5)
+    # local：只用本地排序；rerank：本地排序后由LLM重新排列；llm：由LLM生成候选
+    ranking_mode = getattr(context, 'ranking_mode', 'local')
+
+    # 如果动态食物生成器不可用，只使用本地排序
+    if ranking_mode != "llm" or not DYNAMIC_FOOD_GENERATOR_AVAILABLE:
+        candidates = _rank_local_foods(timing, weather_info, context, count, exclude, preferences)
+        if ranking_mode == "rerank" and DYNAMIC_FOOD_GENERATOR_AVAILABLE and candidates:
+            candidates = await rerank_food_candidates(
+                candidates,
+                meal_type,
+                weather_info["weather"],
+                weather_info["temperature"],
+                timing["season"],
+                preferences,
+                _get_actual_context(context)
+            )
+        # 食物目录为空时才会没有候选，此时仍由LLM生成
+        if candidates or not DYNAMIC_FOOD_GENERATOR_AVAILABLE:
+            return _fallback_candidates(candidates, count, exclude)
 
-    logger.info(f"最终使用的城市: {city}, 温度: {temperature}, 天气: {weather}")
+    try:
+        candidates = await generate_food_candidates(
+            meal_type,
+            weather_info["weather"],
+            weather_info["temperature"],
+            timing["season"],
+            user_text,
+            _get_actual_context(context),
+            count=count,
+            exclude=exclude,
+            preferences=preferences
+        )
+        if candidates:
+            return candidates
+    except Exception as e:
+        logger.error(f"动态生成候选食物失败: {e}")
+    # 如果动态生成失败，使用本地排序
+    candidates = _rank_local_foods(timing, weather_info, context, count, exclude, preferences)
+    return _fallback_candidates(candidates, count, exclude)
 
-    # 获取当前季节
-    season = get_season()
+# 阶段：从候选中选择排名最高且未推荐过的食物
+def choose_food(candidates, exclude):
+    exclude = set(exclude or ())
+    candidates = _fallback_candidates(candidates, 1, exclude)
+    for index, food in enumerate(candidates):
+        if food not in exclude:
+            if index:
+                # 排在前面的候选与历史重复，跳过了 index 个
+                METRICS.inc("dedupe_skipped", index)
+            logger.info(f"选择的食物推荐: {food}")
+            return food
+    METRICS.inc("dedupe_exhausted")
+    logger.info(f"候选食物都与历史重复，使用排名最高的: {candidates[0]}")
+    return candidates[0]
+
+# 阶段：获取食物图片
+async def fetch_image(food, context):
+    if not hasattr(context, 'OUTPUT_DIR'):
+        # 如果context没有必要的属性，则返回None
+        logger.warning("context缺少OUTPUT_DIR属性，无法获取食物图片")
+        return None
+    return await get_food_image(food, context.OUTPUT_DIR, None, context)
 
-    # 动态生成食物推荐
-    if DYNAMIC_FOOD_GENERATOR_AVAILABLE:
+# 阶段：生成食物描述
+async def describe_food(food, context):
+    if DYNAMIC_GENERATION_AVAILABLE:
         try:
-            # 使用动态食物生成器，传递context.context参数
-            # 如果context有context属性，则传递context.context，否则传递context
-            actual_context = context.context if hasattr(context, 'context') else context
-            food = await generate_food(meal_type, weather, temperature, season, user_text, actual_context)
-            logger.info(f"动态生成的食物推荐: {food}")
+            return await generate_food_description(food, _get_actual_context(context))
         except Exception as e:
-            logger.error(f"动态生成食物失败: {e}")
-            # 如果动态生成失败，使用静态食物列表
-            if meal_type in FOOD_CATEGORIES:
-                food = random.choice(FOOD_CATEGORIES[meal_type])
-            else:
-                # 从所有食物中随机选择
-                all_foods = []
-                for foods in FOOD_CATEGORIES.values():
-                    all_foods.extend(foods)
-                food = random.choice(all_foods)
-    else:
-        # 如果动态食物生成器不可用，使用静态食物列表
-        if meal_type in FOOD_CATEGORIES:
-            food = random.choice(FOOD_CATEGORIES[meal_type])
-        else:
-            # 从所有食物中随机选择
-            all_foods = []
-            for foods in FOOD_CATEGORIES.values():
-                all_foods.extend(foods)
-            food = random.choice(all_foods)
-
-    # 获取食物图片
-    if hasattr(context, 'OUTPUT_DIR'):
-        image_path = await get_food_image(food, context.OUTPUT_DIR, None, context)
-    else:
-        # 如果context没有必要的属性，则传递None
-        image_path = None
-        logger.warning("context缺少OUTPUT_DIR属性，无法获取食物图片")
+            logger.error(f"动态生成食物描述失败: {e}")
+    # 如果动态生成失败，使用默认描述
+    return f"{food}是一道深受大众喜爱的美食，口感独特，风味绝佳。"
 
-    # 测试context对象的结构
-    if context:
-        # 输出context对象的所有属性
-        attrs = [attr for attr in dir(context) if not attr.startswith('__')]
-        logger.info(f"context对象的属性: {attrs}")
+# 阶段：生成推荐理由
+async def explain_food(food, timing, weather_info, context):
+    if DYNAMIC_GENERATION_AVAILABLE:
+        try:
+            return await generate_recommendation_reason(
+                food,
+                weather_info["weather"],
+                weather_info["temperature"],
+                timing["date"],
+                timing["time_of_day"],
+                timing["season"],
+                weather_info.get("city", "上海"),
+                _get_actual_context(context)
+            )
+        except Exception as e:
+            logger.error(f"动态生成推荐理由失败: {e}")
+    return _default_reason(food, timing, weather_info)
 
-        # 检查是否有llm相关的属性
-        llm_attrs = [attr for attr in attrs if 'llm' in attr.lower()]
-        logger.info(f"context对象的llm相关属性: {llm_attrs}")
+# 推荐流水线：天气和时段 -> 候选食物 -> 食物 -> 图片、描述、推荐理由（三者并发）
+RECOMMENDATION_PIPELINE = (
+    Pipeline("food_recommendation")
+    .add_stage("timing", resolve_timing, deps=("meal_type",))
+    .add_stage("weather_info", fetch_weather, deps=("context", "city", "user_text"))
+    .add_stage("candidates", pick_candidates, deps=("timing", "weather_info", "context", "exclude", "user_text", "preferences"))
+    .add_stage("food", choose_food, deps=("candidates", "exclude"))
+    .add_stage("image_path", fetch_image, deps=("food", "context"))
+    .add_stage("description", describe_food, deps=("food", "context"))
+    .add_stage("reason", explain_food, deps=("food", "timing", "weather_info", "context"))
+)
 
-        # 检查是否有provider相关的属性
-        provider_attrs = [attr for attr in attrs if 'provider' in attr.lower()]
-        logger.info(f"context对象的provider相关属性: {provider_attrs}")
+# 阶段：合并调用模式下，候选食物只由本地排序生成
+def pick_local_candidates(timing, weather_info, context, exclude, preferences):
+    count = getattr(context, 'candidate_count', 5)
+    exclude = set(exclude or ())
+    candidates = _rank_local_foods(timing, weather_info, context, count, exclude, preferences)
+    return _fallback_candidates(candidates, count, exclude)
 
-        # 检查是否有get_using_provider方法
-        if hasattr(context, 'get_using_provider'):
-            try:
-                provider = context.get_using_provider()
-                if provider and hasattr(provider, 'text_chat'):
-                    logger.info(f"context.get_using_provider()方法可用，并且返回的对象有text_chat()方法")
-                else:
-                    logger.info(f"context.get_using_provider()方法可用，但返回的对象没有text_chat()方法")
-            except Exception as e:
-                logger.error(f"context.get_using_provider()方法异常: {e}")
-        else:
-            logger.info(f"context对象没有get_using_provider()方法")
+def _combined_arguments(timing, weather_info, context, preferences):
+    return {
+        "meal_type": timing["meal_type"],
+        "weather": weather_info["weather"],
+        "temperature": weather_info["temperature"],
+        "date": timing["date"],
+        "time_of_day": timing["time_of_day"],
+        "season": timing["season"],
+        "city": weather_info.get("city", "上海"),
+        "preferences": preferences,
+        "context": _get_actual_context(context),
+    }
 
-    # 动态生成食物描述和推荐理由
-    if dynamic_generation_available:
-        try:
-            # 尝试动态生成食物描述，传递context.context参数
-            # 如果context有context属性，则传递context.context，否则传递context
-            actual_context = context.context if hasattr(context, 'context') else context
-            description = await generate_food_description(food, actual_context)
+# 阶段：一次LLM调用为已确定的食物生成描述和推荐理由
+async def describe_and_explain(food, timing, weather_info, context, preferences):
+    return await generate_combined(food=food, **_combined_arguments(timing, weather_info, context, preferences))
 
-            # 尝试动态生成推荐理由，传递context.context参数
-            reason = await generate_recommendation_reason(food, weather, temperature, date, time_of_day, season, city, actual_context)
+# 阶段：一次LLM调用选择食物并生成描述和推荐理由
+async def pick_describe_and_explain(candidates, timing, weather_info, context, exclude, preferences):
+    if getattr(context, 'ranking_mode', 'local') == "rerank":
+        # 由LLM从本地排序的候选中选择
+        return await generate_combined(
+            candidates=candidates, exclude=exclude, **_combined_arguments(timing, weather_info, context, preferences)
+        )
+    # 由LLM自由选择，本地排序的候选只在LLM的回复无效时使用
+    return await generate_combined(
+        fallback_foods=candidates, exclude=exclude, **_combined_arguments(timing, weather_info, context, preferences)
+    )
 
-            logger.info(f"成功动态生成食物描述和推荐理由")
-        except Exception as e:
-            logger.error(f"动态生成失败: {e}")
-            # 如果动态生成失败，使用默认描述
-            description = f"{food}是一道深受大众喜爱的美食，口感独特，风味绝佳。"
-
-            # 选择一个推荐理由模板
-            reason_template = random.choice(REASON_TEMPLATES)
-            city_text = f"在{city}" if city else ""
-            reason = reason_template.format(
-                food=food,
-                date=date,
-                time_of_day=time_of_day,
-                weather=weather,
-                temperature=temperature,
-                season=season,
-                city_text=city_text
-            )
+def _build_combined_pipeline(local_food):
+    """
+    合并调用模式的推荐流水线，一次LLM调用得到食物、描述和推荐理由
+
+    Args:
+        local_food: 为True时食物由本地排序确定，图片生成与LLM调用同时进行；
+            否则由LLM选择食物，图片在LLM返回后开始生成
+    """
+    pipeline = (
+        Pipeline("food_recommendation")
+        .add_stage("timing", resolve_timing, deps=("meal_type",))
+        .add_stage("weather_info", fetch_weather, deps=("context", "city", "user_text"))
+        .add_stage("candidates", pick_local_candidates, deps=("timing", "weather_info", "context", "exclude", "preferences"))
+    )
+    if local_food:
+        pipeline.add_stage("food", choose_food, deps=("candidates", "exclude"))
+        pipeline.add_stage("combined", describe_and_explain, deps=("food", "timing", "weather_info", "context", "preferences"))
     else:
-        # 使用默认描述
-        description = f"{food}是一道深受大众喜爱的美食，口感独特，风味绝佳。"
-
-        # 选择一个推荐理由模板
-        reason_template = random.choice(REASON_TEMPLATES)
-        city_text = f"在{city}" if city else ""
-        reason = reason_template.format(
-            food=food,
-            date=date,
-            time_of_day=time_of_day,
-            weather=weather,
-            temperature=temperature,
-            season=season,
-            city_text=city_text
+        pipeline.add_stage(
+            "combined", pick_describe_and_explain,
+            deps=("candidates", "timing", "weather_info", "context", "exclude", "preferences")
         )
+        pipeline.add_stage("food", lambda combined: combined["food"], deps=("combined",))
+    return (
+        pipeline
+        .add_stage("image_path", fetch_image, deps=("food", "context"))
+        .add_stage("description", lambda combined: combined["description"], deps=("combined",))
+        .add_stage("reason", lambda combined: combined["reason"], deps=("combined",))
+    )
+
+COMBINED_LOCAL_PIPELINE = _build_combined_pipeline(local_food=True)
+COMBINED_PICKING_PIPELINE = _build_combined_pipeline(local_food=False)
 
-    # 组装结果
-    result = {
-        "food": food,
-        "reason": reason,
-        "description": description,
+def _select_pipeline(context):
+    """根据LLM调用方式和候选食物生成方式选择流水线"""
+    if getattr(context, 'llm_call_mode', 'separate') != "combined" or not DYNAMIC_GENERATION_AVAILABLE:
+        return RECOMMENDATION_PIPELINE
+    if getattr(context, 'ranking_mode', 'local') == "local":
+        return COMBINED_LOCAL_PIPELINE
+    return COMBINED_PICKING_PIPELINE
+
+def _assemble_result(results, image_path):
+    """把流水线的结果组装成推荐结果"""
+    timing = results["timing"]
+    weather_info = results["weather_info"]
+    return {
+        "food": results["food"],
+        "candidates": results["candidates"],
+        "reason": results["reason"],
+        "description": results["description"],
         "image_path": image_path,
-        "date": date,
-        "time_of_day": time_of_day,
-        "weather": weather,
-        "temperature": temperature,
-        "season": season,
-        "meal_type": meal_type
+        "date": timing["date"],
+        "time_of_day": timing["time_of_day"],
+        "weather": weather_info["weather"],
+        "temperature": weather_info["temperature"],
+        "season": timing["season"],
+        "meal_type": timing["meal_type"]
     }
 
-    return result
+# 生成食物推荐 - 更新为支持AI生成图片和动态描述
+def _pipeline_inputs(meal_type, context, exclude, city, user_text, preferences):
+    """
+    本次请求的流水线输入
+
+    城市、用户文本和偏好只属于本次请求，作为输入传给各阶段，不保存在插件对象上，
+    避免并发的请求互相覆盖。
+    """
+    return {
+        "meal_type": meal_type,
+        "context": context,
+        "exclude": exclude or (),
+        "city": city,
+        "user_text": user_text,
+        "preferences": resolve_preferences(preferences, user_text),
+    }
+
+async def generate_food_recommendation(meal_type=None, context=None, exclude=None, city=None, user_text=None, preferences=None):
+    """
+    生成一次完整的食物推荐
+
+    Args:
+        meal_type: 用餐类型，为None时根据当前时间确定
+        context: 插件对象
+        exclude: 需要避开的食物（如该用户最近推荐过的），在生成图片和描述之前过滤
+        city: 用户指定的城市，为None时从用户文本中识别
+        user_text: 用户的消息文本，用于识别城市和偏好
+        preferences: 已解析的偏好标签，为None时从用户文本中提取
+
+    Returns:
+        dict: 推荐结果
+    """
+    inputs = _pipeline_inputs(meal_type, context, exclude, city, user_text, preferences)
+    results = await _select_pipeline(context).run(**inputs)
+    return _assemble_result(results, results["image_path"])
+
+# 分步生成食物推荐：文字部分就绪后立即返回，图片继续在后台生成
+async def start_food_recommendation(meal_type=None, context=None, exclude=None, city=None, user_text=None, preferences=None):
+    """
+    分步生成食物推荐
+
+    Args:
+        参数同 generate_food_recommendation
+
+    Returns:
+        tuple: (image_path为None的推荐结果, 图片任务)，图片任务的结果是图片路径或None
+    """
+    pipeline = _select_pipeline(context)
+    text_stages = [name for name in pipeline.stages if name != "image_path"]
+    results, remaining = await pipeline.run_until(
+        text_stages, **_pipeline_inputs(meal_type, context, exclude, city, user_text, preferences)
+    )
+    return _assemble_result(results, None), remaining["image_path"]
@@ -0,0 +1,348 @@
+import time
+import random
+import asyncio
+import aiohttp
+from astrbot.api import logger
+
+from .metrics import METRICS
+
+# 熔断器状态，数值用于导出指标
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开期间被直接拒绝的调用"""
+
+
+class ServiceError(Exception):
+    """外部服务返回的错误响应，例如非200的状态码"""
+
+
+class RetryableError(ServiceError):
+    """可以重试的服务端错误，例如限流或5xx状态码"""
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续失败（包括超时，以及耗时超过 slow_threshold 的慢调用）达到 failure_threshold 次后打开，
+    打开期间的调用立即抛出 CircuitOpenError，调用方直接使用回退结果，不再等待外部服务。
+
+    打开 reset_timeout 秒后：
+    - 调用时提供了 probe 的，在后台调用 probe 探测服务，成功后关闭，失败则等待 reset_timeout 后再试
+    - 否则进入半开状态，只放行一个调用作为试探，成功后关闭，失败则重新打开
+    """
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30.0, slow_threshold=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_threshold = slow_threshold
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.opened_count = 0
+        self.last_error = None
+        # 半开状态下是否已经放行了试探调用
+        self._trial = False
+        self._probe = None
+        self._probe_task = None
+
+    def configure(self, failure_threshold=None, reset_timeout=None, slow_threshold=None):
+        """调整熔断参数，slow_threshold 为0时不把慢调用视为失败"""
+        if failure_threshold is not None:
+            self.failure_threshold = max(1, int(failure_threshold))
+        if reset_timeout is not None:
+            self.reset_timeout = max(0.0, float(reset_timeout))
+        if slow_threshold is not None:
+            self.slow_threshold = float(slow_threshold) or None
+
+    @property
+    def is_open(self):
+        return self.state == OPEN
+
+    def available(self):
+        """不改变状态地判断下一次调用是否会被放行，用于在排队或准备请求之前快速失败"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return self._probe_task is None and time.monotonic() - self.opened_at >= self.reset_timeout
+        return not self._trial
+
+    def allow(self):
+        """判断是否放行一次调用，半开状态下只放行一个试探调用"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            # 有后台探测时由探测决定何时关闭
+            if self._probe_task is not None:
+                return False
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            self._trial = False
+        if self._trial:
+            return False
+        self._trial = True
+        return True
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info(f"{self.name} 已恢复，熔断器关闭")
+        self.state = CLOSED
+        self.failures = 0
+        self._trial = False
+        task = self._probe_task
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+            self._probe_task = None
+
+    def record_failure(self, error):
+        self.last_error = f"{type(error).__name__}: {error}"
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.opened_count += 1
+        self._trial = False
+        METRICS.inc("circuit_opened", endpoint=self.name)
+        logger.warning(f"{self.name} 连续失败 {self.failures} 次，熔断 {self.reset_timeout} 秒: {self.last_error}")
+        if self._probe is not None and self._probe_task is None:
+            self._probe_task = asyncio.ensure_future(self._probe_loop())
+
+    async def _probe_loop(self):
+        try:
+            while self.state == OPEN:
+                await asyncio.sleep(self.reset_timeout)
+                start = time.monotonic()
+                try:
+                    await self._probe()
+                except Exception as e:
+                    self.last_error = f"{type(e).__name__}: {e}"
+                    METRICS.inc("circuit_probes", endpoint=self.name, result="failure")
+                    continue
+                if self.slow_threshold and time.monotonic() - start > self.slow_threshold:
+                    METRICS.inc("circuit_probes", endpoint=self.name, result="slow")
+                    continue
+                METRICS.inc("circuit_probes", endpoint=self.name, result="success")
+                self.record_success()
+        finally:
+            if self._probe_task is asyncio.current_task():
+                self._probe_task = None
+
+    async def call(self, func, probe=None):
+        """
+        通过熔断器调用 func
+
+        Args:
+            func: 无参数的异步函数
+            probe: 无参数的异步函数，熔断器打开后在后台调用以探测服务是否恢复
+
+        Returns:
+            func 的返回值
+
+        Raises:
+            CircuitOpenError: 熔断器打开，没有调用 func
+        """
+        if probe is not None:
+            self._probe = probe
+        if not self.allow():
+            METRICS.inc("circuit_rejected", endpoint=self.name)
+            raise CircuitOpenError(f"{self.name} 熔断中")
+        start = time.monotonic()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            # 被取消的试探调用不计入结果，让下一个调用继续试探
+            self._trial = False
+            raise
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        elapsed = time.monotonic() - start
+        if self.slow_threshold and elapsed > self.slow_threshold:
+            self.record_failure(TimeoutError(f"耗时 {elapsed:.1f} 秒，超过 {self.slow_threshold} 秒"))
+        else:
+            self.record_success()
+        return result
+
+    def snapshot(self):
+        """返回熔断器的当前状态，供运维查看"""
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened_count": self.opened_count,
+            "open_seconds": time.monotonic() - self.opened_at if self.state != CLOSED and self.opened_at else 0.0,
+            "last_error": self.last_error,
+        }
+
+    async def close(self):
+        """停止后台探测"""
+        task, self._probe_task = self._probe_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+
+class RetryPolicy:
+    """
+    带抖动的指数退避重试
+
+    第 n 次重试前等待 [0, min(max_delay, base_delay * 2^n)) 之间的随机时间，
+    避免大量调用方在同一时刻重试。只重试 retry_on 中的错误（连接错误和 RetryableError），
+    超时和其他错误直接抛出；熔断器打开后不再重试。
+
+    等待发生在调用方的协程中，需要限速的调用（如图片生成队列）应当让 func 的每次调用都重新排队取令牌。
+    """
+
+    def __init__(self, retries=2, base_delay=0.5, max_delay=8.0, retry_on=(RetryableError, aiohttp.ClientConnectionError)):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+
+    def configure(self, retries=None, base_delay=None, max_delay=None):
+        if retries is not None:
+            self.retries = max(0, int(retries))
+        if base_delay is not None:
+            self.base_delay = max(0.0, float(base_delay))
+        if max_delay is not None:
+            self.max_delay = max(0.0, float(max_delay))
+
+    def backoff(self, attempt):
+        """第 attempt 次重试前的等待时间（秒）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def run(self, func, breaker=None):
+        """
+        调用 func，可重试的错误按退避时间重试
+
+        Args:
+            func: 无参数的异步函数，每次重试都会重新调用
+            breaker: 熔断器，整个重试过程只计入一次成功或失败
+
+        Raises:
+            CircuitOpenError: 熔断器打开，没有调用 func
+        """
+        if breaker is None:
+            return await self._retry(func, None)
+        return await breaker.call(lambda: self._retry(func, breaker))
+
+    async def _retry(self, func, breaker):
+        name = breaker.name if breaker is not None else "外部服务"
+        attempt = 0
+        while True:
+            try:
+                return await func()
+            except self.retry_on as e:
+                # 其他调用已经使熔断器打开时不再重试
+                if attempt >= self.retries or (breaker is not None and breaker.is_open):
+                    raise
+                delay = self.backoff(attempt)
+                attempt += 1
+                METRICS.inc("retries", endpoint=name)
+                logger.info(f"{name} 调用失败，{delay:.2f} 秒后第 {attempt} 次重试: {e}")
+                await asyncio.sleep(delay)
+
+
+# 名称 -> 熔断器，插件内所有外部服务共享
+BREAKERS = {}
+
+# 天气和火山引擎等HTTP接口共用的重试策略
+HTTP_RETRY = RetryPolicy()
+
+# HTTP状态码为这些值时可以重试
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def circuit_breaker(name, **kwargs):
+    """返回指定名称的熔断器，不存在时用 kwargs 创建"""
+    breaker = BREAKERS.get(name)
+    if breaker is None:
+        breaker = BREAKERS[name] = CircuitBreaker(name, **kwargs)
+    return breaker
+
+
+def format_breakers():
+    """格式化所有熔断器的状态，适合在聊天中发送"""
+    names = {CLOSED: "正常", HALF_OPEN: "试探中", OPEN: "熔断中"}
+    lines = []
+    for name, breaker in sorted(BREAKERS.items()):
+        state = breaker.snapshot()
+        line = f"{name}: {names[state['state']]}，连续失败 {state['failures']} 次，累计熔断 {state['opened_count']} 次"
+        if state["state"] != CLOSED:
+            line += f"，已熔断 {state['open_seconds']:.0f} 秒"
+        if state["last_error"]:
+            line += f"\n  最近错误: {state['last_error']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+async def close_breakers():
+    for breaker in BREAKERS.values():
+        await breaker.close()
+
+
+async def with_deadline(awaitable, timeout, name):
+    """
+    在 timeout 秒内等待 awaitable 完成，超时时取消并抛出 asyncio.TimeoutError
+
+    timeout 为None或0时不限时间。
+    """
+    if not timeout:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        METRICS.inc("deadline_exceeded", endpoint=name)
+        raise asyncio.TimeoutError(f"{name} 超过 {timeout} 秒没有返回")
+
+
+async def hedged(func, delay, name):
+    """
+    对冲请求：func 在 delay 秒内没有完成时再调用一次，使用先成功完成的结果，另一次调用被取消
+
+    第一次调用在 delay 秒内失败时不再对冲，直接抛出异常；两次都失败时抛出最后一个异常。
+    delay 为None或0时只调用一次。
+
+    Args:
+        func: 无参数的异步函数，每次调用发起一个独立的请求
+        delay: 发起第二次请求前等待的秒数
+        name: 指标中使用的服务名称
+    """
+    if not delay:
+        return await func()
+    tasks = [asyncio.ensure_future(func())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            METRICS.inc("hedged_requests", endpoint=name)
+            tasks.append(asyncio.ensure_future(func()))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if len(tasks) > 1 and task is tasks[1]:
+                        METRICS.inc("hedge_wins", endpoint=name)
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # 读取一次异常，避免出现"exception was never retrieved"
+                task.exception()
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import uuid
+import queue
+import asyncio
+import logging
+import logging.handlers
+import functools
+import contextvars
+from contextlib import contextmanager
+from astrbot.api import logger
+
+from .metrics import METRICS
+
+# 当前请求的ID和当前所在的span，通过contextvars在协程和其创建的任务之间传递
+_request_id = contextvars.ContextVar("food_request_id", default=None)
+_span_id = contextvars.ContextVar("food_span_id", default=None)
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:12]
+
+
+class Tracer:
+    """
+    记录每个请求各阶段耗时的追踪器
+
+    每个阶段是一个span，包含请求ID、父span、开始时间、耗时、状态和附加属性。
+    span以JSONL格式写入本地文件，文件按大小轮转；写文件在后台线程中进行，不阻塞事件循环。
+    未配置文件路径时只计时，不输出。
+    """
+
+    def __init__(self):
+        self.path = None
+        self._logger = None
+        self._listener = None
+
+    @property
+    def enabled(self):
+        return self._logger is not None
+
+    def configure(self, path, max_bytes=5 * 1024 * 1024, backup_count=3):
+        """
+        设置输出文件
+
+        Args:
+            path: JSONL文件路径，None 表示关闭输出
+            max_bytes: 单个文件的最大字节数，超过后轮转
+            backup_count: 保留的历史文件数量
+        """
+        self.close()
+        if not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+            )
+        except Exception as e:
+            logger.error(f"打开追踪文件失败 {path}: {e}")
+            return
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        records = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(records, handler)
+        self._listener.start()
+
+        self._logger = logging.getLogger(f"food_recommender.trace.{id(self)}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.handlers = [logging.handlers.QueueHandler(records)]
+        self.path = path
+        logger.info(f"请求追踪已开启，输出到: {path}")
+
+    def close(self):
+        """停止后台写入线程，写出剩余的span"""
+        if self._listener is not None:
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+        if self._logger is not None:
+            self._logger.handlers = []
+            self._logger = None
+        self.path = None
+
+    def export(self, record):
+        if self._logger is not None:
+            self._logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        记录一个阶段的耗时
+
+        在 with 块中可以通过返回的字典补充属性，例如 status_code、bytes 等。
+        耗时总会计入性能指标；不在请求中时（没有请求ID）不输出到追踪文件。
+
+        Args:
+            name: 阶段名称
+            **attrs: 附加属性
+        """
+        request_id = _request_id.get()
+        if request_id is None:
+            start = time.perf_counter()
+            try:
+                yield attrs
+            finally:
+                METRICS.observe(name, (time.perf_counter() - start) * 1000)
+            return
+
+        span_id = uuid.uuid4().hex[:8]
+        parent_id = _span_id.get()
+        token = _span_id.set(span_id)
+        started_at = time.time()
+        start = time.perf_counter()
+        status = "ok"
+        error = None
+        try:
+            yield attrs
+        except BaseException as e:
+            status = "cancelled" if isinstance(e, (asyncio.CancelledError, GeneratorExit)) else "error"
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            METRICS.observe(name, duration_ms)
+            try:
+                _span_id.reset(token)
+            except ValueError:
+                # 在异步生成器中跨越了不同的上下文，直接恢复父span
+                _span_id.set(parent_id)
+            record = {
+                "request_id": request_id,
+                "span_id": span_id,
+                "parent_id": parent_id,
+                "name": name,
+                "start": round(started_at, 6),
+                "duration_ms": round(duration_ms, 3),
+                "status": status,
+            }
+            if error:
+                record["error"] = error
+            if attrs:
+                record["attrs"] = attrs
+            self.export(record)
+
+    @contextmanager
+    def request(self, name, request_id=None, **attrs):
+        """
+        开始一个新的请求，生成请求ID并记录整个请求的耗时
+
+        请求内创建的任务会继承请求ID，其中的span都归属于该请求。
+        已经在请求中时（例如一个工具调用了另一个工具），只记录为当前请求中的一个span。
+
+        Args:
+            name: 请求名称，如 recommend_food
+            request_id: 请求ID，默认自动生成
+            **attrs: 附加属性
+        """
+        if _request_id.get() is not None:
+            with self.span(name, **attrs) as span_attrs:
+                yield span_attrs
+            return
+
+        request_id = request_id or new_request_id()
+        token = _request_id.set(request_id)
+        start = time.perf_counter()
+        try:
+            with self.span(name, **attrs) as span_attrs:
+                yield span_attrs
+        finally:
+            try:
+                _request_id.reset(token)
+            except ValueError:
+                _request_id.set(None)
+            logger.info(f"请求 {request_id} {name} 结束，耗时 {time.perf_counter() - start:.2f} 秒")
+
+
+# 插件共享的追踪器，在插件初始化时配置输出文件
+TRACER = Tracer()
+
+
+def span(name, **attrs):
+    """使用共享追踪器记录一个阶段的耗时"""
+    return TRACER.span(name, **attrs)
+
+
+def traced_request(name):
+    """
+    为插件的工具方法（异步生成器）开始一个请求
+
+    被装饰的方法需要以 (self, event, ...) 作为参数，用户ID会作为请求的属性记录。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, event, *args, **kwargs):
+            user_id = self._get_user_id(event) if hasattr(self, '_get_user_id') else None
+            with TRACER.request(name, user_id=user_id):
+                async for result in func(self, event, *args, **kwargs):
+                    yield result
+        return wrapper
+    return decorator
@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from astrbot.api import logger
+
+
+class UserRecord:
+    """单个用户的推荐状态"""
+
+    __slots__ = ("meal_type", "food", "city", "timestamp", "history")
+
+    def __init__(self, history_size, meal_type=None, food=None, city=None, timestamp=0.0, history=()):
+        self.meal_type = meal_type
+        self.food = food
+        self.city = city
+        # 最近一次推荐的时间戳（秒）
+        self.timestamp = timestamp
+        # 最近推荐过的食物，固定长度，超出时自动丢弃最早的
+        self.history = deque(history, maxlen=history_size)
+
+    def to_row(self, user_id):
+        return (user_id, self.meal_type, self.food, self.city, self.timestamp,
+                json.dumps(list(self.history), ensure_ascii=False))
+
+
+class UserStateStore:
+    """
+    有上限、可持久化的用户状态存储
+
+    内存中按最近使用顺序保存最多 max_users 个用户，超出时淘汰最久未使用的用户。
+    设置 db_path 后使用SQLite持久化：写入先在内存中攒批，达到 flush_batch 条
+    或每隔 flush_interval 秒在线程池中一次性写入；被淘汰或重启后再次访问的用户
+    需要先调用 load 在线程池中从数据库加载，get 等同步方法只读取内存。
+    """
+
+    def __init__(self, max_users=10000, history_size=5, db_path=None, flush_interval=5.0, flush_batch=100):
+        """
+        Args:
+            max_users: 内存中最多保存的用户数量
+            history_size: 每个用户保存的历史推荐数量
+            db_path: SQLite数据库路径，None 表示只保存在内存中
+            flush_interval: 定时写入数据库的间隔（秒）
+            flush_batch: 攒够多少条修改后立即写入
+        """
+        self.max_users = max_users
+        self.history_size = history_size
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._records = OrderedDict()
+        # 等待写入数据库的行，user_id -> 行数据
+        self._pending = {}
+        # 已从_pending取出、正在线程池中写入的行
+        self._writing = {}
+        self._write_futures = set()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._flush_task = None
+
+        if self.db_path:
+            self._open_db()
+
+    def __len__(self):
+        return len(self._records)
+
+    def _open_db(self):
+        try:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS user_state ("
+                "user_id TEXT PRIMARY KEY, meal_type TEXT, food TEXT, city TEXT, "
+                "timestamp REAL, history TEXT)"
+            )
+            self._db.commit()
+        except Exception as e:
+            logger.error(f"打开用户状态数据库失败，仅使用内存保存: {e}")
+            self._db = None
+
+    def _record_from_row(self, row):
+        meal_type, food, city, timestamp, history = row
+        return UserRecord(self.history_size, meal_type, food, city, timestamp or 0.0, json.loads(history or "[]"))
+
+    def _unsaved_row(self, user_id):
+        """尚未写入数据库的修改，优先于数据库中的数据"""
+        row = self._pending.get(user_id) or self._writing.get(user_id)
+        return row[1:] if row else None
+
+    def _read_row(self, user_id):
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT meal_type, food, city, timestamp, history FROM user_state WHERE user_id = ?",
+                    (user_id,)
+                ).fetchone()
+        except Exception as e:
+            logger.error(f"读取用户状态失败 {user_id}: {e}")
+            return None
+        return row
+
+    def _put(self, user_id, record):
+        self._records[user_id] = record
+        self._records.move_to_end(user_id)
+        while len(self._records) > self.max_users:
+            # 被淘汰用户的修改已经在_pending中，不会丢失
+            self._records.popitem(last=False)
+
+    def get(self, user_id):
+        """获取内存中的用户记录，不存在时返回None，不访问数据库"""
+        user_id = str(user_id)
+        record = self._records.get(user_id)
+        if record is not None:
+            self._records.move_to_end(user_id)
+            return record
+        row = self._unsaved_row(user_id)
+        if row is not None:
+            record = self._record_from_row(row)
+            self._put(user_id, record)
+        return record
+
+    async def load(self, user_id):
+        """
+        确保用户记录已在内存中，需要时在线程池中从数据库读取，不阻塞事件循环
+
+        在调用 recent_foods、last_recommendation 等同步方法之前调用。
+        """
+        user_id = str(user_id)
+        record = self.get(user_id)
+        if record is not None or self._db is None:
+            return record
+        row = await asyncio.get_running_loop().run_in_executor(None, self._read_row, user_id)
+        # 等待读取期间可能已经有了新的推荐记录，以内存中的为准
+        record = self.get(user_id)
+        if record is None and row is not None:
+            record = self._record_from_row(row)
+            self._put(user_id, record)
+        return record
+
+    def recent_foods(self, user_id):
+        """获取用户最近推荐过的食物列表"""
+        record = self.get(user_id)
+        return list(record.history) if record else []
+
+    def last_recommendation(self, user_id, max_age=None):
+        """
+        获取用户上一次的推荐
+
+        Args:
+            user_id: 用户ID
+            max_age: 最长有效时间（秒），超过时返回None
+
+        Returns:
+            dict: 包含 meal_type、food、city、timestamp 的字典，或None
+        """
+        record = self.get(user_id)
+        if record is None or record.food is None:
+            return None
+        if max_age is not None and time.time() - record.timestamp >= max_age:
+            return None
+        return {
+            'meal_type': record.meal_type,
+            'food': record.food,
+            'city': record.city,
+            'timestamp': record.timestamp
+        }
+
+    def record_recommendation(self, user_id, meal_type, food, city=None):
+        """记录一次推荐，并加入历史"""
+        user_id = str(user_id)
+        record = self.get(user_id)
+        if record is None:
+            record = UserRecord(self.history_size)
+            self._put(user_id, record)
+        record.meal_type = meal_type
+        record.food = food
+        record.city = city
+        record.timestamp = time.time()
+        record.history.append(food)
+
+        if self._db is not None:
+            self._pending[user_id] = record.to_row(user_id)
+            if len(self._pending) >= self.flush_batch:
+                self._flush_in_background()
+
+    def _take_pending(self):
+        """取出等待写入的行，只在事件循环线程中调用"""
+        rows = list(self._pending.values())
+        self._pending = {}
+        return rows
+
+    def _write_in_executor(self):
+        """在事件循环线程中取出数据，在线程池中写入，避免阻塞事件循环"""
+        rows = self._take_pending()
+        for row in rows:
+            self._writing[row[0]] = row
+        future = asyncio.get_running_loop().run_in_executor(None, self._write_rows, rows)
+        self._write_futures.add(future)
+
+        def done(_):
+            self._write_futures.discard(future)
+            for row in rows:
+                # 写入期间同一用户可能又有新的行在写入，只移除本批的
+                if self._writing.get(row[0]) is row:
+                    del self._writing[row[0]]
+
+        future.add_done_callback(done)
+        return future
+
+    def _flush_in_background(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中（例如脚本直接调用）时同步写入
+            self.flush()
+            return
+        self._write_in_executor()
+
+    def flush(self):
+        """把攒下的修改一次性写入数据库"""
+        if self._db is None or not self._pending:
+            return
+        self._write_rows(self._take_pending())
+
+    def _write_rows(self, rows):
+        if self._db is None or not rows:
+            return
+        try:
+            with self._db_lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO user_state (user_id, meal_type, food, city, timestamp, history) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                self._db.commit()
+        except Exception as e:
+            logger.error(f"写入用户状态失败: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._pending:
+                await self._write_in_executor()
+
+    def start(self):
+        """启动定时写入任务，必须在事件循环中调用"""
+        if self._db is not None and self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_loop())
+
+    async def close(self):
+        """停止定时写入，写入剩余修改并关闭数据库"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self._write_futures:
+            await asyncio.gather(*self._write_futures)
+        if self._db is not None:
+            self.flush()
+            with self._db_lock:
+                self._db.close()
+            self._db = None